@@ -0,0 +1,15 @@
+"""Entry point for 'python -m autolung'
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+"""
+import sys
+from pathlib import Path
+
+# the modules in this folder import each other by name, as they do when app.py is run as a script
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from cli import main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,10 +14,11 @@ from PyQt5.QtCore import QThread, pyqtSignal, QObject
 from main_window import Ui_MainWindow
 from load_images import collect
 from load_config import load_settings
-from export import write_output
-from processing import process_img
-from measure import measure_all
-from metadata import extract_metadata
+from export import write_output, open_objects
+from batch import run_batch
+from store import ResultsStore, settings_hash, OBJECTS_NAME, PROFILES_NAME
+from sink import ResultsSink, results_name
+from instrument import Profile, Stage, write_profile
 
 
 class Stream(QObject):
@@ -34,6 +35,7 @@ class Stream(QObject):
 class ProcessingThread(QThread):
     """Create separate processing thread for main analysis function"""
     progress_update = pyqtSignal(int)
+    images_found = pyqtSignal(int)
 
     def __init__(self, imgs_dir, conf_file, prv_choice, outdir):
         QThread.__init__(self)
@@ -45,35 +47,77 @@ class ProcessingThread(QThread):
     def __del__(self):
         self.wait()
 
-    def process_all(self, images, preview, **parameters):
-        """Process images in pipeline"""
-        data = []
-        num_images = len(images)
-        for i, img in enumerate(images, start=1):
-            img_name = Path(img).name
+    def process_all(self, images, preview, save, skipped=0, objects=None, profile=None, **parameters):
+        """Process images in pipeline, spread over 'workers' processes
 
-            print(f"Processing image {i}/{num_images}...")
-            print(f"{img_name}...")
-            p = process_img(img, preview, **parameters)
-            print(f"Measuring airspace statistics on {img_name}...")
-            d = measure_all(p, **parameters)
-            print(f"Extracting metadata from {img_name}...")
-            md = extract_metadata(img, **parameters)
-            print("Done.\n")
+        The results of every image are passed to save(image, data) as soon as the image is
+        finished, its airspace table to objects.append and the time of its stages to
+        profile.add. 'skipped' images were processed before and count towards the progress bar.
+        """
+        num_images = len(images)
 
-            results = {**md, **d}
-            data.append(results)
+        def report(done, result):
+            img_name = Path(result.image).name
+            if profile is not None:
+                profile.add(result.events)
+            if result.error is None:
+                print(f"Finished {img_name} ({done}/{num_images}).\n")
+                save(result.image, result.data)
+                if objects is not None:
+                    objects.append(result.image, result.objects)
+            else:
+                print(f"ERROR: Could not process {img_name} -- skipping image")
+                print(result.error)
 
-            self.progress_update.emit(i)
+            self.progress_update.emit(skipped + done)
 
-        return data
+        run_batch(images, preview, on_result=report, keep_data=False, **parameters)
 
     def run(self):
         """Main image processing pipeline, run when new thread starts"""
         params = load_settings(self.configuration_file)
-        images = collect(self.image_directory)
-        data = self.process_all(images, self.preview_yesNo, **params)
-        write_output(data, self.output_directory)
+        profile = Profile(root=self.image_directory)
+        images = collect(self.image_directory, **params)
+        self.images_found.emit(len(images))
+        if not params['incremental']:
+            # results are streamed to a file as they come in, the workbook is built from it
+            sink = ResultsSink.create(self.output_directory)
+            objects = open_objects(sink.path.with_name(f"{sink.path.stem}_objects"), root=self.image_directory, **params)
+            params['image_dir'] = self.image_directory
+            params['profile_dir'] = str(sink.path.with_name(f"{sink.path.stem}_profiles"))
+            self.process_all(images, self.preview_yesNo, sink.append, objects=objects, profile=profile, **params)
+            sink.close()
+            with Stage("export"):
+                write_output(sink.path, self.output_directory, formats=params['output_formats'])
+            if params['profile']:
+                write_profile(profile, self.output_directory, sink.path.stem)
+            return
+
+        # only process new and changed images, then write the output for the whole study
+        store = ResultsStore(self.output_directory, settings_hash(**params))
+        todo = store.pending(images)
+        objects = open_objects(store.path.with_name(OBJECTS_NAME), root=self.image_directory, **params)
+        if objects is not None:
+            # Objects does not change the results, images processed without it only miss their airspace table
+            pending = set(todo)
+            todo = [img for img in images if img in pending or not objects.has(img)]
+        print(f"{len(images) - len(todo)} of {len(images)} images are already processed with these settings -- skipping them")
+        self.progress_update.emit(len(images) - len(todo))
+        params['image_dir'] = self.image_directory
+        params['profile_dir'] = str(store.path.with_name(PROFILES_NAME))
+        self.process_all(todo, self.preview_yesNo, store.add, skipped=len(images) - len(todo), objects=objects,
+                         profile=profile, **params)
+        data = store.results(images)
+        store.close()
+        if data:
+            # the profile is named after the results it belongs to
+            name = results_name()
+            with Stage("export"):
+                write_output(data, self.output_directory, formats=params['output_formats'], name=name)
+            if params['profile']:
+                write_profile(profile, self.output_directory, name)
+        else:
+            print("ERROR: No results to write")
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -164,8 +208,6 @@ class MainWindow(QtWidgets.QMainWindow):
         """Select the images directory and set text in img_dir text field"""
         self.img_dir = str(QFileDialog.getExistingDirectory(self, "Select Image Directory"))
         self.ui.img_dir_text.setText(self.img_dir)
-        N = len(collect(self.img_dir))  # number of images to be processed
-        self.ui.progressBar.setMaximum(N)
 
     def getConfigFile(self):
         """Select the config file and set text in congfig text field"""
@@ -200,6 +242,8 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.img_dir and self.config_file and self.out_dir:
             self.processing_thread = ProcessingThread(self.img_dir, self.config_file, self.preview_choice, self.out_dir)
             self.processing_thread.progress_update.connect(self.updateProgressBar)
+            # the images are counted by the processing thread, so the folder is only searched once
+            self.processing_thread.images_found.connect(self.ui.progressBar.setMaximum)
             self.processing_thread.finished.connect(self.done)
             self.processing_thread.start()
         else:
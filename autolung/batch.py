@@ -0,0 +1,247 @@
+"""Parallel batch processing engine
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Fans images out to a pool of worker processes. Each worker runs the full pipeline (processing,
+measurement and metadata extraction) on one image at a time. Results are returned in the same
+order as the input images regardless of the order in which the workers finish, and an image
+that fails is reported back instead of stopping the whole batch. When a worker process dies
+(e.g. out of memory) the pool is restarted, and the images it was processing are processed again
+one at a time, so only the image that killed the worker is reported as failed.
+
+The next images are read ahead in background threads while the current one is processed
+(load_images.Prefetcher): decoded to grayscale when images are processed in this process, or
+read into the OS file cache for the worker processes. 'prefetch' images are read ahead, within
+'prefetch_mb' megabytes.
+"""
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+
+from processing import process_img, convert_to_grey, working_dtype
+from load_images import image_shape, Prefetcher, read_ahead
+from tiling import process_img_tiled
+from measure import airspace_properties, measure_all, object_table
+from metadata import extract_metadata
+from qc import flush_qc
+from instrument import Stage, timed, drain
+from profiler import image_profiler
+
+
+BatchResult = namedtuple('BatchResult', ['index', 'image', 'data', 'error', 'objects', 'events'], defaults=(None,))
+
+
+def is_tiled(img, **kwargs):
+    """Return True if an image is processed in tiles ('tile_size' from the config file)"""
+    tile_size = kwargs.get('tile_size')
+
+    return bool(tile_size) and max(image_shape(img)) > tile_size
+
+
+def prefetch_grey(img, **kwargs):
+    """Read an image ahead of processing it, None for tiled images (they are read a tile at a time)"""
+    if is_tiled(img, **kwargs):
+        return None
+    with Stage("grey", img) as s:
+        grey = convert_to_grey(img, **kwargs)
+        s.pixels = grey.size
+
+    return grey
+
+
+def grey_bytes(img, **kwargs):
+    """Return the bytes held by the grayscale image of an image"""
+    rows, cols = image_shape(img)
+
+    return rows * cols * working_dtype(**kwargs).itemsize
+
+
+def process_one(img, preview, grey=None, **kwargs):
+    """Run the whole pipeline on a single image
+
+    Arguments:
+        img {str} -- Path to image to be processed
+        preview {str} -- "Yes" or "No" if QC images should be saved
+
+    Keyword Arguments:
+        grey {ndarray} -- the grayscale image, when it was read ahead (default: {None})
+
+    Returns:
+        tuple -- (metadata and measurements for the image, table of every airspace or None
+                 when 'export_objects' is off)
+    """
+    img_name = Path(img).name
+
+    print(f"{img_name}...")
+    if grey is None and is_tiled(img, **kwargs):
+        p = process_img_tiled(img, preview, **kwargs)
+    else:
+        p = process_img(img, preview, grey=grey, **kwargs)
+    print(f"Measuring airspace statistics on {img_name}...")
+    airspaces = timed("regionprops", img, airspace_properties, p, kwargs.get('tile_size') or None)
+    d = measure_all(p, airspaces, image=img, **kwargs)
+    objects = timed("objects", img, object_table, p, airspaces, **kwargs) if kwargs.get('export_objects') else None
+    print(f"Extracting metadata from {img_name}...")
+    with Stage("metadata", img):
+        md = extract_metadata(img, **kwargs)
+
+    return {**md, **d}, objects
+
+
+def run_one(index, img, preview, grey=None, **kwargs):
+    """Process a single image, capturing any error instead of raising it
+
+    Arguments:
+        index {int} -- position of the image in the batch
+        img {str} -- Path to image to be processed
+        preview {str} -- "Yes" or "No" if QC images should be saved
+
+    Keyword Arguments:
+        grey {ndarray} -- the grayscale image, when it was read ahead (default: {None})
+
+    Returns:
+        BatchResult -- (index, image, data, error, objects, events) where error is None on success and events
+                       are the stages recorded (instrument.StageEvent) since the last image
+    """
+    try:
+        with image_profiler(index, img, **kwargs):
+            data, objects = process_one(img, preview, grey=grey, **kwargs)
+        error = None
+    except Exception:
+        data = objects = None
+        error = traceback.format_exc()
+
+    return BatchResult(index, img, data, error, objects, drain())
+
+
+def run_pool(func, jobs, workers, collect, failure, initializer=None):
+    """Run jobs on a pool of worker processes, recovering from workers that die
+
+    At most workers + 1 jobs are in flight, so jobs is only iterated as workers free up. When a
+    worker process dies (e.g. out of memory) the pool is restarted, and the jobs it was running are
+    run again one at a time, so only the job that killed the worker is reported as failed.
+
+    Arguments:
+        func {callable} -- run as func(index, item) in a worker process, must be picklable
+        jobs {iterable} -- (index, item) of every job
+        workers {int} -- number of worker processes
+        collect {callable} -- called as collect(n_done, result) for every finished job
+        failure {callable} -- failure(index, item, error) returns the result of a job that raised, error is the traceback
+
+    Keyword Arguments:
+        initializer {callable} -- run once in every worker process on start up (default: {None})
+    """
+    futures = {}
+    # jobs in flight when a worker process died, the pool cannot tell which one killed it
+    lost = []
+    done = 0
+
+    def finish(finished):
+        nonlocal done
+        for future in finished:
+            i, item = futures.pop(future)
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                lost.append((i, item))
+                continue
+            except Exception:
+                result = failure(i, item, traceback.format_exc())
+            done += 1
+            collect(done, result)
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+    try:
+        for i, item in jobs:
+            while True:
+                try:
+                    if len(futures) > workers:
+                        finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        finish(finished)
+                    futures[pool.submit(func, i, item)] = (i, item)
+                    break
+                except BrokenProcessPool:
+                    # a worker process died - the jobs in flight are retried below
+                    print("WARNING: A worker process died -- restarting the workers")
+                    finish(as_completed(list(futures)))
+                    pool.shutdown(wait=True)
+                    pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+        finish(as_completed(list(futures)))
+    finally:
+        pool.shutdown(wait=True)
+
+    # retry the jobs lost with a dead worker one at a time, so a crash is reported for the job that caused it
+    single = None
+    for i, item in sorted(lost, key=lambda job: job[0]):
+        if single is None:
+            single = ProcessPoolExecutor(max_workers=1, initializer=initializer)
+        try:
+            result = single.submit(func, i, item).result()
+        except Exception:
+            # the worker process itself died - report it like any other failure
+            result = failure(i, item, traceback.format_exc())
+            single.shutdown(wait=True)
+            single = None
+        done += 1
+        collect(done, result)
+    if single is not None:
+        single.shutdown(wait=True)
+
+
+def run_batch(images, preview, workers=1, on_result=None, initializer=None, keep_data=True, **kwargs):
+    """Process a batch of images, optionally spread over a pool of worker processes
+
+    With workers=1 every image is processed in the calling process, one after the other.
+    Otherwise images are submitted to a process pool and collected as they complete.
+
+    Arguments:
+        images {list} -- image paths to process
+        preview {str} -- "Yes" or "No" if QC images should be saved
+
+    Keyword Arguments:
+        workers {int} -- number of worker processes (default: {1})
+        on_result {callable} -- called as on_result(n_done, result) after every image (default: {None})
+        initializer {callable} -- run once in every worker process on start up (default: {None})
+        keep_data {bool} -- keep the data (objects and events) of every image in the returned results, False when on_result
+                            saves it, so memory does not grow with the number of images (default: {True})
+
+    Returns:
+        list -- BatchResult for every image, in the same order as images
+    """
+    results = [None] * len(images)
+
+    def collect_result(done, result):
+        if on_result is not None:
+            on_result(done, result)
+        results[result.index] = result if keep_data else result._replace(data=None, objects=None, events=None)
+
+    depth = kwargs.get('prefetch', 2)
+    max_bytes = kwargs.get('prefetch_mb', 512) * 2**20
+
+    if workers <= 1 or len(images) <= 1:
+        ahead = iter(Prefetcher(images, partial(prefetch_grey, **kwargs), size=partial(grey_bytes, **kwargs),
+                                depth=depth, max_bytes=max_bytes))
+        for i in range(len(images)):
+            # time spent waiting for the image that was not hidden by reading it ahead
+            with Stage("load") as s:
+                img, grey = next(ahead)
+                s.image = img
+            print(f"Processing image {i + 1}/{len(images)}...")
+            # an image that could not be read ahead (grey is None) is read, and its error reported, by run_one
+            collect_result(i + 1, run_one(i, img, preview, grey=grey, **kwargs))
+            del grey
+        # QC images are saved in the background - wait for the last ones
+        flush_qc()
+
+        return results
+
+    # images are submitted as workers free up, so the files read ahead are the next ones processed
+    jobs = ((i, img) for i, (img, _) in enumerate(Prefetcher(images, read_ahead, depth=depth, max_bytes=max_bytes)))
+    run_pool(partial(run_one, preview=preview, **kwargs), jobs, min(workers, len(images)), collect_result,
+             lambda i, img, error: BatchResult(i, img, None, error, None), initializer=initializer)
+    # the workers save their last QC images before they exit, the pool waits for them (qc.qc_writer)
+
+    return results
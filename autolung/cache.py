@@ -0,0 +1,219 @@
+"""On-disk cache of intermediate processing stages
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Every stage of process_img (contrast enhanced image, threshold surface, binary and labeled
+image) is saved as a compressed .npz file named after a hash of the image contents and
+of the settings that affect that stage and the stages before it. Re-running a study with a
+different Constant only compares the cached contrast enhanced image with the cached threshold
+surface, a different Min_Alveolar_Size only repeats the morphology and labeling, and unchanged
+settings load the labeled image directly.
+
+The cache is limited in size; the least recently used files are removed first.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from load_images import file_digest
+
+
+# change when the output of a stage changes for the same settings, to invalidate old files
+CACHE_VERSION = 3
+
+# settings each stage depends on, in processing order
+STAGE_PARAMS = (("grey", ("grey_channel", "precision")),
+                ("surface", ("block_size", "method", "threshold_engine", "precision")),
+                ("binary", ("constant",)),
+                ("labeled", ("min_alv_size", "max_speckle_size")))
+# earlier stages a stage needs besides the one before it, passed to its function after that one
+STAGE_INPUTS = {"binary": ("grey",)}
+
+
+def stage_keys(img, **kwargs):
+    """Return the cache key of every stage for an image
+
+    The key of a stage includes the key of the previous stage, so changing a setting
+    invalidates that stage and every stage after it.
+
+    Arguments:
+        img {str} -- Path to the image
+
+    Returns:
+        dict -- cache key (hex string) for every stage name
+    """
+    key = f"{CACHE_VERSION}:{file_digest(img)}"
+    keys = {}
+    for stage, params in STAGE_PARAMS:
+        settings = json.dumps({p: kwargs.get(p) for p in params}, sort_keys=True, default=str)
+        key = hashlib.sha1(f"{key}:{stage}:{settings}".encode()).hexdigest()
+        keys[stage] = key
+
+    return keys
+
+
+class StageCache:
+    """Directory of cached stage outputs with a size limit
+
+    Arguments:
+        cache_dir {str} -- directory the files are kept in
+
+    Keyword Arguments:
+        max_bytes {int} -- total size of the cache before old files are removed (default: {2 GB})
+    """
+    def __init__(self, cache_dir, max_bytes=2 * 1024**3):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.npz"
+
+    def load(self, key):
+        """Return the cached array for key, or None if it is not cached
+
+        Arguments:
+            key {str} -- cache key
+
+        Returns:
+            ndarray -- cached array or None
+        """
+        path = self.path(key)
+        try:
+            with np.load(str(path)) as f:
+                array = f['array']
+            # mark as recently used
+            os.utime(str(path))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # unreadable (e.g. partially written by a process that was killed) - recompute it
+            print(f"WARNING: Could not read cached stage '{path.name}' ({e!r}) -- recomputing")
+            self.remove(path)
+            return None
+
+        return array
+
+    def save(self, key, array):
+        """Add an array to the cache, then shrink the cache to its size limit
+
+        The file is written under a temporary name and renamed, so other processes never
+        read a partially written file.
+
+        Arguments:
+            key {str} -- cache key
+            array {ndarray} -- array to cache
+        """
+        fd, tmp = tempfile.mkstemp(dir=str(self.cache_dir), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, array=np.asarray(array))
+            os.replace(tmp, str(self.path(key)))
+        except OSError as e:
+            print(f"WARNING: Could not write to the cache ({e!r})")
+            self.remove(Path(tmp))
+            return
+
+        self.evict()
+
+    def remove(self, path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def evict(self):
+        """Remove the least recently used files until the cache fits in max_bytes"""
+        entries = []
+        for entry in os.scandir(str(self.cache_dir)):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(Path(path))
+            total -= size
+
+
+def open_cache(**kwargs):
+    """Return the stage cache configured in the settings
+
+    Returns:
+        StageCache -- the cache, or None if no Cache_Dir is set
+    """
+    cache_dir = kwargs.get('cache_dir')
+    if not cache_dir:
+        return None
+
+    return StageCache(cache_dir, max_bytes=int(float(kwargs.get('cache_size_mb', 2048)) * 1024**2))
+
+
+def run_stages(img, stages, cache=None, keep_all=False, **kwargs):
+    """Run the processing stages of an image, resuming from the cache
+
+    Without keep_all only the last cached stage is loaded (with the earlier stages in STAGE_INPUTS
+    of the stages after it) and the stages after it are computed. With keep_all every stage's
+    output is loaded or computed (e.g. for the QC image).
+
+    Arguments:
+        img {str} -- Path to the image
+        stages {list} -- (name, message, func) for every stage in STAGE_PARAMS order, func takes
+                         the previous stage's output (None for the first stage), then the outputs
+                         of its STAGE_INPUTS
+
+    Keyword Arguments:
+        cache {StageCache} -- cache to use, None to compute every stage (default: {None})
+        keep_all {bool} -- return the output of every stage, not only the last (default: {False})
+
+    Returns:
+        list -- output of every stage (None for stages that were skipped)
+    """
+    outputs = [None] * len(stages)
+    names = [stage[0] for stage in stages]
+    keys = stage_keys(img, **kwargs) if cache is not None else {}
+
+    first = 0
+    previous = None
+    if cache is not None and not keep_all:
+        # resume after the last stage that is cached, if the inputs of the stages after it are cached too
+        for i in reversed(range(len(stages))):
+            needed = [names.index(n) for stage in names[i + 1:] for n in STAGE_INPUTS.get(stage, ())]
+            needed = sorted({j for j in needed if j < i}) + [i]
+            loaded = []
+            for j in needed:
+                output = cache.load(keys[names[j]])
+                if output is None:
+                    break
+                loaded.append((j, output))
+            if len(loaded) < len(needed):
+                continue
+            for j, output in loaded:
+                print(f"Loaded {names[j]} image from cache")
+                outputs[j] = output
+            previous = outputs[i]
+            first = i + 1
+            break
+
+    for i in range(first, len(stages)):
+        name, message, func = stages[i]
+        output = cache.load(keys[name]) if cache is not None and keep_all else None
+        if output is None:
+            print(message)
+            output = func(previous, *(outputs[names.index(n)] for n in STAGE_INPUTS.get(name, ())))
+            if cache is not None:
+                cache.save(keys[name], output)
+        else:
+            print(f"Loaded {name} image from cache")
+        outputs[i] = previous = output
+
+    return outputs
@@ -0,0 +1,289 @@
+"""Headless command line interface
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Runs the same pipeline as the GUI without importing Qt, so it can be used on machines without a display:
+
+    python -m autolung run --images DIR --config FILE --out DIR --workers 4
+
+and sweeps the thresholding and morphology settings over a set of images (see sweep.py):
+
+    python -m autolung sweep --images DIR --config FILE --out DIR --grid Block_Size=151:351:50 --grid Constant=0,0.01
+
+Progress is written to stdout as one JSON object per line. Every other message is written to stderr.
+The exit code is non-zero when any image failed or nothing could be processed.
+"""
+import argparse
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+
+from load_images import collect
+from load_config import load_settings, validate_settings
+from export import write_output, open_objects
+from batch import run_batch
+from store import ResultsStore, settings_hash, OBJECTS_NAME, PROFILES_NAME
+from sink import ResultsSink, read_sink, results_name
+from instrument import Profile, Stage, write_profile
+from sweep import read_grid, combinations, run_sweep, write_sweep
+
+
+EXIT_OK = 0
+EXIT_IMAGES_FAILED = 1
+EXIT_USAGE = 2
+EXIT_NO_RESULTS = 3
+
+
+def emit(stream, event, **fields):
+    """Write a single progress event as a line of JSON
+
+    Arguments:
+        stream {file} -- stream to write the event to
+        event {str} -- name of the event
+    """
+    stream.write(json.dumps({"event": event, **fields}) + "\n")
+    stream.flush()
+
+
+def log_to_stderr():
+    """Send pipeline messages to stderr so stdout only carries progress events"""
+    sys.stdout = sys.stderr
+
+
+def run(args, stream=None):
+    """Run the image processing pipeline on a directory of images
+
+    Arguments:
+        args {argparse.Namespace} -- parsed command line arguments
+
+    Keyword Arguments:
+        stream {file} -- stream progress events are written to (default: {None}, sys.stdout when the command runs)
+
+    Returns:
+        int -- exit code
+    """
+    stream = stream or sys.stdout
+    for name, path, check in (("images", args.images, os.path.isdir),
+                              ("config", args.config, os.path.isfile),
+                              ("out", args.out, os.path.isdir),
+                              ("resume", args.resume or args.out, os.path.exists)):
+        if not check(path):
+            emit(stream, "error", message=f"--{name} '{path}' does not exist")
+            return EXIT_USAGE
+
+    try:
+        with redirect_stdout(sys.stderr):
+            params = load_settings(args.config)
+            # command line options override the config file
+            overrides = {"workers": args.workers, "profile_every": args.profile_every, "profiler": args.profiler}
+            if args.profile_images is not None:
+                overrides["profile_images"] = tuple(p.strip() for p in args.profile_images.split(',') if p.strip())
+            overrides = {k: v for k, v in overrides.items() if v is not None}
+            if overrides:
+                params = validate_settings(**{**params, **overrides})
+            if args.incremental:
+                params["incremental"] = True
+            if args.manifest is not None:
+                params["manifest"] = args.manifest
+    except Exception as e:
+        emit(stream, "error", message=f"Could not read configuration file: {e!r}")
+        return EXIT_USAGE
+
+    with redirect_stdout(sys.stderr):
+        study = collect(args.images, **params)
+    if not study:
+        emit(stream, "start", images=0, skipped=0, workers=params['workers'])
+        emit(stream, "error", message=f"No images found in '{args.images}'")
+        return EXIT_NO_RESULTS
+
+    if params['incremental']:
+        # only process new and changed images, the output covers the whole study
+        store = ResultsStore(args.out, settings_hash(**params))
+        images = store.pending(study)
+        save = store.add
+    else:
+        # results are streamed to a file as they come in - a killed run can be resumed from it
+        if args.resume:
+            finished = {row["image"] for row in read_sink(args.resume)}
+            images = [img for img in study if str(img) not in finished]
+            store = ResultsSink(args.resume)
+        else:
+            images = study
+            store = ResultsSink.create(args.out)
+        save = store.append
+    objects_dir = store.path.with_name(OBJECTS_NAME if params['incremental'] else f"{store.path.stem}_objects")
+    params['image_dir'] = args.images
+    params['profile_dir'] = str(store.path.with_name(PROFILES_NAME if params['incremental'] else f"{store.path.stem}_profiles"))
+    with redirect_stdout(sys.stderr):
+        objects = open_objects(objects_dir, root=args.images, **params)
+    if params['incremental'] and objects is not None:
+        # Objects does not change the results, images processed without it only miss their airspace table
+        todo = set(images)
+        images = [img for img in study if img in todo or not objects.has(img)]
+    num_images = len(images)
+    profile = Profile(root=args.images)
+    emit(stream, "start", images=num_images, skipped=len(study) - num_images, workers=params['workers'])
+
+    def report(done, result):
+        fields = {"done": done, "total": num_images, "image": str(result.image)}
+        profile.add(result.events)
+        if result.error is None:
+            save(result.image, result.data)
+            if objects is not None:
+                objects.append(result.image, result.objects)
+            emit(stream, "image", status="ok", **fields)
+        else:
+            emit(stream, "image", status="error", error=result.error.strip().splitlines()[-1], **fields)
+            print(result.error)
+
+    preview = "Yes" if args.qc else "No"
+    with redirect_stdout(sys.stderr):
+        results = run_batch(images, preview, on_result=report, initializer=log_to_stderr, keep_data=False, **params)
+        failed = [str(r.image) for r in results if r.error is not None]
+        if params['incremental']:
+            data = store.results(study)
+            processed = len(data)
+            name = results_name()
+        else:
+            data = store.path
+            processed = len(read_sink(data))
+            name = data.stem
+        store.close()
+        if not processed:
+            emit(stream, "finish", output=None, processed=0, failed=len(failed))
+            return EXIT_NO_RESULTS
+
+        with Stage("export"):
+            files = write_output(data, args.out, formats=params['output_formats'], name=name)
+        # the profile is named after the results it belongs to
+        profile_path = write_profile(profile, args.out, name) if params['profile'] else None
+
+    emit(stream, "finish", output=files[0] if files else None, files=files, processed=processed, failed=len(failed),
+         profile=str(profile_path) if profile_path else None)
+
+    return EXIT_IMAGES_FAILED if failed else EXIT_OK
+
+
+def sweep(args, stream=None):
+    """Measure a directory of images with every combination of the swept settings
+
+    Arguments:
+        args {argparse.Namespace} -- parsed command line arguments
+
+    Keyword Arguments:
+        stream {file} -- stream progress events are written to (default: {None}, sys.stdout when the command runs)
+
+    Returns:
+        int -- exit code
+    """
+    stream = stream or sys.stdout
+    for name, path, check in (("images", args.images, os.path.isdir),
+                              ("config", args.config, os.path.isfile),
+                              ("out", args.out, os.path.isdir)):
+        if not check(path):
+            emit(stream, "error", message=f"--{name} '{path}' does not exist")
+            return EXIT_USAGE
+
+    try:
+        with redirect_stdout(sys.stderr):
+            params = load_settings(args.config)
+            if args.workers is not None:
+                params = validate_settings(**{**params, "workers": args.workers})
+            grid = read_grid(args.config, args.grid or ())
+    except Exception as e:
+        emit(stream, "error", message=f"Could not read the configuration file or --grid: {e!r}")
+        return EXIT_USAGE
+    combos = combinations(grid, **params)
+
+    with redirect_stdout(sys.stderr):
+        images = collect(args.images, **params)
+    if not images:
+        emit(stream, "error", message=f"No images found in '{args.images}'")
+        return EXIT_NO_RESULTS
+    emit(stream, "start", images=len(images), combinations=len(combos), workers=params['workers'])
+
+    def report(done, result):
+        fields = {"done": done, "total": len(images), "image": str(result.image)}
+        if result.error is None:
+            emit(stream, "image", status="ok", **fields)
+        else:
+            emit(stream, "image", status="error", error=result.error.strip().splitlines()[-1], **fields)
+            print(result.error)
+
+    with redirect_stdout(sys.stderr):
+        results = run_sweep(images, combos, on_result=report, initializer=log_to_stderr, **params)
+        failed = [str(r.image) for r in results if r.error is not None]
+        if len(failed) == len(results):
+            emit(stream, "finish", output=None, processed=0, failed=len(failed))
+            return EXIT_NO_RESULTS
+        files = write_sweep(results, combos, args.out, formats=params['output_formats'])
+
+    emit(stream, "finish", output=files[0] if files else None, files=files, processed=len(results) - len(failed),
+         failed=len(failed))
+
+    return EXIT_IMAGES_FAILED if failed else EXIT_OK
+
+
+def build_parser():
+    """Build the command line argument parser
+
+    Returns:
+        argparse.ArgumentParser -- parser for all autolung commands
+    """
+    parser = argparse.ArgumentParser(prog="autolung", description="Automated lung morphometry")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run", help="process a directory of images")
+    run_parser.add_argument("--images", required=True, help="directory containing the .tif images")
+    run_parser.add_argument("--config", required=True, help="configuration (.ini) file for this image set")
+    run_parser.add_argument("--out", required=True, help="directory the results are written to")
+    run_parser.add_argument("--workers", type=int, help="number of worker processes, 0 uses every core "
+                            "(default: [Processing_Params] Workers from the config file)")
+    run_parser.add_argument("--qc", action="store_true", help="save QC images next to the input images")
+    run_parser.add_argument("--resume", metavar="JSONL", help="continue an interrupted run from its results "
+                            "file (Lung_Data_<timestamp>.jsonl in --out), skipping the images already in it")
+    run_parser.add_argument("--incremental", action="store_true", help="only process images that are new or changed "
+                            "since the last run into --out (default: [Processing_Params] Incremental from the config file)")
+    run_parser.add_argument("--manifest", metavar="FILE", help="save the list of images to FILE (relative to --images) "
+                            "and reuse it while no folder changed (default: [Processing_Params] Manifest from the config file)")
+    run_parser.add_argument("--profile-every", type=int, metavar="N", help="profile the processing of every N-th image "
+                            "(default: [Output_Params] Profile_Every from the config file)")
+    run_parser.add_argument("--profile-images", metavar="PATTERNS", help="profile the images whose file names match "
+                            "these patterns, separated by commas (default: [Output_Params] Profile_Images)")
+    run_parser.add_argument("--profiler", choices=("cprofile", "sampling"), help="cProfile (.prof) or sampled stacks "
+                            "(.folded, for flame graphs) (default: [Output_Params] Profiler)")
+    run_parser.set_defaults(func=run)
+
+    sweep_parser = commands.add_parser("sweep", help="measure a directory of images with every combination of settings")
+    sweep_parser.add_argument("--images", required=True, help="directory containing the .tif images")
+    sweep_parser.add_argument("--config", required=True, help="configuration (.ini) file, its [Sweep] section "
+                              "gives the values of the swept settings")
+    sweep_parser.add_argument("--out", required=True, help="directory the results are written to")
+    sweep_parser.add_argument("--grid", action="append", metavar="KEY=VALUES", help="values of a setting "
+                              "(Block_Size, Method, Constant, Min_Alveolar_Size or Max_Speckle_Size), separated by "
+                              "commas and/or as start:stop:step ranges, e.g. Block_Size=151:351:50 (repeatable)")
+    sweep_parser.add_argument("--workers", type=int, help="number of worker processes, 0 uses every core "
+                              "(default: [Processing_Params] Workers from the config file)")
+    sweep_parser.set_defaults(func=sweep)
+
+    return parser
+
+
+def main(argv=None):
+    """Parse the command line and run the selected command
+
+    Keyword Arguments:
+        argv {list} -- command line arguments (default: {None}, uses sys.argv)
+
+    Returns:
+        int -- exit code
+    """
+    args = build_parser().parse_args(argv)
+
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
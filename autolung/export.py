@@ -1,111 +1,441 @@
-"""Writes data to Excel spreadsheet
+"""Writes data to Excel spreadsheet and columnar files
 
 (c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
 
-Collects metadata and measurements and writes to Excel.
+Collects metadata and measurements and writes them with one or more exporters, selected in
+[Output_Params] Formats:
+
+- excel: the Excel workbook (one sheet per table, with a comment describing every column)
+- parquet: one compressed Parquet file per table (requires pyarrow)
+- feather: one Feather (Arrow IPC) file per table (requires pyarrow)
+- csv: one CSV file per table
+
+Every file is named after the run, e.g. Lung_Data_yyyymmdd-hhmmss.xlsx or
+Lung_Data_yyyymmdd-hhmmss_raw.parquet.
+
+With [Output_Params] Objects the table of every airspace (measure.object_table) is also written,
+as a Parquet dataset partitioned by image: <dataset>/image=<path>/part-0.parquet, where <path> is
+the path of the image relative to the image folder, quoted (so images of the same name in different
+subfolders get their own partition). The file of an image is written as soon as the image is
+measured and replaced when the image is processed again.
 """
-import time
 import os
+import tempfile
+from pathlib import Path
+from urllib.parse import quote, unquote
 
+import numpy as np
 import pandas as pd
 
+from sink import read_sink, results_name
+from load_images import image_key
+
+
+RAW_COLUMNS = ["FileName", "Animal_id", "Location", "Img_num", "Species", "Magnification", "Fixed_Field",  "Scale(px/um)",
+               "Image_Width(um)", "Image_Height(um)","Obj_Num", "Mean_Area(sq_um)", "Stdev_Area(sq_um)", "Mean_Dia(um)",
+               "Mean_Per(um)", "Total_Airspace_Area(sq_um)", "Total_Tissue_Area(sq_um)", "EXP", "Lm(um)", "D0", "D1", "D2"]
+GROUPED_COLUMNS = RAW_COLUMNS[1:]
+GROUP_KEYS = ["Animal_id", "Location", "Species", "Magnification", "Fixed_Field"]
+
+# measurements summarized per group, and the statistics computed for every one of them
+MEASURE_COLUMNS = RAW_COLUMNS[RAW_COLUMNS.index("Obj_Num"):]
+SUMMARY_STATS = ("mean", "std", "sem", "count", "median")
+# column suffix of every statistic in the summary table
+STAT_NAMES = {"mean": "mean", "std": "sd", "sem": "sem", "count": "n", "median": "median"}
+
+# pooled means over the images of a group, weighted by the number of airspaces in each image
+WEIGHTED_COLUMNS = {"Lm(um)": "Obj_Num", "Mean_Area(sq_um)": "Obj_Num",
+                    "Mean_Dia(um)": "Obj_Num", "Mean_Per(um)": "Obj_Num"}
+
+# columns holding text - everything else is numeric
+TEXT_COLUMNS = ("FileName", "Animal_id", "Location", "Species", "Magnification", "Fixed_Field", "Method")
+
+COLUMN_COMMENTS = {
+    "FileName": 'FileName of the processed image',
+    "Animal_id": 'Animal ID - derived from the first field of the FileName',
+    "Location": 'Location - derived from the second field of the FileName',
+    "Img_num": 'Image Number - image Number derived from the third field of the FileName',
+    "Species": 'Species - Species label obtained from the config_file [Image_metadata]',
+    "Magnification": 'Magnification  - Magnification of the objective obtained from the config_file [Image_metadata]',
+    "Fixed_Field": 'Fixed Field - Size of the fixed field (image) in pixels. Obtained from the config_file [Image_metadata]',
+    "Scale(px/um)": 'Scale - Scale of the image in pixels/micrometer',
+    "Image_Width(um)": 'Image Width - Width of the image in micrometers',
+    "Image_Height(um)": 'Image Height - Height of the image in micrometers',
+    "Obj_Num": 'Object Number - The number of unique airspaces counted in the image',
+    "Mean_Area(sq_um)": 'Mean Area - The mean area of an airspace in the image given in square micrometers',
+    "Stdev_Area(sq_um)": 'Stdev Area - The standard deviation of the mean area of the airspaces in the image given in square micrometers',
+    "Mean_Dia(um)": 'Mean Diameter - The mean of the equivalent diameters of the airspaces in the image given in micrometers',
+    "Mean_Per(um)": 'Mean Perimeter - The mean of the perimeters of the airspaces in the image given in micrometers',
+    "Total_Airspace_Area(sq_um)": 'Total Airspace Area - The total area of the airspaces in the image given in square micrometers',
+    "Total_Tissue_Area(sq_um)": 'Total Tissue Area - The total area of the tissue in the image given in square micrometers',
+    "EXP": 'Expansion Index (EXP) - Calculated as (Airspace_Area:Tissue_Area) * 100',
+    "Lm(um)": 'Mean linear Intercept (Lm) - Mean Linear Intercept estimate given in micrometers',
+    "D0": 'D0 Index - A weighted mean of the equivalent diameter. Measured in micrometers. Note: D0 is equivalent to Mean_Dia(um)',
+    "D1": 'D1 index - A weighted mean of the equivalent diameter. Measured in micrometers. D1 is a function of the mean and the variance of the airspace diameters',
+    "D2": 'D2 Index - A weighted mean of the equivalent diameter. Measured in micrometers. D2 is a function of the mean, variance, and skew of the airspace diameters',
+}
+
+# sheet name of every table in the Excel workbook
+SHEET_NAMES = {"raw": "Raw Data", "grouped": "Grouped Averages", "summary": "Summary"}
+
+# description of the statistic columns of the summary table, added to the comment of the measurement
+STAT_COMMENTS = {"mean": "mean of the images in the group",
+                 "sd": "standard deviation of the images in the group",
+                 "sem": "standard error of the mean of the images in the group",
+                 "n": "number of images in the group with this measurement",
+                 "median": "median of the images in the group",
+                 "weighted": "mean of the images in the group weighted by their Obj_Num (number of airspaces)"}
+
+# rows per Excel sheet, including the header
+EXCEL_MAX_ROWS = 1048576
+
+
+def summarize(raw_df, keys=GROUP_KEYS, stats=SUMMARY_STATS, weights=WEIGHTED_COLUMNS):
+    """Summarize the measurements of every group of images
+
+    The images are grouped once, on the key columns as categoricals, and every statistic is a
+    vectorized aggregation over that grouping. Every measurement gets the statistics in 'stats';
+    the remaining numeric columns of the grouped table only their mean. The SEM is derived from
+    the SD and count instead of another pass over the data. Columns in 'weights' also get a
+    weighted mean, e.g. Lm weighted by the number of airspaces in each image:
+    sum(Lm * Obj_Num) / sum(Obj_Num) over the images of the group.
+
+    Arguments:
+        raw_df {pd.DataFrame} -- measurements of every image, one row per image
+
+    Keyword Arguments:
+        keys {list} -- columns to group by (default: {GROUP_KEYS})
+        stats {tuple} -- statistics of every measurement, keys of STAT_NAMES (default: {SUMMARY_STATS})
+        weights {dict} -- column -> column it is weighted by (default: {WEIGHTED_COLUMNS})
+
+    Returns:
+        tuple -- (mean of every column per group as in GROUPED_COLUMNS,
+                  statistics of every measurement per group as '<column>_<stat>' columns)
+    """
+    measures = [c for c in MEASURE_COLUMNS if c in raw_df.columns]
+    others = [c for c in GROUPED_COLUMNS if c not in keys and c not in measures]
+    values = raw_df[measures + others]
+    text = [c for c in values.columns if not pd.api.types.is_numeric_dtype(values[c])]
+    if text:
+        values = values.assign(**{c: pd.to_numeric(values[c], errors='coerce') for c in text})
+
+    # weighted means are the group sums of value * weight divided by the group sums of weight,
+    # counting the weight only where the value is known
+    products = {}
+    for col, weight in weights.items():
+        w = values[weight].where(values[col].notna())
+        products[f"{col}_x_w"] = values[col] * w
+        products[f"{col}_w"] = w
+    values = values.assign(**products)
+
+    grouped_values = values.groupby([pd.Categorical(raw_df[k]) for k in keys], observed=True, sort=True)
+    means = grouped_values[measures + others].mean()
+    means.index = means.index.set_names(keys)
+    results = {"mean": means}
+    if "std" in stats or "sem" in stats:
+        results["std"] = grouped_values[measures].std()
+    if "count" in stats or "sem" in stats:
+        results["count"] = grouped_values[measures].count()
+    if "sem" in stats:
+        results["sem"] = results["std"] / np.sqrt(results["count"])
+    if "median" in stats:
+        results["median"] = grouped_values[measures].median()
+    sums = grouped_values[list(products)].sum(min_count=1)
+
+    columns = {f"{col}_{STAT_NAMES[stat]}": results[stat][col].to_numpy() for col in measures for stat in stats}
+    for col in weights:
+        columns[f"{col}_weighted"] = (sums[f"{col}_x_w"] / sums[f"{col}_w"]).to_numpy()
+    summary = pd.DataFrame(columns, index=means.index).reset_index()
+    grouped = means.reset_index()[GROUPED_COLUMNS]
+
+    return grouped, summary
+
 
 def group_and_summarize(data_list):
     """Groups and summarizes the data
-    
+
     Arguments:
         data_list {list} -- list of the data returned from image processing
-    
+
     Returns:
-        [tuple] -- (raw data collected from each image, grouped data based on image metadata)
+        [tuple] -- (raw data collected from each image, grouped data based on image metadata,
+                    summary statistics of every group)
     """
-    raw_df = pd.DataFrame(data_list)
-    grouped_df = raw_df.groupby(['Animal_id', 'Location', 'Species', 'Magnification', 'Fixed_Field']).mean().reset_index()
+    raw_df = pd.DataFrame(data_list, columns=RAW_COLUMNS)
 
-    # sort data sheets - if can't, not important - pass
+    # image numbers are missing (NaN) where the file name could not be split - sorted last
     try:
         raw_df = raw_df.sort_values(['Animal_id', 'Location', 'Img_num'], ascending=[True, True, True])
-        grouped_df = grouped_df.sort_values(['Animal_id', 'Location', 'Img_num'], ascending=[True, True, True])
-    except:
-        print("Raw data could not be sorted - ignoring group operation")
-
-    # Rearrange order of columns
-    raw_df = raw_df[["FileName", "Animal_id", "Location", "Img_num", "Species", "Magnification", "Fixed_Field",  "Scale(px/um)", 
-                    "Image_Width(um)", "Image_Height(um)","Obj_Num", "Mean_Area(sq_um)", "Stdev_Area(sq_um)", "Mean_Dia(um)", 
-                    "Mean_Per(um)", "Total_Airspace_Area(sq_um)", "Total_Tissue_Area(sq_um)", "EXP", "Lm(um)", "D0", "D1", "D2"]]
-    grouped_df = grouped_df[["Animal_id", "Location", "Img_num", "Species", "Magnification", "Fixed_Field",  "Scale(px/um)", 
-                    "Image_Width(um)", "Image_Height(um)","Obj_Num", "Mean_Area(sq_um)", "Stdev_Area(sq_um)", "Mean_Dia(um)", 
-                    "Mean_Per(um)", "Total_Airspace_Area(sq_um)", "Total_Tissue_Area(sq_um)", "EXP", "Lm(um)", "D0", "D1", "D2"]]
-        
-    return raw_df, grouped_df
-
-
-def write_output(data_list, output_path):
-    """Writes DataFrames to Excel file
-    
+    except TypeError:
+        print("WARNING: Raw data could not be sorted -- file names do not follow the <animal>-<location>-<number> convention")
+
+    grouped_df, summary_df = summarize(raw_df)
+
+    return raw_df, grouped_df, summary_df
+
+
+def typed(df):
+    """Give every column a single type for the columnar formats
+
+    Text columns can hold NaN where the file name could not be split; these become missing
+    values instead of floats inside a text column.
+
     Arguments:
-        data_list {list} -- list of the data returned from image processing
-        output_path {str} -- path to write Excel file
+        df {pd.DataFrame} -- table to convert
+
+    Returns:
+        pd.DataFrame -- table with text columns as str/None and all other columns as numbers
+    """
+    df = df.reset_index(drop=True).copy()
+    for col in df.columns:
+        if col in TEXT_COLUMNS:
+            df[col] = df[col].map(lambda v: None if pd.isna(v) else str(v)).astype(object)
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    return df
+
+
+def column_comment(header):
+    """Return the comment of a column header, including the statistic columns of the summary table"""
+    if header in COLUMN_COMMENTS:
+        return COLUMN_COMMENTS[header]
+    column, _, stat = header.rpartition("_")
+    if column in COLUMN_COMMENTS and stat in STAT_COMMENTS:
+        return f"{COLUMN_COMMENTS[column]}. {stat.upper()}: {STAT_COMMENTS[stat]}"
+
+    return None
+
+
+def write_excel(tables, base_name):
+    """Write every table to a sheet of an Excel workbook, with a comment on every column header
+
+    Arguments:
+        tables {dict} -- table name -> DataFrame
+        base_name {str} -- output path without extension
+
+    Returns:
+        list -- path of the workbook
+    """
+    excel_file = f"{base_name}.xlsx"
+    with pd.ExcelWriter(excel_file, engine='xlsxwriter') as writer:
+        for name, df in tables.items():
+            if len(df) >= EXCEL_MAX_ROWS:
+                print(f"ERROR: {len(df)} rows do not fit in an Excel sheet -- '{name}' not written to Excel, use another format")
+                continue
+            sheet_name = SHEET_NAMES.get(name, name.title())
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+
+            # add comments to each column header
+            sheet = writer.sheets[sheet_name]
+            for col, header in enumerate(df.columns):
+                comment = column_comment(header)
+                if comment:
+                    sheet.write_comment(0, col, comment)
+
+    return [excel_file]
+
+
+def write_parquet(tables, base_name):
+    """Write every table to a compressed Parquet file
+
+    Arguments:
+        tables {dict} -- table name -> DataFrame
+        base_name {str} -- output path without extension
+
+    Returns:
+        list -- paths of the Parquet files
+    """
+    files = []
+    for name, df in tables.items():
+        path = f"{base_name}_{name}.parquet"
+        typed(df).to_parquet(path, engine='pyarrow', compression='snappy', index=False)
+        files.append(path)
+
+    return files
+
+
+def write_feather(tables, base_name):
+    """Write every table to a Feather (Arrow IPC) file
+
+    Arguments:
+        tables {dict} -- table name -> DataFrame
+        base_name {str} -- output path without extension
+
+    Returns:
+        list -- paths of the Feather files
+    """
+    files = []
+    for name, df in tables.items():
+        path = f"{base_name}_{name}.feather"
+        typed(df).to_feather(path)
+        files.append(path)
+
+    return files
+
+
+def write_csv(tables, base_name):
+    """Write every table to a CSV file
+
+    Arguments:
+        tables {dict} -- table name -> DataFrame
+        base_name {str} -- output path without extension
+
+    Returns:
+        list -- paths of the CSV files
+    """
+    files = []
+    for name, df in tables.items():
+        path = f"{base_name}_{name}.csv"
+        df.to_csv(path, index=False)
+        files.append(path)
+
+    return files
+
+
+EXPORTERS = {"excel": write_excel,
+             "parquet": write_parquet,
+             "feather": write_feather,
+             "csv": write_csv}
+
+
+def write_output(data_list, output_path, formats=("excel",), name=None):
+    """Writes DataFrames to Excel file and/or columnar files
+
+    The data is either a list of the results of every image or the path of a results file
+    written by sink.ResultsSink. The output files of a results file are named after it.
+
+    Arguments:
+        data_list {list or str} -- list of the data returned from image processing, or path of a results file
+        output_path {str} -- path to write the output files
+
+    Keyword Arguments:
+        formats {tuple} -- exporters to write with, keys of EXPORTERS (default: {("excel",)})
+        name {str} -- name of the output files (default: {None}, named after the results file or Lung_Data_<timestamp>)
+
+    Returns:
+        list -- paths of the files that were written
     """
     print(f"Writing results to {output_path}")
     print("#" * 80)
-    df1, df2 = group_and_summarize(data_list)
-
-    timestr = time.strftime("%Y%m%d-%H%M%S")
-
-    with pd.ExcelWriter(os.path.join(output_path, "Lung_Data_{}.xlsx".format(timestr)), engine='xlsxwriter') as writer:
-        df1.to_excel(writer, sheet_name="Raw Data", index=False)
-        df2.to_excel(writer, sheet_name="Grouped Averages", index=False)
-
-        s1 = writer.sheets['Raw Data']
-        s2 = writer.sheets['Grouped Averages']
-
-        # add comments to each sheet
-        s1.write_comment('A1', 'FileName of the processed image')
-        s1.write_comment('B1', 'Animal ID - derived from the first field of the FileName')
-        s1.write_comment('C1', 'Location - derived from the second field of the FileName')
-        s1.write_comment('D1', 'Image Number - image Number derived from the third field of the FileName')
-        s1.write_comment('E1', 'Species - Species label obtained from the config_file [Image_metadata]')
-        s1.write_comment('F1', 'Magnification  - Magnification of the objective obtained from the config_file [Image_metadata]')
-        s1.write_comment('G1', 'Fixed Field - Size of the fixed field (image) in pixels. Obtained from the config_file [Image_metadata]')
-        s1.write_comment('H1', 'Scale - Scale of the image in pixels/micrometer')
-        s1.write_comment('I1', 'Image Width - Width of the image in micrometers')
-        s1.write_comment('J1', 'Image Height - Height of the image in micrometers')
-        s1.write_comment('K1', 'Object Number - The number of unique airspaces counted in the image')
-        s1.write_comment('L1', 'Mean Area - The mean area of an airspace in the image given in square micrometers')
-        s1.write_comment('M1', 'Stdev Area - The standard deviation of the mean area of the airspaces in the image given in square micrometers')
-        s1.write_comment('N1', 'Mean Diameter - The mean of the equivalent diameters of the airspaces in the image given in micrometers')
-        s1.write_comment('O1', 'Mean Perimeter - The mean of the perimeters of the airspaces in the image given in micrometers')
-        s1.write_comment('P1', 'Total Airspace Area - The total area of the airspaces in the image given in square micrometers')
-        s1.write_comment('Q1', 'Total Tissue Area - The total area of the tissue in the image given in square micrometers')
-        s1.write_comment('R1', 'Expansion Index (EXP) - Calculated as (Airspace_Area:Tissue_Area) * 100')
-        s1.write_comment('S1', 'Mean linear Intercept (Lm) - Mean Linear Intercept estimate given in micrometers')
-        s1.write_comment('T1', 'D0 Index - A weighted mean of the equivalent diameter. Measured in micrometers. Note: D0 is equivalent to Mean_Dia(um)')
-        s1.write_comment('U1', 'D1 index - A weighted mean of the equivalent diameter. Measured in micrometers. D1 is a function of the mean and the variance of the airspace diameters')
-        s1.write_comment('V1', 'D2 Index - A weighted mean of the equivalent diameter. Measured in micrometers. D2 is a function of the mean, variance, and skew of the airspace diameters')
-        
-        # on Grouped Averages Sheet
-        s2.write_comment('A1', 'FileName of the processed image')
-        s2.write_comment('B1', 'Animal ID - derived from the first field of the FileName')
-        s2.write_comment('C1', 'Location - derived from the second field of the FileName')
-        s2.write_comment('D1', 'Image Number - image Number derived from the third field of the FileName')
-        s2.write_comment('E1', 'Species - Species label obtained from the config_file [Image_metadata]')
-        s2.write_comment('F1', 'Magnification  - Magnification of the objective obtained from the config_file [Image_metadata]')
-        s2.write_comment('G1', 'Fixed Field - Size of the fixed field (image) in pixels. Obtained from the config_file [Image_metadata]')
-        s2.write_comment('H1', 'Scale - Scale of the image in pixels/micrometer')
-        s2.write_comment('I1', 'Image Width - Width of the image in micrometers')
-        s2.write_comment('J1', 'Image Height - Height of the image in micrometers')
-        s2.write_comment('K1', 'Object Number - The number of unique airspaces counted in the image')
-        s2.write_comment('L1', 'Mean Area - The mean area of an airspace in the image given in square micrometers')
-        s2.write_comment('M1', 'Stdev Area - The standard deviation of the mean area of the airspaces in the image given in square micrometers')
-        s2.write_comment('N1', 'Mean Diameter - The mean of the equivalent diameters of the airspaces in the image given in micrometers')
-        s2.write_comment('O1', 'Mean Perimeter - The mean of the perimeters of the airspaces in the image given in micrometers')
-        s2.write_comment('P1', 'Total Airspace Area - The total area of the airspaces in the image given in square micrometers')
-        s2.write_comment('Q1', 'Total Tissue Area - The total area of the tissue in the image given in square micrometers')
-        s2.write_comment('R1', 'Expansion Index (EXP) - Calculated as (Airspace_Area:Tissue_Area) * 100')
-        s2.write_comment('S1', 'Mean linear Intercept (Lm) - Mean Linear Intercept estimate given in micrometers')
-        s2.write_comment('T1', 'D0 Index - A weighted mean of the equivalent diameter. Measured in micrometers. Note: D0 is equivalent to Mean_Dia(um)')
-        s2.write_comment('U1', 'D1 index - A weighted mean of the equivalent diameter. Measured in micrometers. D1 is a function of the mean and the variance of the airspace diameters')
-        s2.write_comment('V1', 'D2 Index - A weighted mean of the equivalent diameter. Measured in micrometers. D2 is a function of the mean, variance, and skew of the airspace diameters')
-    
-        writer.save()
+    if isinstance(data_list, (str, Path)):
+        name = name or Path(data_list).stem
+        data_list = [row["data"] for row in read_sink(data_list)]
+    else:
+        name = name or results_name()
+
+    df1, df2, df3 = group_and_summarize(data_list)
+    tables = {"raw": df1, "grouped": df2, "summary": df3}
+
+    return write_tables(tables, os.path.join(output_path, name), formats)
+
+
+def write_tables(tables, base_name, formats=("excel",)):
+    """Write tables with every exporter in formats, reporting the formats that cannot be written
+
+    Arguments:
+        tables {dict} -- table name -> DataFrame
+        base_name {str} -- output path without extension
+
+    Keyword Arguments:
+        formats {tuple} -- exporters to write with, keys of EXPORTERS (default: {("excel",)})
+
+    Returns:
+        list -- paths of the files that were written
+    """
+    files = []
+    for fmt in formats:
+        try:
+            files.extend(EXPORTERS[fmt](tables, base_name))
+        except ImportError as e:
+            print(f"ERROR: Could not write {fmt} output ({e}) -- install pyarrow for parquet and feather output")
+
+    return files
+
+
+class ObjectsWriter:
+    """Parquet dataset of per-airspace tables, one partition per image
+
+    Arguments:
+        path {str} -- directory of the dataset, created if it does not exist
+
+    Keyword Arguments:
+        root {str} -- image folder, images are keyed by their path relative to it (default: {None}, the file name)
+    """
+    def __init__(self, path, root=None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.root = root
+
+    def partition(self, image):
+        """Return the partition directory of an image"""
+        return self.path / f"image={quote(image_key(image, self.root), safe='')}"
+
+    def has(self, image):
+        """Return True if the airspace table of an image is in the dataset"""
+        return (self.partition(image) / "part-0.parquet").exists()
+
+    def append(self, image, objects):
+        """Write the airspace table of one image, replacing any earlier table of the image
+
+        The file is written under a temporary name and renamed, so a killed run never
+        leaves a partially written partition.
+
+        Arguments:
+            image {str} -- image path, its path relative to the image folder is the partition key
+            objects {np.array} -- structured array from measure.object_table
+        """
+        partition = self.partition(image)
+        partition.mkdir(exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=str(partition), suffix=".tmp")
+        os.close(fd)
+        try:
+            pd.DataFrame(objects).to_parquet(tmp, engine='pyarrow', compression='snappy', index=False)
+            os.replace(tmp, str(partition / "part-0.parquet"))
+        except Exception:
+            os.remove(tmp)
+            raise
+
+
+def open_objects(path, root=None, **kwargs):
+    """Return the per-airspace dataset writer configured in the settings
+
+    Arguments:
+        path {str} -- directory of the dataset
+
+    Keyword Arguments:
+        root {str} -- image folder, images are keyed by their path relative to it (default: {None})
+
+    Returns:
+        ObjectsWriter -- the writer, or None if Objects is off or pyarrow is not installed
+    """
+    if not kwargs.get('export_objects'):
+        return None
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("ERROR: Could not write the airspace table -- install pyarrow for per-airspace output")
+        return None
+
+    return ObjectsWriter(path, root)
+
+
+def read_objects(path):
+    """Read a per-airspace dataset
+
+    Arguments:
+        path {str} -- directory of the dataset
+
+    Returns:
+        pd.DataFrame -- one row per airspace, with the path of its image relative to the image folder
+                        in the 'image' column
+    """
+    tables = []
+    for partition in sorted(Path(path).glob("image=*")):
+        part = partition / "part-0.parquet"
+        if part.exists():
+            table = pd.read_parquet(str(part), engine='pyarrow')
+            table.insert(0, "image", unquote(partition.name[len("image="):]))
+            tables.append(table)
+
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=["image"])
@@ -0,0 +1,238 @@
+"""Timing and memory of every processing stage
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Every stage of the pipeline is run inside a Stage, which records a StageEvent: the image, the
+stage, its duration, how much it raised the peak memory (resident set size) of the process and
+the number of pixels it worked on. Recording an event costs a few microseconds, so stages are
+always recorded.
+
+Events are kept per process until drain() collects them - batch.run_one returns the events of
+every image with its results, so the events of worker processes reach the main process (except
+for QC images a worker saves after its last image). A Profile aggregates the events of a run
+into a summary per stage, which is printed as a table and saved with every event to
+Lung_Data_<timestamp>_profile.json next to the results. The Profile keys the events by the path of
+the image relative to the image folder (load_images.image_key), so images of the same name in
+different subfolders are kept apart.
+
+The peak memory only grows, so a stage raises it only when it needs more memory than any stage
+before it in the same process: the first images show where memory goes, later ones show 0.
+"""
+import ctypes
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from pathlib import Path
+
+from load_images import image_key
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, see windows_peak_rss
+    resource = None
+
+
+# stages in the order they run, the summary lists them in this order
+STAGES = ("load", "grey", "clahe", "surface", "threshold", "morphology", "label", "regionprops", "mli", "expansion",
+          "d_indices", "objects", "metadata", "qc", "export")
+
+StageEvent = namedtuple('StageEvent', ['image', 'stage', 'seconds', 'rss_delta_mb', 'peak_rss_mb', 'pixels', 'pid'])
+
+_events = []
+_lock = threading.Lock()
+
+
+def windows_peak_rss():
+    """Return the peak working set of this process in bytes on Windows, None elsewhere"""
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    try:
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = ctypes.c_void_p
+        get_info = kernel32.K32GetProcessMemoryInfo
+        get_info.argtypes = [ctypes.c_void_p, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), ctypes.c_ulong]
+        if not get_info(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return None
+    except (AttributeError, OSError):
+        return None
+
+    return counters.PeakWorkingSetSize
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process in MB, None if it cannot be measured"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kilobytes on Linux
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+    peak = windows_peak_rss()
+
+    return None if peak is None else peak / 2**20
+
+
+def record(event):
+    """Keep an event until the next drain()"""
+    with _lock:
+        _events.append(event)
+
+
+def drain():
+    """Return and forget the events recorded in this process since the last drain()"""
+    global _events
+    with _lock:
+        events, _events = _events, []
+
+    return events
+
+
+class Stage:
+    """Record the duration and memory of the code run inside a with block as a StageEvent
+
+    The image and pixels can also be set on the Stage inside the block, when they are only
+    known after loading the image.
+
+    Arguments:
+        name {str} -- name of the stage, one of STAGES
+
+    Keyword Arguments:
+        image {str} -- Path to the image (default: {None}, stages of the whole run)
+        pixels {int} -- number of pixels processed (default: {None})
+    """
+    def __init__(self, name, image=None, pixels=None):
+        self.name = name
+        self.image = image
+        self.pixels = pixels
+
+    def __enter__(self):
+        self.rss = peak_rss_mb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        rss = peak_rss_mb()
+        delta = None if rss is None else rss - self.rss
+        image = None if self.image is None else str(self.image)
+        pixels = None if self.pixels is None else int(self.pixels)
+        record(StageEvent(image, self.name, seconds, delta, rss, pixels, os.getpid()))
+
+
+def timed(name, image, func, *args, **kwargs):
+    """Return func(*args, **kwargs), recorded as stage name of image
+
+    The pixels are the size of the first argument (the image the stage works on).
+    """
+    with Stage(name, image, getattr(args[0], 'size', None) if args else None):
+        return func(*args, **kwargs)
+
+
+class Profile:
+    """Events of a run, summarized per stage
+
+    Keyword Arguments:
+        root {str} -- image folder, events are keyed by the image path relative to it (default: {None}, the file name)
+    """
+    def __init__(self, root=None):
+        self.events = []
+        self.root = root
+        self.start = time.time()
+
+    def add(self, events):
+        """Add the events of an image (BatchResult.events) or of the run (drain())"""
+        self.events.extend(e if e.image is None else e._replace(image=image_key(e.image, self.root))
+                           for e in events or ())
+
+    def summary(self):
+        """Return the totals of every stage
+
+        Returns:
+            list -- for every stage that ran (STAGES order): stage, count, total, mean and max seconds,
+                    share of the total time of all stages, largest increase of the peak memory (MB)
+                    and megapixels processed per second
+        """
+        by_stage = OrderedDict((s, []) for s in STAGES)
+        for e in self.events:
+            by_stage.setdefault(e.stage, []).append(e)
+        total = sum(e.seconds for e in self.events) or 1.0
+
+        rows = []
+        for name, events in by_stage.items():
+            if not events:
+                continue
+            seconds = [e.seconds for e in events]
+            deltas = [e.rss_delta_mb for e in events if e.rss_delta_mb is not None]
+            pixels = sum(e.pixels for e in events if e.pixels)
+            timed_pixels = sum(e.seconds for e in events if e.pixels)
+            rows.append({"stage": name, "count": len(events), "total_s": sum(seconds),
+                         "mean_s": sum(seconds) / len(seconds), "max_s": max(seconds),
+                         "share": sum(seconds) / total, "rss_delta_mb": max(deltas) if deltas else None,
+                         "mpx_per_s": pixels / 1e6 / timed_pixels if timed_pixels else None})
+
+        return rows
+
+    def table(self):
+        """Return the summary as a text table"""
+        lines = [f"{'Stage':<12}{'Count':>7}{'Total(s)':>11}{'Mean(s)':>10}{'Max(s)':>10}{'Share':>8}"
+                 f"{'Peak+(MB)':>11}{'MPx/s':>9}"]
+        for r in self.summary():
+            rss = "" if r["rss_delta_mb"] is None else f"{r['rss_delta_mb']:.0f}"
+            speed = "" if r["mpx_per_s"] is None else f"{r['mpx_per_s']:.1f}"
+            lines.append(f"{r['stage']:<12}{r['count']:>7}{r['total_s']:>11.2f}{r['mean_s']:>10.3f}{r['max_s']:>10.3f}"
+                         f"{r['share']:>8.0%}{rss:>11}{speed:>9}")
+        lines.append(f"Wall time {time.time() - self.start:.1f} s")
+
+        return "\n".join(lines)
+
+    def write(self, output_dir, name):
+        """Save the summary and every event to <name>_profile.json in output_dir
+
+        Arguments:
+            output_dir {str} -- directory to save the profile in
+            name {str} -- name of the results of the run (Lung_Data_<timestamp>)
+
+        Returns:
+            Path -- path of the saved profile
+        """
+        path = Path(output_dir) / f"{name}_profile.json"
+        report = {"wall_seconds": time.time() - self.start, "summary": self.summary(),
+                  "events": [e._asdict() for e in self.events]}
+        with open(str(path), 'w') as f:
+            json.dump(report, f, indent=1)
+
+        return path
+
+
+def write_profile(profile, output_dir, name):
+    """Print the summary of a run and save its profile, reporting instead of raising errors
+
+    Arguments:
+        profile {Profile} -- profile of the run
+        output_dir {str} -- directory to save the profile in
+        name {str} -- name of the results of the run, the profile is saved as <name>_profile.json
+
+    Returns:
+        Path -- path of the saved profile, None if it could not be saved
+    """
+    profile.add(drain())
+    print("Time and memory of every stage:")
+    print(profile.table())
+    try:
+        path = profile.write(output_dir, name)
+    except OSError as e:
+        print(f"ERROR: Could not save the profile ({e!r})")
+        return None
+    print(f"Saved the profile to {path}")
+
+    return path
@@ -3,6 +3,14 @@
 (c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
 """
 import configparser
+import os
+
+
+def number(value):
+    """Return a config value as an int if it is a whole number, otherwise as a float"""
+    value = float(value)
+
+    return int(value) if value.is_integer() else value
 
 
 def validate_settings(**kwargs):
@@ -25,6 +33,91 @@ def validate_settings(**kwargs):
         print("Setting Method to 'mean'")
         kwargs['method'] = 'mean'
 
+    if kwargs['threshold_engine'] not in ('fast', 'skimage'):
+        print(f"ERROR: Invalid Engine '{kwargs['threshold_engine']}' -- must be 'fast' or 'skimage', check your config file")
+        print("Setting Engine to 'fast'")
+        kwargs['threshold_engine'] = 'fast'
+
+    invalid = [d for d in kwargs['mli_directions'] if d not in (0, 45, 90, 135)]
+    if invalid or not kwargs['mli_directions']:
+        print(f"ERROR: Invalid MLI_Directions '{invalid}' -- must be one or more of 0, 45, 90, 135, check your config file")
+        print("Setting MLI_Directions to 0")
+        kwargs['mli_directions'] = (0,)
+
+    if kwargs['mli_spacing'] < 1:
+        print(f"ERROR: Invalid MLI_Spacing '{kwargs['mli_spacing']}' -- must be a positive integer, check your config file")
+        print("Setting MLI_Spacing to 1")
+        kwargs['mli_spacing'] = 1
+
+    if kwargs['workers'] < 0:
+        print(f"ERROR: Invalid Workers '{kwargs['workers']}' -- must be 0 (all cores) or a positive integer, check your config file")
+        print("Setting Workers to 1")
+        kwargs['workers'] = 1
+
+    if kwargs['workers'] == 0:
+        kwargs['workers'] = os.cpu_count() or 1
+
+    if kwargs['grey_channel'] not in ('luminance', 'red', 'green', 'blue'):
+        print(f"ERROR: Invalid Grey_Channel '{kwargs['grey_channel']}' -- must be one of 'luminance', 'red', 'green', or 'blue', check your config file")
+        print("Setting Grey_Channel to 'luminance'")
+        kwargs['grey_channel'] = 'luminance'
+
+    if kwargs['precision'] not in ('float32', 'float64'):
+        print(f"ERROR: Invalid Precision '{kwargs['precision']}' -- must be 'float32' or 'float64', check your config file")
+        print("Setting Precision to 'float64'")
+        kwargs['precision'] = 'float64'
+
+    if kwargs['cache_size_mb'] < 0:
+        print(f"ERROR: Invalid Max_Size_MB '{kwargs['cache_size_mb']}' -- must be a positive integer, check your config file")
+        print("Setting Max_Size_MB to 2048")
+        kwargs['cache_size_mb'] = 2048
+
+    unknown = [f for f in kwargs['output_formats'] if f not in ('excel', 'parquet', 'feather', 'csv')]
+    if unknown:
+        print(f"ERROR: Invalid Formats '{unknown}' -- must be one or more of 'excel', 'parquet', 'feather', 'csv', check your config file")
+        print("Ignoring invalid formats")
+        kwargs['output_formats'] = tuple(f for f in kwargs['output_formats'] if f not in unknown)
+
+    if not kwargs['output_formats']:
+        print("ERROR: No output Formats -- check your config file")
+        print("Setting Formats to 'excel'")
+        kwargs['output_formats'] = ('excel',)
+
+    if kwargs['qc_width'] < 128:
+        print(f"ERROR: Invalid QC_Width '{kwargs['qc_width']}' -- must be an integer of at least 128, check your config file")
+        print("Setting QC_Width to 1600")
+        kwargs['qc_width'] = 1600
+
+    if kwargs['tile_size'] < 0:
+        print(f"ERROR: Invalid Tile_Size '{kwargs['tile_size']}' -- must be 0 (no tiling) or a positive integer, check your config file")
+        print("Setting Tile_Size to 0")
+        kwargs['tile_size'] = 0
+
+    if not kwargs['include']:
+        print("ERROR: No Include patterns -- check your config file")
+        print("Setting Include to '*.tif, *.tiff'")
+        kwargs['include'] = ('*.tif', '*.tiff')
+
+    if kwargs['prefetch'] < 0:
+        print(f"ERROR: Invalid Prefetch '{kwargs['prefetch']}' -- must be 0 (off) or a positive integer, check your config file")
+        print("Setting Prefetch to 2")
+        kwargs['prefetch'] = 2
+
+    if kwargs['prefetch_mb'] < 0:
+        print(f"ERROR: Invalid Prefetch_MB '{kwargs['prefetch_mb']}' -- must be a positive integer, check your config file")
+        print("Setting Prefetch_MB to 512")
+        kwargs['prefetch_mb'] = 512
+
+    if kwargs['profile_every'] < 0:
+        print(f"ERROR: Invalid Profile_Every '{kwargs['profile_every']}' -- must be 0 (off) or a positive integer, check your config file")
+        print("Setting Profile_Every to 0")
+        kwargs['profile_every'] = 0
+
+    if kwargs['profiler'] not in ('cprofile', 'sampling'):
+        print(f"ERROR: Invalid Profiler '{kwargs['profiler']}' -- must be 'cprofile' or 'sampling', check your config file")
+        print("Setting Profiler to 'cprofile'")
+        kwargs['profiler'] = 'cprofile'
+
     return kwargs
 
 
@@ -47,16 +140,44 @@ def load_settings(config_file):
     metadata = config['Image_Metadata']
     threshold_params = config['Threshold_Params']
     morphometry_params = config['Morphology_Params']
+    # optional sections - older config files do not have them
+    measurement_params = config['Measurement_Params'] if config.has_section('Measurement_Params') else {}
+    processing_params = config['Processing_Params'] if config.has_section('Processing_Params') else {}
+    cache_params = config['Cache_Params'] if config.has_section('Cache_Params') else {}
+    output_params = config['Output_Params'] if config.has_section('Output_Params') else {}
 
     species = metadata.get('Species', 'mouse')
     magnification = metadata.get('Magnification', '10X')
     fixed_field = metadata.get('Fixed_Field', '2560x1920')
     scale = float(metadata.get('Scale', 2.0969))
     block_size = int(threshold_params.get('Block_Size', 251))
-    constant = int(threshold_params.get('Constant', 0))
+    constant = number(threshold_params.get('Constant', 0))
     method = str(threshold_params.get('Method', 'mean'))
+    threshold_engine = str(threshold_params.get('Engine', 'fast')).lower()
     min_alv_size = int(morphometry_params.get('Min_Alveolar_Size', 500))
     max_speckle_size = int(morphometry_params.get('Max_Speckle_Size', 100))
+    mli_directions = tuple(int(d) for d in str(measurement_params.get('MLI_Directions', '0')).split(',') if d.strip())
+    mli_spacing = int(measurement_params.get('MLI_Spacing', 1))
+    workers = int(processing_params.get('Workers', 1))
+    grey_channel = str(processing_params.get('Grey_Channel', 'luminance')).lower()
+    precision = str(processing_params.get('Precision', 'float64')).lower()
+    tile_size = int(processing_params.get('Tile_Size', 0))
+    incremental = str(processing_params.get('Incremental', 'no')).lower() in ('yes', 'true', 'on', '1')
+    scratch_dir = str(processing_params.get('Scratch_Dir', ''))
+    include = tuple(p.strip() for p in str(processing_params.get('Include', '*.tif, *.tiff')).split(',') if p.strip())
+    exclude = tuple(p.strip() for p in str(processing_params.get('Exclude', '')).split(',') if p.strip())
+    manifest = str(processing_params.get('Manifest', ''))
+    prefetch = int(processing_params.get('Prefetch', 2))
+    prefetch_mb = int(processing_params.get('Prefetch_MB', 512))
+    cache_dir = str(cache_params.get('Cache_Dir', ''))
+    cache_size_mb = int(cache_params.get('Max_Size_MB', 2048))
+    qc_width = int(output_params.get('QC_Width', 1600))
+    export_objects = str(output_params.get('Objects', 'no')).lower() in ('yes', 'true', 'on', '1')
+    profile = str(output_params.get('Profile', 'yes')).lower() in ('yes', 'true', 'on', '1')
+    profile_every = int(output_params.get('Profile_Every', 0))
+    profile_images = tuple(p.strip() for p in str(output_params.get('Profile_Images', '')).split(',') if p.strip())
+    profiler = str(output_params.get('Profiler', 'cprofile')).lower()
+    output_formats = tuple(f.strip().lower() for f in str(output_params.get('Formats', 'excel')).split(',') if f.strip())
 
     settings = {"species" : species,
                 "magnification" : magnification,
@@ -65,8 +186,31 @@ def load_settings(config_file):
                 "block_size" : block_size,
                 "constant" : constant,
                 "method" : method, 
+                "threshold_engine" : threshold_engine,
                 "min_alv_size" : min_alv_size,
-                "max_speckle_size" : max_speckle_size
+                "max_speckle_size" : max_speckle_size,
+                "mli_directions" : mli_directions,
+                "mli_spacing" : mli_spacing,
+                "workers" : workers,
+                "grey_channel" : grey_channel,
+                "precision" : precision,
+                "tile_size" : tile_size,
+                "scratch_dir" : scratch_dir,
+                "incremental" : incremental,
+                "include" : include,
+                "exclude" : exclude,
+                "manifest" : manifest,
+                "prefetch" : prefetch,
+                "prefetch_mb" : prefetch_mb,
+                "cache_dir" : cache_dir,
+                "cache_size_mb" : cache_size_mb,
+                "output_formats" : output_formats,
+                "export_objects" : export_objects,
+                "qc_width" : qc_width,
+                "profile" : profile,
+                "profile_every" : profile_every,
+                "profile_images" : profile_images,
+                "profiler" : profiler
                 }
 
     validated = validate_settings(**settings)
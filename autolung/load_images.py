@@ -1,21 +1,455 @@
-"""Collect images from the specified directory
+"""Collect images from the specified directory and read them
+
 (c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Images are read without decoding the whole RGB image into memory where possible. Uncompressed
+TIFFs are memory-mapped and the grayscale image is built a strip of rows at a time, so only the
+grayscale output is held in memory. Compressed TIFFs are decoded into memory, or into a
+temporary memory-mapped file for images processed in tiles (larger than Tile_Size). A region of a
+compressed TIFF is read by decoding only the strips or tiles that overlap it.
+
+Images are found with os.scandir, a directory at a time, skipping the QC folders written next to
+the images. The list of images can be saved to a manifest file and reused by later runs while
+no folder of the study has changed, so large studies are not walked again.
+
+A Prefetcher loads the next images in background threads while the current image is processed,
+so reading from slow disks and network shares overlaps with the processing.
 """
+import fnmatch
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
+import tifffile
+from skimage import io
+
+
+# weights used by skimage.color.rgb2gray
+LUMINANCE = np.array([0.2125, 0.7154, 0.0721])
+CHANNELS = {"red": 0, "green": 1, "blue": 2}
+# rows converted to grayscale at a time
+STRIP_ROWS = 256
+# file names of images, matched regardless of case
+IMAGE_PATTERNS = ("*.tif", "*.tiff")
+# folders written by autolung into the image directory (QC images, see qc.qc_path)
+SKIP_DIRS = ("QC",)
+MANIFEST_VERSION = 1
+
+
+def matches(name, rel_path, patterns):
+    """Return True if a file or folder name, or its path relative to the image directory, matches any pattern
+
+    Patterns are shell-style wildcards ('*.tif', 'controls/*') and are matched regardless of case.
+    """
+    name, rel_path = name.lower(), rel_path.lower()
+
+    return any(fnmatch.fnmatchcase(name, p.lower()) or fnmatch.fnmatchcase(rel_path, p.lower()) for p in patterns)
+
+
+def walk(root, include, exclude):
+    """Find the images below a directory with os.scandir
+
+    Arguments:
+        root {str} -- path to the directory containing images
+        include {tuple} -- patterns of the files to collect
+        exclude {tuple} -- patterns of the files and folders to leave out
+
+    Returns:
+        tuple -- (sorted image paths relative to root, {folder relative to root: modification time in ns})
+    """
+    images = []
+    dirs = {".": os.stat(root).st_mtime_ns}
+    pending = [""]
+    while pending:
+        rel_dir = pending.pop()
+        with os.scandir(os.path.join(root, rel_dir)) as entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if matches(entry.name, rel_path, exclude):
+                    continue
+                if entry.is_dir():
+                    if entry.name not in SKIP_DIRS:
+                        # recorded before the folder is listed, so a file added meanwhile changes it
+                        dirs[rel_path] = entry.stat().st_mtime_ns
+                        pending.append(rel_path)
+                elif matches(entry.name, rel_path, include) and entry.is_file():
+                    images.append(rel_path)
+
+    return sorted(images), dirs
+
+
+def read_manifest(manifest, root, include, exclude):
+    """Return the images listed in a manifest, or None if it does not exist or is out of date
+
+    A manifest is out of date when it was made for another directory or other patterns, or
+    when any folder it lists was modified (a file was added, removed or renamed in it).
+
+    Returns:
+        list -- image paths relative to root, or None
+    """
+    try:
+        with open(str(manifest)) as f:
+            m = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (m.get("version"), m.get("root"), m.get("include"), m.get("exclude")) != (MANIFEST_VERSION, root, list(include), list(exclude)):
+        return None
+    # saving the manifest modifies its own folder, up to the time the manifest was saved
+    own_dir = os.path.relpath(os.path.dirname(os.path.abspath(str(manifest))), root).replace(os.sep, "/")
+    saved = os.stat(str(manifest)).st_mtime_ns
+    try:
+        for d, mtime in m["dirs"].items():
+            current = os.stat(os.path.join(root, d)).st_mtime_ns
+            if current != mtime and not (d == own_dir and mtime <= current <= saved):
+                return None
+    except OSError:
+        return None
+
+    return m["images"]
+
 
-def collect(input_dir):
+def write_manifest(manifest, root, include, exclude, images, dirs):
+    """Save the images found below root to a manifest file (JSON), replacing it in one step"""
+    manifest = Path(manifest)
+    m = {"version": MANIFEST_VERSION, "root": root, "include": list(include), "exclude": list(exclude),
+         "dirs": dirs, "images": images}
+    tmp = manifest.with_name(manifest.name + ".tmp")
+    with open(str(tmp), 'w') as f:
+        json.dump(m, f)
+    os.replace(str(tmp), str(manifest))
+    # later than the change of its folder by the replace, see read_manifest
+    os.utime(str(manifest))
+
+
+def collect(input_dir, **kwargs):
     """Iterate through image directory collecting image paths for processing
-    This method currently only accepts .tif images
-    
+
+    'include' (default: .tif and .tiff files), 'exclude' (file or folder patterns) and 'manifest'
+    (a file the list of images is saved to and reused from, relative to input_dir) are gathered
+    from the config file. QC folders are never searched.
+
     Arguments:
         input_dir {str} -- path to the directory containing images
-    
+
     Returns:
         list -- list of image paths to process
     """
+    root = os.path.abspath(str(input_dir))
+    include = tuple(kwargs.get('include') or IMAGE_PATTERNS)
+    exclude = tuple(kwargs.get('exclude') or ())
+    manifest = kwargs.get('manifest')
+    if manifest:
+        manifest = os.path.join(root, str(manifest))
+        images = read_manifest(manifest, root, include, exclude)
+        if images is not None:
+            print(f"Reading the list of images from {manifest}")
+            return [Path(root, img) for img in images]
+
+    images, dirs = walk(root, include, exclude)
+    if manifest:
+        try:
+            write_manifest(manifest, root, include, exclude, images, dirs)
+        except OSError as e:
+            print(f"WARNING: Could not save the list of images to {manifest} ({e!r})")
+
+    return [Path(root, img) for img in images]
+
+
+def image_key(image, root=None):
+    """Return the path of an image relative to the image folder ('/' separated), its file name outside of it"""
+    if root is not None:
+        try:
+            return Path(image).resolve().relative_to(Path(root).resolve()).as_posix()
+        except ValueError:
+            pass
+
+    return Path(image).name
+
+
+def file_digest(img, chunk_size=2**20):
+    """Return a hash of the contents of an image file
+
+    Arguments:
+        img {str} -- Path to the image
+
+    Keyword Arguments:
+        chunk_size {int} -- bytes read at a time (default: {1 MB})
+
+    Returns:
+        str -- hex digest of the file contents
+    """
+    h = hashlib.sha1()
+    with open(str(img), 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+def is_tiff(img):
+    """Return True if the image is a TIFF file
+
+    Arguments:
+        img {str} -- Path to the image
+    """
+    return Path(img).suffix.lower() in ('.tif', '.tiff')
+
+
+def image_shape(img):
+    """Return the (rows, columns) of an image without decoding it
+
+    Arguments:
+        img {str} -- Path to the image
+
+    Returns:
+        tuple -- rows and columns of the image
+    """
+    if not is_tiff(img):
+        return tuple(io.imread(img).shape[:2])
+
+    with tifffile.TiffFile(str(img)) as tif:
+        return tuple(tif.pages[0].shape[:2])
+
+
+def open_image(img, scratch=False):
+    """Open an image, without loading it into memory where possible
+
+    Uncompressed TIFFs are memory-mapped directly. Compressed (or tiled) TIFFs are decoded into
+    memory, or into a temporary memory-mapped file with scratch. Other formats are read with skimage.
+
+    Arguments:
+        img {str} -- Path to the image
+
+    Keyword Arguments:
+        scratch {bool} -- decode compressed TIFFs into a temporary file, for images too large for
+                          memory (processed in tiles) (default: {False})
+
+    Returns:
+        ndarray -- image (memory-mapped for uncompressed TIFFs)
+    """
+    if not is_tiff(img):
+        return io.imread(img)
+
+    try:
+        return tifffile.memmap(str(img), mode='r')
+    except ValueError:
+        # not stored contiguously - decode it, into a temporary file only if it may not fit in memory
+        return tifffile.imread(str(img), out='memmap' if scratch else None)
+
+
+def read_tiff_region(img, region):
+    """Decode only the strips or tiles of a TIFF that overlap a region
+
+    Arguments:
+        img {str} -- Path to the TIFF
+        region {tuple} -- (row slice, column slice)
+
+    Returns:
+        ndarray -- the region of the image, None if the image is not stored as strips or tiles of
+                   interleaved samples (e.g. planar RGB or a volume) and has to be decoded whole
+    """
+    with tifffile.TiffFile(str(img)) as tif:
+        page = tif.pages[0]
+        if page.planarconfig != 1 or page.imagedepth > 1:
+            return None
+        rows = range(page.imagelength)[region[0]]
+        cols = range(page.imagewidth)[region[1]]
+        if rows.step != 1 or cols.step != 1:
+            return None
+
+        out = np.zeros((len(rows), len(cols)) + tuple(page.shape[2:]), dtype=page.dtype)
+        if not len(rows) or not len(cols):
+            return out
+        seg_rows = page.tilelength if page.is_tiled else page.rowsperstrip
+        seg_cols = page.tilewidth if page.is_tiled else page.imagewidth
+        across = -(-page.imagewidth // seg_cols)
+        indices = [r * across + c
+                   for r in range(rows.start // seg_rows, (rows.stop - 1) // seg_rows + 1)
+                   for c in range(cols.start // seg_cols, (cols.stop - 1) // seg_cols + 1)]
+
+        segments = tif.filehandle.read_segments([page.dataoffsets[i] for i in indices],
+                                                [page.databytecounts[i] for i in indices], indices, sort=True)
+        for data, index in segments:
+            segment, position, _ = page.decode(data, index, jpegtables=page.jpegtables)
+            if segment is None:
+                # empty tile
+                continue
+            # tiles at the edges are padded to the full tile size
+            segment = segment.reshape(segment.shape[1:3] + tuple(page.shape[2:]))
+            r0, c0 = position[2], position[3]
+            r1, c1 = min(r0 + segment.shape[0], rows.stop), min(c0 + segment.shape[1], cols.stop)
+            r, c = max(r0, rows.start), max(c0, cols.start)
+            out[r - rows.start:r1 - rows.start, c - cols.start:c1 - cols.start] = segment[r - r0:r1 - r0, c - c0:c1 - c0]
+
+    return out
+
+
+def open_region(img, region):
+    """Open a region of an image, without decoding the rest of it where possible
+
+    Uncompressed TIFFs are memory-mapped and sliced, compressed TIFFs are read with read_tiff_region.
+    Other images, and TIFFs read_tiff_region cannot read in parts, are decoded whole and then sliced.
+
+    Arguments:
+        img {str} -- Path to the image
+        region {tuple} -- (row slice, column slice)
+
+    Returns:
+        ndarray -- the region of the image
+    """
+    if is_tiff(img):
+        try:
+            return tifffile.memmap(str(img), mode='r')[region]
+        except ValueError:
+            rgb = read_tiff_region(img, region)
+            if rgb is not None:
+                return rgb
+
+    return open_image(img)[region]
+
+
+def to_grey(rgb, channel=None, dtype=np.float32):
+    """Convert (part of) an RGB image to grayscale
+
+    Arguments:
+        rgb {ndarray} -- RGB(A) or grayscale image
+
+    Keyword Arguments:
+        channel {str} -- 'red', 'green' or 'blue' to use a single channel, otherwise the luminance (default: {None})
+        dtype {np.dtype} -- float32/float64 (scaled to 0-1, as rgb2gray) or uint8/uint16 (default: {np.float32})
+
+    Returns:
+        ndarray -- grayscale image
+    """
+    dtype = np.dtype(dtype)
+    # float64 output is computed in float64, everything else in float32
+    work = np.float64 if dtype == np.float64 else np.float32
+    in_max = np.iinfo(rgb.dtype).max if rgb.dtype.kind in 'ui' else 1.0
+    out_max = np.iinfo(dtype).max if dtype.kind in 'ui' else 1.0
+
+    if rgb.ndim == 2:
+        grey = rgb
+    elif channel in CHANNELS:
+        grey = rgb[..., CHANNELS[channel]]
+    else:
+        grey = rgb[..., :3] @ LUMINANCE.astype(work)
+
+    if grey.dtype == dtype and in_max == out_max:
+        return np.array(grey)
+
+    grey = grey.astype(work) * work(out_max / in_max)
+    if dtype.kind in 'ui':
+        grey = np.rint(grey)
+    # rounding can take a white pixel just past the maximum
+    np.clip(grey, 0, out_max, out=grey)
+
+    return grey.astype(dtype)
+
+
+def read_grey(img, channel=None, region=None, dtype=np.float32):
+    """Read an image as grayscale without building a full-size RGB array in memory
+
+    Arguments:
+        img {str} -- Path to the image
+
+    Keyword Arguments:
+        channel {str} -- 'red', 'green' or 'blue' to use a single channel, otherwise the luminance (default: {None})
+        region {tuple} -- (row slice, column slice) to read only part of the image, see open_region (default: {None})
+        dtype {np.dtype} -- float32/float64 (scaled to 0-1, as rgb2gray) or uint8/uint16 (default: {np.float32})
+
+    Returns:
+        ndarray -- grayscale image
+    """
+    rgb = open_image(img) if region is None else open_region(img, region)
+
+    grey = np.empty(rgb.shape[:2], dtype=dtype)
+    for r0 in range(0, grey.shape[0], STRIP_ROWS):
+        rows = slice(r0, r0 + STRIP_ROWS)
+        grey[rows] = to_grey(rgb[rows], channel, dtype)
+
+    return grey
+
+
+def read_ahead(img, chunk_size=2**20):
+    """Read an image file without keeping its contents, so it is in the operating system's file cache
+
+    Arguments:
+        img {str} -- Path to the image
+
+    Keyword Arguments:
+        chunk_size {int} -- bytes read at a time (default: {1 MB})
+    """
+    with open(str(img), 'rb') as f:
+        while f.read(chunk_size):
+            pass
+
+
+class Prefetcher:
+    """Load images ahead of their use in background threads
+
+    Iterating gives (image, loaded data) in the order of images. While an image is used, the
+    next 'depth' images are loaded, as long as their estimated sizes fit in max_bytes (the next
+    image is always loaded). An image that could not be loaded gives None, so the caller can
+    load it itself and report the error.
+
+    Arguments:
+        images {list} -- image paths
+        load {callable} -- load(image) returns the loaded data
+
+    Keyword Arguments:
+        size {callable} -- size(image) estimates the bytes held by the loaded data (default: {None}, file size)
+        depth {int} -- images loaded ahead, 0 loads nothing (default: {2})
+        max_bytes {int} -- estimated bytes of the images loaded ahead (default: {512 MB})
+    """
+    def __init__(self, images, load, size=None, depth=2, max_bytes=512 * 2**20):
+        self.images = images
+        self.load = load
+        self.size = size or os.path.getsize
+        self.depth = depth
+        self.max_bytes = max_bytes
+
+    def __len__(self):
+        return len(self.images)
+
+    def __iter__(self):
+        if self.depth <= 0:
+            for img in self.images:
+                yield img, None
+            return
+
+        upcoming = iter(self.images)
+        next_img = next(upcoming, None)
+        ahead = deque()
+        ahead_bytes = 0
 
-    p = Path(input_dir)
-    image_files = [f.absolute() for f in p.glob('**/*.tif') if f.is_file()]
+        def top_up(pool):
+            """Start loading the next images, up to depth images and max_bytes ahead"""
+            nonlocal next_img, ahead_bytes
+            while next_img is not None and len(ahead) < self.depth:
+                try:
+                    nbytes = self.size(next_img)
+                except Exception:
+                    nbytes = 0
+                if ahead and ahead_bytes + nbytes > self.max_bytes:
+                    break
+                ahead.append((next_img, pool.submit(self.load, next_img), nbytes))
+                ahead_bytes += nbytes
+                next_img = next(upcoming, None)
 
-    return image_files
\ No newline at end of file
+        with ThreadPoolExecutor(max_workers=self.depth) as pool:
+            top_up(pool)
+            while ahead:
+                img, future, nbytes = ahead.popleft()
+                ahead_bytes -= nbytes
+                # the following images load while this one is used
+                top_up(pool)
+                try:
+                    data = future.result()
+                except Exception:
+                    data = None
+                yield img, data
@@ -5,69 +5,295 @@
 Main 'measurements' file. Controls all measurements performed on a given image. 
 """
 from collections import namedtuple
+from math import sqrt
 
 import numpy as np
+from scipy import ndimage as ndi
 from scipy import stats
-from skimage.measure import regionprops
 
+from instrument import Stage, timed
 
-def airspace_properties(labeled_img):
+
+# weights of the neighbourhood codes used by skimage.measure.perimeter (Benkrid & Crookes)
+PERIMETER_WEIGHTS = np.zeros(50, dtype=np.float64)
+PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+PERIMETER_WEIGHTS[[21, 33]] = sqrt(2)
+PERIMETER_WEIGHTS[[13, 23]] = (1 + sqrt(2)) / 2
+
+EDGE_NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+CORNER_NEIGHBOURS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def strips(n_rows, strip_rows=None, halo=0):
+    """Split the rows of an image into horizontal strips
+
+    Measurements are accumulated strip by strip so that very large (memory-mapped) label images
+    never have to be held in memory at once. Each strip is extended by 'halo' rows on both sides
+    (where the image has them) for measurements that look at neighbouring rows.
+
+    Arguments:
+        n_rows {int} -- number of rows in the image
+
+    Keyword Arguments:
+        strip_rows {int} -- rows per strip, None for a single strip (default: {None})
+        halo {int} -- rows of context added above and below each strip (default: {0})
+
+    Yields:
+        tuple -- (rows of the strip and its halo, rows of the strip within those rows)
+    """
+    strip_rows = strip_rows or max(n_rows, 1)
+    for lo in range(0, n_rows, strip_rows):
+        hi = min(lo + strip_rows, n_rows)
+        start = max(lo - halo, 0)
+        stop = min(hi + halo, n_rows)
+        yield slice(start, stop), slice(lo - start, hi - start)
+
+
+def as_labels(labeled_img):
+    """Return the label image as an integer array, suitable for np.bincount"""
+    labeled_img = np.asarray(labeled_img)
+    if not np.issubdtype(labeled_img.dtype, np.integer):
+        labeled_img = labeled_img.astype(np.intp)
+
+    return labeled_img
+
+
+def code_histogram(labeled_strip, core, n_labels):
+    """Histogram of the perimeter neighbourhood codes of every label in a strip
+
+    Border pixels are pixels with a 4-neighbour belonging to another label. Each border pixel 
+    is coded by how many of its edge and corner neighbours are border pixels of the same label.
+    Only the pixels in the 'core' rows of the strip are counted - the strip needs two rows of 
+    halo above and below the core (where the image has them) for their codes to be exact.
+
+    Arguments:
+        labeled_strip {np.array} -- labelled strip of the image, integer numpy array
+        core {slice} -- rows of the strip to count
+        n_labels {int} -- number of labels, including the background (max label + 1)
+
+    Returns:
+        np.array -- code counts, n_labels * 50 long (50 codes per label)
+    """
+    padded = np.pad(labeled_strip, 1, mode='constant')
+    center = padded[1:-1, 1:-1]
+
+    border = np.zeros(center.shape, dtype=bool)
+    for di, dj in EDGE_NEIGHBOURS:
+        border |= padded[1 + di:padded.shape[0] - 1 + di, 1 + dj:padded.shape[1] - 1 + dj] != center
+    border &= center != 0
+
+    # only the border pixels contribute to the perimeter - work on their coordinates alone
+    rows, cols = np.nonzero(border[core])
+    rows += core.start + 1
+    cols += 1
+    labels = padded[rows, cols]
+    border = np.pad(border, 1, mode='constant')
+
+    codes = np.ones(len(labels), dtype=np.int64)
+    for weight, neighbours in ((2, EDGE_NEIGHBOURS), (10, CORNER_NEIGHBOURS)):
+        for di, dj in neighbours:
+            same = border[rows + di, cols + dj] & (padded[rows + di, cols + dj] == labels)
+            codes += weight * same
+
+    return np.bincount(labels.astype(np.int64) * 50 + codes, minlength=n_labels * 50)
+
+
+def perimeters(labeled_img, n_labels, strip_rows=None):
+    """Return the perimeter of every label in the image
+
+    Gives the same result as calling skimage.measure.perimeter (4-neighbourhood) on every
+    region, as regionprops does, but for all labels at once: the code histogram of each
+    label is weighted to give its perimeter.
+
+    Arguments:
+        labeled_img {np.array} -- labelled image, integer numpy array
+        n_labels {int} -- number of labels, including the background (max label + 1)
+
+    Keyword Arguments:
+        strip_rows {int} -- measure the image in strips of this many rows (default: {None})
+
+    Returns:
+        np.array -- perimeter of every label in pixels, indexed by label
+    """
+    histogram = np.zeros(n_labels * 50, dtype=np.int64)
+    for outer, core in strips(labeled_img.shape[0], strip_rows, halo=2):
+        histogram += code_histogram(as_labels(labeled_img[outer]), core, n_labels)
+
+    return histogram.reshape(n_labels, 50) @ PERIMETER_WEIGHTS
+
+
+def airspace_properties(labeled_img, strip_rows=None):
     """Return the properties of the airspaces.
 
     Measures the areas, perimeters, equivalent diameters of airspaces, and 
     the number of airspaces in a given image. measurements are returned in
-    pixels.
+    pixels. All airspaces are measured in a single vectorized pass over the
+    image (areas are counted with np.bincount) instead of one regionprops 
+    object per airspace.
     
     Arguments:
         labeled_img {np.array} -- binary image, uint16 numpy array
+
+    Keyword Arguments:
+        strip_rows {int} -- measure the image in strips of this many rows (default: {None})
     
     Returns:
-        [named tuple] -- area, perimeter, equivalent diameter, and number of objects
+        [named tuple] -- area, perimeter, equivalent diameter, number of objects and the label of every object
     """
-    props = regionprops(labeled_img)
-    
-    areas = [p.area for p in props]
-    dias = [p.equivalent_diameter for p in props]
-    pers = [p.perimeter for p in props]
+    counts = np.zeros(1, dtype=np.int64)
+    for outer, _ in strips(labeled_img.shape[0], strip_rows):
+        strip_counts = np.bincount(as_labels(labeled_img[outer]).ravel())
+        if len(strip_counts) > len(counts):
+            counts = np.pad(counts, (0, len(strip_counts) - len(counts)), mode='constant')
+        counts[:len(strip_counts)] += strip_counts
+
+    present = np.flatnonzero(counts[1:]) + 1
+
+    areas = counts[present]
+    dias = np.sqrt(4 * areas / np.pi)
+    pers = perimeters(labeled_img, len(counts), strip_rows)[present]
     obj_num = len(areas)
 
-    Measurements = namedtuple('Measurements', ['obj_num', 'areas', 'dias', 'pers'])
-    m = Measurements(obj_num, areas, dias, pers)
+    Measurements = namedtuple('Measurements', ['obj_num', 'areas', 'dias', 'pers', 'labels'])
+    m = Measurements(obj_num, areas, dias, pers, present)
 
     return m
 
 
-def mli(labeled_img):
+def neighbours(airspace, rows, cols, offset):
+    """Return the pixels at a fixed offset from every pixel of airspace[rows, cols]
+
+    Pixels that fall outside the image are returned as tissue (False).
+
+    Arguments:
+        airspace {np.array} -- boolean airspace image
+        rows {slice} -- rows of the test pixels
+        cols {slice} -- columns of the test pixels
+        offset {tuple} -- (rows, columns) offset of the neighbours
+
+    Returns:
+        np.array -- boolean array with the shape of airspace[rows, cols]
+    """
+    shifted = []
+    for index, size, delta in ((rows, airspace.shape[0], offset[0]), (cols, airspace.shape[1], offset[1])):
+        r = range(size)[index]
+        start = r.start + delta
+        first = 0 if start >= 0 else (r.step - start - 1) // r.step
+        last = min(len(r), max(0, (size - 1 - start) // r.step + 1))
+        shifted.append((len(r), first, last, slice(start + first * r.step, start + last * r.step, r.step)))
+
+    (n_rows, r0, r1, rs), (n_cols, c0, c1, cs) = shifted
+    out = np.zeros((n_rows, n_cols), dtype=bool)
+    if r1 > r0 and c1 > c0:
+        out[r0:r1, c0:c1] = airspace[rs, cs]
+
+    return out
+
+
+def scan_lines(shape, direction, spacing):
+    """Yield the pixels on every spacing-th test line of one direction
+
+    Horizontal (0) and vertical (90) lines are single strided slices. Diagonal lines (45, 135)
+    are covered by 'spacing' strided slices, one per row offset, so that the cost of every 
+    direction is proportional to the number of pixels on its test lines.
+
+    Arguments:
+        shape {tuple} -- shape of the image
+        direction {int} -- orientation of the test lines in degrees, one of 0, 45, 90 or 135
+        spacing {int} -- distance between test lines in pixels
+
+    Yields:
+        tuple -- (row slice, column slice) of test pixels
+    """
+    if direction == 0:
+        yield slice(0, shape[0], spacing), slice(0, shape[1], 1)
+    elif direction == 90:
+        yield slice(0, shape[0], 1), slice(0, shape[1], spacing)
+    else:
+        for r in range(min(spacing, shape[0])):
+            # 135 degree lines have a constant column - row, 45 degree lines a constant column + row
+            c = r if direction == 135 else -r % spacing
+            yield slice(r, shape[0], spacing), slice(c, shape[1], spacing)
+
+
+# offset of the previous pixel on a test line and the length of one pixel step along it
+MLI_DIRECTIONS = {0: ((0, -1), 1.0),
+                  45: ((-1, 1), sqrt(2)),
+                  90: ((-1, 0), 1.0),
+                  135: ((-1, -1), sqrt(2))}
+
+
+def strip_lines(rows, outer, core):
+    """Return the rows of a set of test lines that fall in the core of a strip
+
+    Arguments:
+        rows {slice} -- rows of the test lines in the whole image
+        outer {slice} -- rows of the strip (with its halo) in the whole image
+        core {slice} -- rows of the strip within the outer rows
+
+    Returns:
+        slice -- rows of the test lines relative to the outer rows
+    """
+    lo = outer.start + core.start
+    hi = outer.start + core.stop
+    first = lo + (rows.start - lo) % rows.step if lo >= rows.start else rows.start
+
+    return slice(first - outer.start, hi - outer.start, rows.step)
+
+
+def mli(labeled_img, directions=(0,), spacing=1, strip_rows=None):
     """Calculates the Mean Linear Intercept
     
-    Calculates the Mean Linear Intercept (mli) by raster scanning the image and 
-    returning a list of the lengths of unbroken 'airspace' segments
+    Calculates the Mean Linear Intercept (mli) by scanning the image along test lines and 
+    returning the mean length of unbroken 'airspace' segments. The mean is the total length 
+    of the airspace pixels on the test lines divided by the number of segments, and segments 
+    are counted by their first pixels, so every direction is measured in one vectorized pass.
+    By default every row of the image is used as a horizontal test line.
 
     Arguments:
         labeled_img {np.array} -- binary image, uint16 numpy array
+
+    Keyword Arguments:
+        directions {tuple} -- orientations of the test lines in degrees: 0 (rows), 45, 90 (columns) 
+                              and/or 135. Intercepts of all directions are pooled (default: {(0,)})
+        spacing {int} -- use every spacing-th test line of each direction (default: {1})
+        strip_rows {int} -- measure the image in strips of this many rows (default: {None})
     
     Returns:
         float -- length of Mean linear intercept in pixels
     """
-    # get length of consecutive stretches of white pixels per row
-    intercepts = []
-    for row in labeled_img:
-        result = np.diff(np.where(np.concatenate(([row[0]], row[:-1] != row[1:], [True])))[0])[::2]
-        for measurement in result:
-            intercepts.append(measurement)
-
-    mli = np.mean(intercepts)
+    length = 0.0
+    segments = 0
+    for outer, core in strips(labeled_img.shape[0], strip_rows, halo=1):
+        airspace = np.asarray(labeled_img[outer]) != 0
+        for direction in directions:
+            offset, step = MLI_DIRECTIONS[direction]
+            for rows, cols in scan_lines(labeled_img.shape, direction, spacing):
+                rows = strip_lines(rows, outer, core)
+                line_pixels = airspace[rows, cols]
+                # a segment starts at an airspace pixel that begins a line or follows tissue
+                segments += np.count_nonzero(line_pixels > neighbours(airspace, rows, cols, offset))
+                length += np.count_nonzero(line_pixels) * step
+
+    if segments == 0:
+        return np.nan
+
+    mli = np.float64(length) / segments
     
     return mli
 
 
-def expansion(labeled_img):
+def expansion(labeled_img, airspaces=None):
     """Calculate the Expansion Index
 
     Ratio of the total area of the airspaces : total area of the tissue
     
     Arguments:
         labeled_img {np.array} -- binary image, uint16 numpy array
+
+    Keyword Arguments:
+        airspaces {named tuple} -- result of airspace_properties for this image, reused 
+                                   instead of measuring the image again (default: {None})
     
     Returns:
         float -- estimate of the Expansion Index
@@ -77,7 +303,10 @@ def expansion(labeled_img):
     total_area = x * y
 
     # calculate the sum of all airspaces measured in the image 
-    airspace_area = np.sum(airspace_properties(labeled_img).areas)
+    if airspaces is None:
+        airspace_area = np.count_nonzero(labeled_img)
+    else:
+        airspace_area = np.sum(airspaces.areas)
     tissue_area = total_area - airspace_area
     exp =  airspace_area / tissue_area * 100
 
@@ -113,11 +342,79 @@ def d_indeces(dia_ar):
     return d
 
 
-def measure_all(labeled_img, **kwargs):
+# one row of the per-airspace table - sizes in calibrated units, positions in pixels
+OBJECT_DTYPE = np.dtype([("Label", np.int32), ("Area(sq_um)", np.float64), ("Perimeter(um)", np.float64),
+                         ("Dia(um)", np.float64), ("Centroid_Row(px)", np.float32), ("Centroid_Col(px)", np.float32),
+                         ("Min_Row(px)", np.int32), ("Min_Col(px)", np.int32), ("Max_Row(px)", np.int32),
+                         ("Max_Col(px)", np.int32)])
+
+
+def object_table(labeled_img, airspaces=None, **kwargs):
+    """Return a table of every airspace in the image
+
+    Centroids are summed with np.bincount and bounding boxes found with ndimage.find_objects,
+    strip by strip like the other measurements. Bounding boxes follow the regionprops convention:
+    the max row and column are one past the last pixel of the airspace.
+
+    Arguments:
+        labeled_img {np.array} -- labeled image, integer numpy array
+
+    Keyword Arguments:
+        airspaces {named tuple} -- result of airspace_properties for this image, reused
+                                   instead of measuring the image again (default: {None})
+
+    Returns:
+        np.array -- structured array of OBJECT_DTYPE, one row per airspace in label order
+    """
+    scale = kwargs.get('scale')
+    strip_rows = kwargs.get('tile_size') or None
+    if airspaces is None:
+        airspaces = airspace_properties(labeled_img, strip_rows)
+
+    n_labels = int(airspaces.labels[-1]) + 1 if airspaces.obj_num else 1
+    row_sums = np.zeros(n_labels, dtype=np.float64)
+    col_sums = np.zeros(n_labels, dtype=np.float64)
+    bbox_min = np.full((n_labels, 2), np.iinfo(np.int32).max, dtype=np.int64)
+    bbox_max = np.zeros((n_labels, 2), dtype=np.int64)
+    for outer, _ in strips(labeled_img.shape[0], strip_rows):
+        strip = as_labels(labeled_img[outer])
+        rows, cols = np.indices(strip.shape, sparse=True)
+        flat = strip.ravel()
+        row_sums += np.bincount(flat, weights=np.broadcast_to(rows + outer.start, strip.shape).ravel(), minlength=n_labels)
+        col_sums += np.bincount(flat, weights=np.broadcast_to(cols, strip.shape).ravel(), minlength=n_labels)
+
+        found = [(i, s) for i, s in enumerate(ndi.find_objects(strip), start=1) if s is not None]
+        if found:
+            idx = np.array([i for i, _ in found])
+            lo = np.array([(r.start + outer.start, c.start) for _, (r, c) in found])
+            hi = np.array([(r.stop + outer.start, c.stop) for _, (r, c) in found])
+            bbox_min[idx] = np.minimum(bbox_min[idx], lo)
+            bbox_max[idx] = np.maximum(bbox_max[idx], hi)
+
+    labels = airspaces.labels
+    table = np.zeros(airspaces.obj_num, dtype=OBJECT_DTYPE)
+    table["Label"] = labels
+    table["Area(sq_um)"] = airspaces.areas / scale ** 2
+    table["Perimeter(um)"] = airspaces.pers / scale
+    table["Dia(um)"] = airspaces.dias / scale
+    table["Centroid_Row(px)"] = row_sums[labels] / airspaces.areas
+    table["Centroid_Col(px)"] = col_sums[labels] / airspaces.areas
+    table["Min_Row(px)"], table["Min_Col(px)"] = bbox_min[labels].T
+    table["Max_Row(px)"], table["Max_Col(px)"] = bbox_max[labels].T
+
+    return table
+
+
+def measure_all(labeled_img, airspaces=None, image=None, **kwargs):
     """Call all measurement functions and return data in calibrated units
     
     Arguments:
         labeled_img {np.array} -- binary image, uint16 numpy array
+
+    Keyword Arguments:
+        airspaces {named tuple} -- result of airspace_properties for this image, reused
+                                   instead of measuring the image again (default: {None})
+        image {str} -- Path to the image, the measurements are recorded as its stages (default: {None})
     
     Returns:
         dict -- all measurements for a given image
@@ -127,10 +424,15 @@ def measure_all(labeled_img, **kwargs):
     um = 1 / scale
     sq_um = (1 / scale) ** 2
 
-    airspaces = airspace_properties(labeled_img)
-    m = mli(labeled_img)
-    e = expansion(labeled_img)
-    d = d_indeces(airspaces.dias)
+    # large (tiled) images are measured in strips of tile_size rows
+    strip_rows = kwargs.get('tile_size') or None
+
+    if airspaces is None:
+        airspaces = timed("regionprops", image, airspace_properties, labeled_img, strip_rows)
+    m = timed("mli", image, mli, labeled_img, kwargs.get('mli_directions', (0,)), kwargs.get('mli_spacing', 1), strip_rows)
+    e = timed("expansion", image, expansion, labeled_img, airspaces)
+    with Stage("d_indices", image, labeled_img.size):
+        d = d_indeces(airspaces.dias)
 
     obj_num = airspaces.obj_num
     mean_area = np.mean(airspaces.areas) * sq_um
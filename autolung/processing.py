@@ -10,78 +10,133 @@ thresholded using a local thresholding method ('mean'). Small holes in the thres
 the filled image is then used as inout for connected component labelling. Measurements are then made on the 
 labeled image.
 """
-from pathlib import Path
+import inspect
 import warnings
 
-from skimage import io
-from skimage.color import rgb2gray
 from skimage.filters import threshold_local
 from skimage.morphology import remove_small_holes, remove_small_objects, label
 from skimage.exposure import equalize_adapthist
-import matplotlib.pyplot as plt
+from scipy import ndimage as ndi
 import numpy as np
 
+from load_images import read_grey
+from cache import open_cache, run_stages
+from threshold import local_statistic
 from measure import measure_all
 from metadata import extract_metadata
+from qc import queue_qc, render_qc
+from instrument import Stage, timed
 
 
-def convert_to_grey(img):
-    """Convert RBG image to gray
+def working_dtype(**kwargs):
+    """Return the floating point type used by the pre-processing steps
+
+    'precision' is gathered from the config file, 'float64' (default) or 'float32'.
+
+    Returns:
+        np.dtype -- float32 or float64
+    """
+    return np.dtype(kwargs.get('precision') or 'float64')
+
+
+def convert_to_grey(img, **kwargs):
+    """Read an RGB image as gray
+
+    The image is read with load_images.read_grey, so the full RGB image is never held in memory.
+    'grey_channel' is gathered from the config file: the luminance (default) or a single channel.
     
     Arguments:
-        img {ndarray} -- RGB image, image to convert
+        img {str} -- Path to the RGB image to convert
     
     Returns:
-        ndarray -- converted image (grayscale)
+        ndarray -- converted image (grayscale, in the working precision)
     """
-    orig = io.imread(img)
-    grey = rgb2gray(orig)
+    grey = read_grey(img, channel=kwargs.get('grey_channel'), dtype=working_dtype(**kwargs))
 
     return grey
 
 
-def enhance_contrast(grey_img):
+def enhance_contrast(grey_img, **kwargs):
     """Enhance the contrast of the greyscale image using CLAHE
     
     Arguments:
         grey_img {ndarray} -- grayscale image
     
     Returns:
-        ndarray -- grayscale image with enhanced contrast
+        ndarray -- grayscale image with enhanced contrast, in the working precision
     """
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
         enhanced = equalize_adapthist(grey_img)
 
-    return enhanced
+    return enhanced.astype(working_dtype(**kwargs), copy=False)
 
 
-def binarize(grey_img, **kwargs):
+def threshold_surface(grey_img, **kwargs):
+    """Compute the local threshold surface of the gray image, before 'constant' is subtracted
+
+    'block size' and 'method' are gathered from the config file. 'threshold_engine' selects
+    skimage's threshold_local or the faster, equivalent implementation in threshold.py ('fast',
+    default). The surface does not depend on 'constant': computing it once, the image can be
+    thresholded with any number of constants by binarize(grey_img, surface=surface), each a single
+    comparison (milliseconds instead of seconds).
+
+    Arguments:
+        grey_img {ndarray} -- grayscale image
+
+    Returns:
+        ndarray -- local mean, median or gaussian mean of every pixel
+    """
+    block_size = kwargs.get('block_size')
+    met = kwargs.get('method')
+
+    grey_img = np.asarray(grey_img, dtype=working_dtype(**kwargs))
+    if kwargs.get('threshold_engine') == 'skimage':
+        return threshold_local(grey_img, block_size, method=met, offset=0)
+
+    return local_statistic(grey_img, block_size, method=met)
+
+
+def binarize(grey_img, surface=None, **kwargs):
     """Apply a threshold to the gray image
 
     'block size' and 'constant' are gathered from the config file and are 
-    used in the thresholding function.
+    used in the thresholding function (see threshold_surface).
     
     Arguments:
         grey_img {ndarray} -- grayscale image
+
+    Keyword Arguments:
+        surface {ndarray} -- threshold_surface of grey_img with the same settings (default: {None}, computed here)
     
     Returns:
         ndarray -- binary image
     """
-    block_size = kwargs.get('block_size')
     constant = kwargs.get('constant')
-    met = kwargs.get('method')
 
-    local_thresh = threshold_local(grey_img, block_size, method=met, offset=constant)
-    binary_local = grey_img > local_thresh
+    grey_img = np.asarray(grey_img, dtype=working_dtype(**kwargs))
+    if surface is None:
+        surface = threshold_surface(grey_img, **kwargs)
+    binary_local = grey_img > surface - constant
 
     return binary_local
 
 
+# connectivity used by remove_small_objects/remove_small_holes (1) and label (2)
+EDGE_CONNECTED = ndi.generate_binary_structure(2, 1)
+FULLY_CONNECTED = ndi.generate_binary_structure(2, 2)
+# rows of a label image counted at a time by component_sizes
+COUNT_ROWS = 256
+# scikit-image 0.26 replaced min_size/area_threshold (remove sizes < limit) by max_size (sizes <= limit)
+SKIMAGE_MAX_SIZE = 'max_size' in inspect.signature(remove_small_objects).parameters
+
+
 def fill_holes(binary_img, **kwargs):
     """Fill holes in the thresholded image
 
-    Fill small holes that are not actual airspaces using morphological operations.
+    Fill small holes that are not actual airspaces using morphological operations. Objects
+    smaller than 'min_alv_size' and holes smaller than 'max_speckle_size' are removed, with any
+    version of scikit-image.
     
     Arguments:
         binary_img {ndarray} -- binary (thresholded) image
@@ -92,8 +147,12 @@ def fill_holes(binary_img, **kwargs):
     min_alv_size = kwargs.get('min_alv_size')
     max_speckle_size = kwargs.get('max_speckle_size')
 
-    remove_objects = remove_small_objects(binary_img, min_size=min_alv_size)
-    remove_holes = remove_small_holes(remove_objects, area_threshold=max_speckle_size)
+    if SKIMAGE_MAX_SIZE:
+        remove_objects = remove_small_objects(binary_img, max_size=max(min_alv_size - 1, 0))
+        remove_holes = remove_small_holes(remove_objects, max_size=max(max_speckle_size - 1, 0))
+    else:
+        remove_objects = remove_small_objects(binary_img, min_size=min_alv_size)
+        remove_holes = remove_small_holes(remove_objects, area_threshold=max_speckle_size)
 
     return remove_holes
 
@@ -110,10 +169,72 @@ def label_image(filled_binary_img):
     return label(filled_binary_img)
 
 
+def component_sizes(labels, n):
+    """Count the pixels of every label, COUNT_ROWS rows at a time
+
+    Counting a block of rows at a time avoids the full-size copy np.bincount makes of int32 labels.
+
+    Arguments:
+        labels {ndarray} -- label image
+        n {int} -- largest label
+
+    Returns:
+        ndarray -- number of pixels of every label, label 0 is the background
+    """
+    sizes = np.zeros(n + 1, dtype=np.int64)
+    for start in range(0, labels.shape[0], COUNT_ROWS):
+        sizes += np.bincount(labels[start:start + COUNT_ROWS].ravel(), minlength=n + 1)
+
+    return sizes
+
+
+def fill_and_label(binary_img, **kwargs):
+    """Remove small airspaces, fill small holes and label the result in a single stage
+
+    Same result as label_image(fill_holes(binary_img)) - objects smaller than 'min_alv_size' and
+    holes smaller than 'max_speckle_size' (both 4-connected), then the airspaces (8-connected) -
+    but the three labelings share one label image and the filled image is built in place, instead
+    of a copy, an inverted copy, a label image and a 64-bit copy of it for each step. A labeling
+    that cannot change anything (a size of 1 or less) is skipped.
+
+    Arguments:
+        binary_img {ndarray} -- binary (thresholded) image
+
+    Returns:
+        ndarray -- Labeled array, where all connected regions are assigned the same integer value
+    """
+    min_alv_size = kwargs.get('min_alv_size')
+    max_speckle_size = kwargs.get('max_speckle_size')
+
+    labels = np.empty(binary_img.shape, dtype=np.int32)
+    if min_alv_size > 1:
+        n = ndi.label(binary_img, EDGE_CONNECTED, output=labels)
+        keep = component_sizes(labels, n) >= min_alv_size
+        keep[0] = False
+        filled = keep[labels]
+    else:
+        filled = np.array(binary_img, dtype=bool)
+
+    if max_speckle_size > 1:
+        # the holes are the 4-connected components of the background
+        np.logical_not(filled, out=filled)
+        n = ndi.label(filled, EDGE_CONNECTED, output=labels)
+        fill = component_sizes(labels, n) < max_speckle_size
+        fill[0] = False
+        np.logical_not(filled, out=filled)
+        filled |= fill[labels]
+
+    ndi.label(filled, FULLY_CONNECTED, output=labels)
+
+    return labels
+
+
 def preview_process(img, grey, thresh, filled, labeled, **kwargs):
     """If "Yes", save the image processing steps for QC
 
-    By default, saves the image in the same location as the original image in a new folder called QC
+    By default, saves the image in the same location as the original image in a new folder called QC.
+    The panels are downsampled to 'qc_width' (gathered from the config file), see qc.py. The image
+    is rendered and saved in the background, this returns as soon as it is queued.
     
     Arguments:
         grey {ndarray} -- grayscale image
@@ -121,62 +242,44 @@ def preview_process(img, grey, thresh, filled, labeled, **kwargs):
         filled {ndarray} -- binary image with holes filled
         labeled {ndarray} -- labelled image
     """
-    # create new folder 'QC' in images dir and save preview figure as jpg files
-    p = Path(img)
-    Path(p.parent.joinpath('QC')).mkdir(parents=True, exist_ok=True)
-    savename = str(p.stem) + ".jpg"
-    save_loc = p.parent.joinpath('QC', savename)
-
-    # Create mask for the labeled image
-    l = np.ma.masked_where(labeled < 0.05, labeled)
-    cmap_l = plt.cm.get_cmap('prism')
-    cmap_l.set_bad(color = 'black')
-
-    _, axarr = plt.subplots(2,2)
-    axarr[0, 0].imshow(grey, cmap='gray')
-    axarr[0, 1].imshow(thresh, cmap='gray')
-    axarr[1, 0].imshow(filled, cmap='gray')
-    axarr[1, 1].imshow(l, interpolation='none', cmap=cmap_l)
-
-    axarr[0, 0].set_title('Gray Scale Image')
-    axarr[0, 1].set_title('Thresholded Image')
-    axarr[1, 0].set_title('Filled Image')
-    axarr[1, 1].set_title('Connected Components - Airspaces Colored')
-    
-    plt.tight_layout()
-    figure = plt.gcf()
-    figure.set_size_inches(10, 8)
-
-    print(f"Saving QC image to {save_loc}...")
-   
-    plt.savefig(save_loc, dpi=800)
-    plt.close()
+    queue_qc(render_qc, img, grey, thresh, filled, labeled, **kwargs)
 
 
-def process_img(img, preview, **kwargs):
+def process_img(img, preview, grey=None, **kwargs):
     """Perform all pre-processing functions on a given image. 
 
-    The final labelled image is used as input for the measurements module.
+    The final labelled image is used as input for the measurements module. If a Cache_Dir is
+    set, every stage is cached and only the stages whose settings changed are recomputed.
     
     Arguments:
         img {str} -- Path to image to be processed
         preview {str} -- "Yes" or "No" if preview should be displayed
+
+    Keyword Arguments:
+        grey {ndarray} -- the image already read by convert_to_grey, e.g. by the prefetcher (default: {None}, read here)
     
     Returns:
         ndarray -- Labeled array, where all connected regions are assigned the same integer value
     """
-    print("Converting image to grayscale...")
-    grey = convert_to_grey(img)
-    print("Enhancing contrast...")
-    grey_scaled = enhance_contrast(grey)
-    print("Thresholding (this may take a while for large images/block_sizes)...")
-    binary = binarize(grey_scaled, **kwargs)
-    print("Performing morphology operations...")
-    filled = fill_holes(binary, **kwargs)
-    print("Performing connected components labeling...")
-    labeled = label_image(filled)
+    def grey_stage(_):
+        g = grey
+        if g is None:
+            with Stage("grey", img) as s:
+                g = convert_to_grey(img, **kwargs)
+                s.pixels = g.size
+        return timed("clahe", img, enhance_contrast, g, **kwargs)
+
+    stages = [("grey", "Converting image to grayscale and enhancing contrast...", grey_stage),
+              ("surface", "Thresholding (this may take a while for large images/block_sizes)...",
+               lambda grey_scaled: timed("surface", img, threshold_surface, grey_scaled, **kwargs)),
+              ("binary", "Applying the threshold constant...",
+               lambda surface, grey_scaled: timed("threshold", img, binarize, grey_scaled, surface, **kwargs)),
+              ("labeled", "Performing morphology operations and connected components labeling...",
+               lambda binary: timed("morphology", img, fill_and_label, binary, **kwargs))]
+    grey_scaled, _, binary, labeled = run_stages(img, stages, open_cache(**kwargs),
+                                              keep_all=(preview == "Yes"), **kwargs)
 
     if preview == "Yes":
-        preview_process(img, grey_scaled, binary, filled, labeled)
+        preview_process(img, grey_scaled, binary, labeled > 0, labeled, **kwargs)
 
     return labeled
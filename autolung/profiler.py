@@ -0,0 +1,159 @@
+"""Profiling the processing of selected images
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+When an image is selected ('profile_every' N-th image or 'profile_images' file name patterns,
+from the config file or the command line) its processing and measurements are profiled, and
+the results are saved to the 'profile_dir' folder next to the results, named after the path of
+the image relative to the image folder ('image_dir'), quoted:
+
+- 'cprofile' (default): every function call is counted and timed with cProfile. <image>.prof
+  can be opened with pstats, snakeviz or gprof2dot, <image>.txt lists the 40 functions with
+  the largest cumulative time.
+- 'sampling': the stack of the processing thread is sampled every SAMPLE_INTERVAL seconds and
+  saved as folded stacks (<image>.folded), the input of flamegraph.pl and speedscope. Sampling
+  barely slows the processing down, cProfile slows down Python-heavy code by up to 2x.
+
+Images that are not selected are not slowed down at all.
+"""
+import cProfile
+import io
+import pstats
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote
+
+from load_images import matches, image_key
+
+
+# seconds between two samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+# functions listed in the text summary of a cProfile profile
+TOP_FUNCTIONS = 40
+
+
+def should_profile(index, img, **kwargs):
+    """Return True if the processing of an image is to be profiled
+
+    'profile_every' (every N-th image, starting with the first, 0 for none) and 'profile_images'
+    (patterns of file names) are gathered from the config file.
+
+    Arguments:
+        index {int} -- position of the image in the batch
+        img {str} -- Path to the image
+    """
+    every = kwargs.get('profile_every') or 0
+    name = Path(img).name
+
+    return bool(every and index % every == 0) or matches(name, name, kwargs.get('profile_images') or ())
+
+
+class Sampler:
+    """Count the stacks of a thread, sampled from a background thread
+
+    Arguments:
+        thread_id {int} -- threading.get_ident() of the thread to sample
+
+    Keyword Arguments:
+        root {frame} -- outermost frame kept in the stacks, the frames that called it are left out (default: {None})
+        interval {float} -- seconds between samples (default: {SAMPLE_INTERVAL})
+    """
+    def __init__(self, thread_id, root=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name="profile-sampler", daemon=True)
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+                frame = None if frame is self.root else frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        """Save the stacks as folded stacks, one 'frame;frame;frame count' line per stack"""
+        with open(str(path), 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def profile_name(img, image_dir=None):
+    """Return the name the profiles of an image are saved under, without extension
+
+    The path relative to the image folder, without the image's extension and quoted, so images of
+    the same name in different folders (and names with dots) get their own files.
+    """
+    key = image_key(img, image_dir)
+    suffix = Path(key).suffix
+
+    return quote(key[:-len(suffix)] if suffix else key, safe='')
+
+
+def save_cprofile(profile, out, name):
+    """Save a cProfile profile to out/name.prof and its top functions to out/name.txt"""
+    profile.dump_stats(str(out / f"{name}.prof"))
+    text = io.StringIO()
+    pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    (out / f"{name}.txt").write_text(text.getvalue())
+
+
+@contextmanager
+def image_profiler(index, img, **kwargs):
+    """Profile the code run inside the with block if the image is selected (see should_profile)
+
+    'profiler' ('cprofile' or 'sampling') is gathered from the config file, the profile is saved
+    to 'profile_dir' (default: the current directory). A profile that cannot be saved is reported,
+    it does not fail the image.
+
+    Arguments:
+        index {int} -- position of the image in the batch
+        img {str} -- Path to the image
+    """
+    if not should_profile(index, img, **kwargs):
+        yield
+        return
+
+    out = Path(kwargs.get('profile_dir') or ".")
+    name = profile_name(img, kwargs.get('image_dir'))
+    sampling = kwargs.get('profiler') == 'sampling'
+    print(f"Profiling {Path(img).name} ({'sampling' if sampling else 'cProfile'})...")
+    if sampling:
+        # stacks start at the caller of the with block (this generator is run by contextlib's __enter__)
+        profiler = Sampler(threading.get_ident(), root=sys._getframe(2))
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if sampling:
+            profiler.stop()
+        else:
+            profiler.disable()
+        try:
+            out.mkdir(parents=True, exist_ok=True)
+            if sampling:
+                profiler.write(out / f"{name}.folded")
+            else:
+                save_cprofile(profiler, out, name)
+            print(f"Saved the profile of {Path(img).name} to {out}")
+        except OSError as e:
+            print(f"ERROR: Could not save the profile of {Path(img).name} ({e!r})")
@@ -0,0 +1,282 @@
+"""QC images of the processing steps
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Renders the grayscale, thresholded, filled and labeled images of an image side by side in a 2x2
+mosaic and saves it as a JPEG in a 'QC' folder next to the image. Every panel is downsampled
+with NumPy before it is drawn, so the cost and memory of a QC image depend on the QC width
+([Output_Params] QC_Width) instead of the size of the image, and memory-mapped (tiled) images
+are read a strip at a time.
+
+QC images are rendered and saved by a background thread in every process (QCWriter), so the
+measurements and the next image do not wait for them. At most QC_QUEUE_SIZE images wait to be
+saved; queue_qc blocks beyond that, so a slow disk cannot fill up the memory with images.
+"""
+import os
+import queue
+import threading
+from multiprocessing.util import Finalize
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+from skimage.color import hsv2rgb
+
+from instrument import timed
+
+
+PANEL_TITLES = ("Gray Scale Image", "Thresholded Image", "Filled Image", "Connected Components - Airspaces Colored")
+
+# default width of the QC image in pixels
+QC_WIDTH = 1600
+
+# height of the title band above every panel and the gap between panels, in pixels
+TITLE_HEIGHT = 16
+GAP = 4
+
+# output rows downsampled at a time
+STRIP_ROWS = 64
+
+# QC images waiting to be saved before queue_qc blocks
+QC_QUEUE_SIZE = 2
+
+
+def label_lut(n_colors=256):
+    """Return a lookup table of distinct colours for labels
+
+    Hues are spread by the golden ratio so neighbouring labels get very different colours.
+    Entry 0 (the background) is black.
+
+    Keyword Arguments:
+        n_colors {int} -- number of entries, labels wrap around after n_colors - 1 (default: {256})
+
+    Returns:
+        np.array -- (n_colors, 3) uint8 RGB colours
+    """
+    hues = (np.arange(n_colors) * 0.618033988749895) % 1
+    hsv = np.stack([hues, np.full(n_colors, 0.85), np.ones(n_colors)], axis=1)
+    lut = (hsv2rgb(hsv[np.newaxis])[0] * 255).astype(np.uint8)
+    lut[0] = 0
+
+    return lut
+
+
+LABEL_LUT = label_lut()
+
+
+def qc_factor(shape, width):
+    """Return the downsampling factor that fits two panels of an image in a QC image width pixels wide"""
+    return max(1, -(-shape[1] // max(width // 2 - GAP, 1)))
+
+
+def downsample(image, factor):
+    """Downsample an image by averaging factor x factor blocks
+
+    Rows are summed first, as factor strided views of whole rows, then the columns of the
+    (factor times smaller) row sums. Blocks at the bottom and right edge may be smaller. The
+    image is read STRIP_ROWS output rows at a time.
+
+    Arguments:
+        image {ndarray} -- 2D grayscale or binary image
+        factor {int} -- downsampling factor
+
+    Returns:
+        np.array -- float32 image of ceil(rows / factor) x ceil(columns / factor) block means
+    """
+    if factor == 1:
+        return np.asarray(image, dtype=np.float32)
+
+    rows, cols = image.shape
+    col_sizes = np.diff(np.append(np.arange(0, cols, factor), cols))
+    out = np.zeros((-(-rows // factor), len(col_sizes)), dtype=np.float32)
+    step = STRIP_ROWS * factor
+    for lo in range(0, rows, step):
+        strip = np.asarray(image[lo:lo + step])
+        row_sizes = np.diff(np.append(np.arange(0, strip.shape[0], factor), strip.shape[0]))
+        row_sums = np.zeros((len(row_sizes), cols), dtype=np.float32)
+        for i in range(factor):
+            part = strip[i::factor]
+            row_sums[:len(part)] += part
+
+        block = out[lo // factor:lo // factor + len(row_sizes)]
+        for j in range(factor):
+            part = row_sums[:, j::factor]
+            block[:, :part.shape[1]] += part
+        block /= np.outer(row_sizes, col_sizes)
+
+    return out
+
+
+def grey_panel(image, factor):
+    """Return the downsampled RGB panel of a grayscale (0-1) or binary image"""
+    grey = np.clip(downsample(image, factor) * 255 + 0.5, 0, 255).astype(np.uint8)
+
+    return np.repeat(grey[:, :, np.newaxis], 3, axis=2)
+
+
+def label_panel(labeled, factor):
+    """Return the downsampled RGB panel of a labeled image, every label coloured with LABEL_LUT
+
+    Labels are sampled (every factor-th pixel), not averaged.
+    """
+    labels = np.asarray(labeled[::factor, ::factor])
+    index = np.where(labels == 0, 0, (labels - 1) % (len(LABEL_LUT) - 1) + 1)
+
+    return LABEL_LUT[index]
+
+
+def qc_panels(grey, thresh, filled, labeled, **kwargs):
+    """Return the four downsampled QC panels
+
+    'qc_width' is gathered from the config file.
+
+    Arguments:
+        grey {ndarray} -- grayscale image
+        thresh {ndarray} -- thresholded image (binary)
+        filled {ndarray} -- binary image with holes filled
+        labeled {ndarray} -- labelled image
+
+    Returns:
+        list -- RGB uint8 panels
+    """
+    factor = qc_factor(grey.shape, kwargs.get('qc_width') or QC_WIDTH)
+
+    return [grey_panel(grey, factor), grey_panel(thresh, factor), grey_panel(filled, factor), label_panel(labeled, factor)]
+
+
+def mosaic(panels):
+    """Arrange four panels in a 2x2 grid with a title above each
+
+    Arguments:
+        panels {list} -- four RGB uint8 panels of the same size
+
+    Returns:
+        PIL.Image -- the QC image
+    """
+    rows, cols = panels[0].shape[:2]
+    cell_rows = TITLE_HEIGHT + rows + GAP
+    cell_cols = cols + GAP
+    canvas = np.full((2 * cell_rows, 2 * cell_cols, 3), 255, dtype=np.uint8)
+    for i, panel in enumerate(panels):
+        top = (i // 2) * cell_rows + TITLE_HEIGHT
+        left = (i % 2) * cell_cols
+        canvas[top:top + rows, left:left + cols] = panel
+
+    image = Image.fromarray(canvas)
+    draw = ImageDraw.Draw(image)
+    for i, title in enumerate(PANEL_TITLES):
+        draw.text(((i % 2) * cell_cols + 2, (i // 2) * cell_rows + 2), title, fill=(0, 0, 0))
+
+    return image
+
+
+def qc_path(img):
+    """Return the path of the QC image of an image, creating the QC folder next to it"""
+    p = Path(img)
+    p.parent.joinpath('QC').mkdir(parents=True, exist_ok=True)
+
+    return p.parent.joinpath('QC', str(p.stem) + ".jpg")
+
+
+def save_qc(img, panels):
+    """Save the QC image of an image
+
+    Arguments:
+        img {str} -- Path to the processed image
+        panels {list} -- the four panels from qc_panels
+
+    Returns:
+        Path -- path of the saved QC image
+    """
+    save_loc = qc_path(img)
+    print(f"Saving QC image to {save_loc}...")
+    mosaic(panels).save(str(save_loc), quality=90)
+
+    return save_loc
+
+
+def render_qc(img, grey, thresh, filled, labeled, **kwargs):
+    """Render and save the QC image of an image from its processing steps
+
+    Arguments:
+        img {str} -- Path to the processed image
+        grey {ndarray} -- grayscale image
+        thresh {ndarray} -- thresholded image (binary)
+        filled {ndarray} -- binary image with holes filled
+        labeled {ndarray} -- labelled image
+
+    Returns:
+        Path -- path of the saved QC image
+    """
+    return save_qc(img, qc_panels(grey, thresh, filled, labeled, **kwargs))
+
+
+class QCWriter:
+    """Background thread that runs QC jobs one after the other
+
+    Keyword Arguments:
+        max_pending {int} -- jobs waiting to run before submit blocks (default: {QC_QUEUE_SIZE})
+    """
+    def __init__(self, max_pending=QC_QUEUE_SIZE):
+        self.jobs = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.work, name="qc-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        """Queue func(*args, **kwargs), waiting while max_pending jobs are queued"""
+        self.jobs.put((func, args, kwargs))
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                func(*args, **kwargs)
+            except Exception as e:
+                # a QC image is not worth failing the image for - its results are already measured
+                print(f"ERROR: Could not save QC image ({e!r})")
+            finally:
+                self.jobs.task_done()
+
+    def flush(self):
+        """Wait until every queued job has run"""
+        self.jobs.join()
+
+    def close(self):
+        """Run the queued jobs and stop the thread"""
+        self.jobs.put(None)
+        self.thread.join()
+
+
+_writer = None
+
+
+def qc_writer():
+    """Return the QC writer of this process, starting it on first use
+
+    Worker processes do not share the writer of the process they were forked from. The writer
+    is closed (its queue drained) when the process exits.
+
+    Returns:
+        QCWriter -- the writer
+    """
+    global _writer
+    if _writer is None or _writer.pid != os.getpid():
+        _writer = QCWriter()
+        _writer.pid = os.getpid()
+        Finalize(_writer, _writer.close, exitpriority=10)
+
+    return _writer
+
+
+def queue_qc(func, img, *args, **kwargs):
+    """Run func(img, *args, **kwargs) on the QC writer of this process, recorded as the qc stage of img"""
+    qc_writer().submit(timed, "qc", img, func, img, *args, **kwargs)
+
+
+def flush_qc():
+    """Wait until every QC image queued in this process is saved"""
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.flush()
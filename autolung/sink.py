@@ -0,0 +1,92 @@
+"""Streaming, crash-safe results file
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+The results of every image are appended to a JSON Lines file (Lung_Data_<timestamp>.jsonl) in
+the output directory as soon as the image is measured, and written to disk before the next image
+is reported. Nothing is lost if a run is killed part way through: the file can be resumed, and the
+Excel workbook is built from it at the end of the run.
+"""
+import json
+import os
+import time
+from pathlib import Path
+
+
+def to_json(value):
+    """Convert numpy scalars (and anything else json cannot write) for json.dumps"""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def results_name():
+    """Return the name of the results of a run started now, Lung_Data_<timestamp>"""
+    return "Lung_Data_{}".format(time.strftime("%Y%m%d-%H%M%S"))
+
+
+class ResultsSink:
+    """Append-only JSON Lines file of per-image results
+
+    Arguments:
+        path {str} -- path of the .jsonl file, appended to if it exists
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.exists():
+            self.drop_incomplete_line()
+        self.file = open(str(self.path), 'a', encoding='utf-8')
+
+    def drop_incomplete_line(self):
+        """Cut off a last line that was not completely written, so new rows start on a line of their own"""
+        with open(str(self.path), 'rb+') as f:
+            contents = f.read()
+            if contents and not contents.endswith(b"\n"):
+                print(f"WARNING: Removing incomplete last line of {self.path}")
+                f.truncate(contents.rfind(b"\n") + 1)
+
+    @classmethod
+    def create(cls, output_dir):
+        """Start a new results file named after the current time
+
+        Arguments:
+            output_dir {str} -- directory to create the file in
+
+        Returns:
+            ResultsSink -- the new sink
+        """
+        return cls(Path(output_dir) / f"{results_name()}.jsonl")
+
+    def append(self, image, data):
+        """Append the results of one image and flush them to disk
+
+        Arguments:
+            image {str} -- image path
+            data {dict} -- metadata and measurements of the image
+        """
+        self.file.write(json.dumps({"image": str(image), "data": data}, default=to_json) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def read_sink(path):
+    """Read every complete row of a results file
+
+    A last line that was cut off (the run was killed while writing it) is ignored.
+
+    Arguments:
+        path {str} -- path of the .jsonl file
+
+    Returns:
+        list -- {"image": path, "data": results} for every image, in the order they were written
+    """
+    rows = []
+    with open(str(path), encoding='utf-8') as f:
+        for n, line in enumerate(f, start=1):
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                print(f"WARNING: Ignoring incomplete line {n} of {path}")
+
+    return rows
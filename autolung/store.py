@@ -0,0 +1,149 @@
+"""Persistent results store for incremental study runs
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Keeps the results of every image in an SQLite database in the output directory, keyed by the
+image path. Each row records the file size, modification time and content hash of the image and
+a hash of the settings it was processed with. An incremental run only processes images that are
+new, have changed or were processed with different settings, and the output file is written from
+the store, so it covers every image of the study.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from load_images import file_digest
+from sink import to_json
+
+
+STORE_NAME = "autolung_results.sqlite"
+# per-airspace dataset kept next to the store, see export.ObjectsWriter
+OBJECTS_NAME = "autolung_objects"
+# profiles of selected images, see profiler.image_profiler
+PROFILES_NAME = "autolung_profiles"
+
+# settings that change how images are processed, not the results
+IGNORED_SETTINGS = ("workers", "scratch_dir", "cache_dir", "cache_size_mb", "incremental",
+                    "output_formats", "qc_width", "prefetch", "prefetch_mb",
+                    "include", "exclude", "manifest", "profile",
+                    "profile_every", "profile_images", "profiler", "profile_dir", "image_dir",
+                    "export_objects")
+
+
+def settings_hash(**kwargs):
+    """Return a hash of the settings that affect the results
+
+    Returns:
+        str -- hex digest of the settings
+    """
+    settings = {k: v for k, v in kwargs.items() if k not in IGNORED_SETTINGS}
+
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_stat(img):
+    """Return the (size, modification time in ns) of a file"""
+    st = os.stat(str(img))
+
+    return st.st_size, st.st_mtime_ns
+
+
+class ResultsStore:
+    """SQLite store of per-image results
+
+    Arguments:
+        output_dir {str} -- directory the store is kept in
+        settings {str} -- settings hash of this run, from settings_hash
+    """
+    def __init__(self, output_dir, settings):
+        self.settings = settings
+        self.path = Path(output_dir) / STORE_NAME
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("""CREATE TABLE IF NOT EXISTS results (
+                               path TEXT PRIMARY KEY,
+                               size INTEGER,
+                               mtime_ns INTEGER,
+                               digest TEXT,
+                               settings TEXT,
+                               data TEXT,
+                               processed TEXT)""")
+        self.db.commit()
+        # digests pending() already knows, by image path: (size, modification time, digest)
+        self.digests = {}
+
+    def close(self):
+        self.db.close()
+
+    def pending(self, images):
+        """Return the images that have to be (re)processed
+
+        An image is skipped if it was processed with the same settings and its size and
+        modification time are unchanged. If only the modification time changed, the contents
+        are hashed to check whether the image really changed.
+
+        Arguments:
+            images {list} -- image paths of the study
+
+        Returns:
+            list -- images that are new, changed or processed with other settings
+        """
+        todo = []
+        for img in images:
+            row = self.db.execute("SELECT size, mtime_ns, digest, settings FROM results WHERE path = ?",
+                                  (str(img),)).fetchone()
+            size, mtime_ns = file_stat(img)
+            if row is not None and row[0] == size and row[1] == mtime_ns:
+                # unchanged, e.g. processed with other settings - the stored digest is still valid
+                self.digests[str(img)] = (size, mtime_ns, row[2])
+            if row is None or row[3] != self.settings or row[0] != size:
+                todo.append(img)
+            elif row[1] != mtime_ns:
+                digest = file_digest(img)
+                if digest == row[2]:
+                    # touched but not modified
+                    self.db.execute("UPDATE results SET mtime_ns = ? WHERE path = ?", (mtime_ns, str(img)))
+                else:
+                    self.digests[str(img)] = (size, mtime_ns, digest)
+                    todo.append(img)
+        self.db.commit()
+
+        return todo
+
+    def add(self, img, data):
+        """Store the results of an image, replacing any previous results
+
+        The digest found by pending() is reused while the file is unchanged, so an image is only
+        hashed here when it was never hashed before (new or resized images).
+
+        Arguments:
+            img {str} -- image path
+            data {dict} -- metadata and measurements of the image
+        """
+        size, mtime_ns = file_stat(img)
+        known = self.digests.pop(str(img), None)
+        digest = known[2] if known is not None and known[:2] == (size, mtime_ns) else file_digest(img)
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (str(img), size, mtime_ns, digest, self.settings,
+                         json.dumps(data, default=to_json), time.strftime("%Y-%m-%d %H:%M:%S")))
+        self.db.commit()
+
+    def results(self, images):
+        """Return the stored results of the given images, processed with the settings of this run
+
+        Arguments:
+            images {list} -- image paths of the study
+
+        Returns:
+            list -- results (dicts) of the images found in the store, in the order of images
+        """
+        data = []
+        for img in images:
+            row = self.db.execute("SELECT data FROM results WHERE path = ? AND settings = ?",
+                                  (str(img), self.settings)).fetchone()
+            if row is not None:
+                data.append(json.loads(row[0]))
+
+        return data
@@ -0,0 +1,313 @@
+"""Parameter sweeps
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Measures a set of images with every combination of values of the thresholding and morphology
+settings, to find the settings that suit a study:
+
+    python -m autolung sweep --images DIR --config FILE --out DIR --grid Block_Size=151:351:50 --grid Constant=0,0.01,0.02
+
+Values are given per setting (Block_Size, Method, Constant, Min_Alveolar_Size, Max_Speckle_Size)
+as a list ('0, 0.01, 0.02') or an inclusive range ('start:stop:step'), on the command line or in a
+[Sweep] section of the config file. The other settings are taken from the config file.
+
+The stages every combination shares are computed once per image and the combinations fan out
+from them: the grayscale and contrast enhanced image once, the threshold surface once per
+(Block_Size, Method) and applied with every Constant, the airspaces of a threshold labeled once for every
+Min_Alveolar_Size and the holes once per Min_Alveolar_Size for every Max_Speckle_Size, so only
+labeling and measuring the final image are done once per combination.
+
+The results are one row per image and combination (Sweep_<timestamp>_results) and the mean, SD
+and count of every measurement over the images per combination (Sweep_<timestamp>_summary).
+"""
+import configparser
+import itertools
+import time
+import traceback
+from collections import namedtuple, OrderedDict
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage as ndi
+
+from load_config import number
+from processing import (convert_to_grey, enhance_contrast, threshold_surface, binarize, label_image,
+                        component_sizes, EDGE_CONNECTED)
+from batch import is_tiled, run_pool
+from tiling import process_img_tiled
+from measure import measure_all
+from metadata import extract_metadata
+from export import RAW_COLUMNS, MEASURE_COLUMNS, STAT_NAMES, write_tables
+
+
+# config file name -> setting name of the settings that can be swept, in the order they are used
+SWEEP_KEYS = OrderedDict([("Block_Size", "block_size"), ("Method", "method"), ("Constant", "constant"),
+                          ("Min_Alveolar_Size", "min_alv_size"), ("Max_Speckle_Size", "max_speckle_size")])
+SURFACE_SETTINGS = ("block_size", "method")
+# statistics of every measurement over the images of a combination
+SWEEP_STATS = ("mean", "std", "count")
+
+SweepResult = namedtuple('SweepResult', ['index', 'image', 'rows', 'error'])
+
+
+def parse_values(text):
+    """Return the values of a setting: a comma separated list of values and/or start:stop:step ranges
+
+    Ranges include stop. Numbers are ints when they are whole numbers, anything else is text.
+
+    Arguments:
+        text {str} -- e.g. '151:351:50', '0, 0.01, 0.02' or 'mean, gaussian'
+
+    Returns:
+        list -- the values
+    """
+    values = []
+    for part in str(text).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if ':' in part:
+            start, stop, step = (float(p) for p in part.split(':'))
+            if step <= 0:
+                raise ValueError(f"range '{part}' needs a positive step")
+            n = int((stop - start) / step + 1e-9) + 1
+            values.extend(number(round(start + i * step, 10)) for i in range(n))
+        else:
+            try:
+                values.append(number(part))
+            except ValueError:
+                values.append(part.lower())
+
+    return values
+
+
+def validate_grid(grid):
+    """Drop the values that are not valid for their setting, reporting them
+
+    Arguments:
+        grid {dict} -- setting name -> list of values
+
+    Returns:
+        dict -- setting name -> list of valid values, without duplicates
+    """
+    checks = {"block_size": (lambda v: isinstance(v, int) and v > 1 and v % 2 == 1, "odd integers greater than 1"),
+              "method": (lambda v: v in ('mean', 'median', 'gaussian'), "'mean', 'median' or 'gaussian'"),
+              "constant": (lambda v: isinstance(v, (int, float)), "numbers"),
+              "min_alv_size": (lambda v: isinstance(v, int) and v >= 0, "positive integers"),
+              "max_speckle_size": (lambda v: isinstance(v, int) and v >= 0, "positive integers")}
+    names = {v: k for k, v in SWEEP_KEYS.items()}
+
+    valid = {}
+    for key, values in grid.items():
+        check, allowed = checks[key]
+        invalid = [v for v in values if not check(v)]
+        if invalid:
+            print(f"ERROR: Invalid {names[key]} values {invalid} -- must be {allowed}, leaving them out of the sweep")
+        valid[key] = list(OrderedDict.fromkeys(v for v in values if check(v)))
+        if not valid[key]:
+            raise ValueError(f"No valid {names[key]} values to sweep")
+
+    return valid
+
+
+def read_grid(config_file, options=()):
+    """Return the values of every swept setting
+
+    Arguments:
+        config_file {str} -- config file, its [Sweep] section (if any) gives values per setting
+
+    Keyword Arguments:
+        options {list} -- 'Key=values' from the command line, they replace the config file (default: {()})
+
+    Returns:
+        dict -- setting name -> list of values, for the settings that are swept
+    """
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(config_file)
+    specs = OrderedDict(config['Sweep']) if config.has_section('Sweep') else OrderedDict()
+    for option in options:
+        key, sep, values = option.partition('=')
+        if not sep:
+            raise ValueError(f"--grid '{option}' must be Key=values")
+        specs[key.strip()] = values
+
+    lower = {k.lower(): k for k in SWEEP_KEYS}
+    grid = {}
+    for key, values in specs.items():
+        if key.lower() not in lower:
+            raise ValueError(f"'{key}' cannot be swept -- must be one of {', '.join(SWEEP_KEYS)}")
+        grid[SWEEP_KEYS[lower[key.lower()]]] = parse_values(values)
+
+    return validate_grid(grid)
+
+
+def combinations(grid, **kwargs):
+    """Return every combination of the swept values, the other settings from kwargs
+
+    Returns:
+        list -- {setting name: value} for every swept setting, the last setting changing fastest
+    """
+    keys = list(SWEEP_KEYS.values())
+    values = [grid.get(k, [kwargs.get(k)]) for k in keys]
+
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def components(binary_img):
+    """Label the edge-connected components of a binary image and count their pixels
+
+    Labeling once serves every size limit: the components of at least n pixels are
+    (sizes >= n)[labels], the same as remove_small_objects(binary_img, min_size=n) in fill_holes.
+
+    Returns:
+        tuple -- (labels, number of pixels of every label, label 0 is the background)
+    """
+    labels = np.empty(binary_img.shape, dtype=np.int32)
+    n = ndi.label(binary_img, EDGE_CONNECTED, output=labels)
+
+    return labels, component_sizes(labels, n)
+
+
+def sweep_image(img, combos, **kwargs):
+    """Measure an image with every combination of settings, sharing the stages they have in common
+
+    Arguments:
+        img {str} -- Path to the image
+        combos {list} -- settings of every combination, from combinations()
+
+    Returns:
+        list -- (index of the combination, metadata and measurements) for every combination
+    """
+    img_name = Path(img).name
+    md = extract_metadata(img, **kwargs)
+    rows = []
+
+    if is_tiled(img, **kwargs):
+        # tiles are processed end to end, nothing can be shared between the combinations
+        print(f"WARNING: {img_name} is processed in tiles -- every combination is processed in full")
+        for i, combo in enumerate(combos):
+            settings = {**kwargs, **combo}
+            rows.append((i, {**md, **measure_all(process_img_tiled(img, "No", **settings), **settings)}))
+        return rows
+
+    print(f"Converting {img_name} to grayscale and enhancing contrast...")
+    enhanced = enhance_contrast(convert_to_grey(img, **kwargs), **kwargs)
+
+    def group(indices, keys):
+        """Split combinations (by index) into runs sharing the values of keys"""
+        ordered = sorted(indices, key=lambda i: [str(combos[i][k]) for k in keys])
+        return itertools.groupby(ordered, key=lambda i: tuple(combos[i][k] for k in keys))
+
+    for (block_size, method), by_surface in group(range(len(combos)), SURFACE_SETTINGS):
+        print(f"Thresholding {img_name} with Block_Size {block_size}, Method {method}...")
+        surface = threshold_surface(enhanced, **{**kwargs, "block_size": block_size, "method": method})
+        for (constant,), by_threshold in group(by_surface, ("constant",)):
+            binary = binarize(enhanced, surface, **{**kwargs, "constant": constant})
+            # fill_holes for every (Min_Alveolar_Size, Max_Speckle_Size) from one labeling of the
+            # airspaces and one of the holes per Min_Alveolar_Size
+            objects, object_sizes = components(binary)
+            for (min_alv_size,), by_size in group(by_threshold, ("min_alv_size",)):
+                keep = object_sizes >= min_alv_size
+                keep[0] = False
+                airspaces = keep[objects]
+                holes, hole_sizes = components(~airspaces)
+                for i in by_size:
+                    settings = {**kwargs, **combos[i]}
+                    fill = hole_sizes < settings['max_speckle_size']
+                    fill[0] = False
+                    labeled = label_image(airspaces | fill[holes])
+                    rows.append((i, {**md, **measure_all(labeled, **settings)}))
+
+    return sorted(rows, key=lambda row: row[0])
+
+
+def run_one(index, img, combos, **kwargs):
+    """Sweep a single image, capturing any error instead of raising it
+
+    Returns:
+        SweepResult -- (index, image, rows, error) where error is None on success
+    """
+    try:
+        rows = sweep_image(img, combos, **kwargs)
+        error = None
+    except Exception:
+        rows = None
+        error = traceback.format_exc()
+
+    return SweepResult(index, img, rows, error)
+
+
+def run_sweep(images, combos, workers=1, on_result=None, initializer=None, **kwargs):
+    """Sweep a set of images, optionally spread over a pool of worker processes (one image per worker)
+
+    Arguments:
+        images {list} -- image paths
+        combos {list} -- settings of every combination, from combinations()
+
+    Keyword Arguments:
+        workers {int} -- number of worker processes (default: {1})
+        on_result {callable} -- called as on_result(n_done, result) after every image (default: {None})
+        initializer {callable} -- run once in every worker process on start up (default: {None})
+
+    Returns:
+        list -- SweepResult for every image, in the same order as images
+    """
+    results = [None] * len(images)
+
+    def collect_result(done, result):
+        if on_result is not None:
+            on_result(done, result)
+        results[result.index] = result
+
+    if workers <= 1 or len(images) <= 1:
+        for i, img in enumerate(images):
+            print(f"Sweeping image {i + 1}/{len(images)}...")
+            collect_result(i + 1, run_one(i, img, combos, **kwargs))
+        return results
+
+    # a worker process that dies (e.g. out of memory) only fails the image it was sweeping
+    run_pool(partial(run_one, combos=combos, **kwargs), enumerate(images), min(workers, len(images)), collect_result,
+             lambda i, img, error: SweepResult(i, img, None, error), initializer=initializer)
+
+    return results
+
+
+def sweep_tables(results, combos):
+    """Build the results and summary tables of a sweep
+
+    Arguments:
+        results {list} -- SweepResult of every image
+        combos {list} -- settings of every combination
+
+    Returns:
+        dict -- {"results": one row per image and combination, "summary": statistics per combination}
+    """
+    keys = list(SWEEP_KEYS)
+    settings = pd.DataFrame([{name: combo[key] for name, key in SWEEP_KEYS.items()} for combo in combos])
+    settings.insert(0, "Combination", range(1, len(combos) + 1))
+
+    rows = [{"Combination": i + 1, **data} for r in results if r.rows for i, data in r.rows]
+    measured = pd.DataFrame(rows, columns=["Combination"] + RAW_COLUMNS)
+    table = settings.merge(measured, on="Combination").sort_values(["FileName", "Combination"], kind="stable")
+
+    grouped = table.groupby("Combination", sort=True)[MEASURE_COLUMNS]
+    stats = {stat: grouped.agg(stat) for stat in SWEEP_STATS}
+    columns = {f"{col}_{STAT_NAMES[stat]}": stats[stat][col] for col in MEASURE_COLUMNS for stat in SWEEP_STATS}
+    summary = settings.merge(pd.DataFrame(columns).reset_index(), on="Combination")
+
+    return {"results": table[["Combination"] + keys + RAW_COLUMNS].reset_index(drop=True), "summary": summary}
+
+
+def write_sweep(results, combos, output_path, formats=("excel",)):
+    """Write the tables of a sweep to Sweep_<timestamp> files in output_path
+
+    Returns:
+        list -- paths of the files that were written
+    """
+    print(f"Writing sweep results to {output_path}")
+    base_name = str(Path(output_path) / "Sweep_{}".format(time.strftime("%Y%m%d-%H%M%S")))
+
+    return write_tables(sweep_tables(results, combos), base_name, formats)
@@ -0,0 +1,467 @@
+"""Tiled processing of very large images
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Whole-slide scans are too large to keep the grayscale, contrast enhanced, binary, filled and
+labelled images in memory at once. Here every step of process_img is run on overlapping tiles
+and the full-size intermediate images are kept in temporary memory-mapped files, so memory use
+depends on the tile size instead of the image size.
+
+- Contrast enhancement is exact: CLAHE is computed over the whole image (intensity range, kernel
+  size and contextual region histograms), then applied tile by tile.
+- Thresholding is exact: the halo around each tile is sized from block_size so every pixel sees
+  the same neighbourhood as in threshold_local on the whole image.
+- Small objects, small holes and the final labels are found per tile and stitched across the
+  tile seams, so an airspace crossing a seam is counted (and sized) once.
+"""
+import tempfile
+import warnings
+
+import numpy as np
+from scipy import ndimage as ndi
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage import img_as_uint
+from skimage.exposure import rescale_intensity
+
+from load_images import open_image, to_grey
+from processing import binarize, working_dtype, EDGE_CONNECTED, FULLY_CONNECTED
+from qc import qc_factor, grey_panel, label_panel, save_qc, queue_qc, QC_WIDTH
+from instrument import Stage
+
+
+def scratch_array(shape, dtype, scratch_dir=None):
+    """Create a full-size array backed by a temporary file
+
+    The file is removed as soon as the array is no longer used.
+
+    Arguments:
+        shape {tuple} -- shape of the array
+        dtype {np.dtype} -- data type of the array
+
+    Keyword Arguments:
+        scratch_dir {str} -- directory for the temporary file, None for the system default (default: {None})
+
+    Returns:
+        np.memmap -- writable memory-mapped array
+    """
+    return np.memmap(tempfile.TemporaryFile(dir=scratch_dir), dtype=dtype, mode='w+', shape=shape)
+
+
+def tiles(shape, tile_size, halo=0):
+    """Split an image into square tiles
+
+    Arguments:
+        shape {tuple} -- (rows, columns) of the image
+        tile_size {int} -- length of the tile sides in pixels
+
+    Keyword Arguments:
+        halo {int} -- pixels of context added around each tile, where the image has them (default: {0})
+
+    Yields:
+        tuple -- (tile in the image, tile with its halo in the image, tile within the tile with halo)
+    """
+    for r0 in range(0, shape[0], tile_size):
+        for c0 in range(0, shape[1], tile_size):
+            r1 = min(r0 + tile_size, shape[0])
+            c1 = min(c0 + tile_size, shape[1])
+            hr0, hc0 = max(r0 - halo, 0), max(c0 - halo, 0)
+            hr1, hc1 = min(r1 + halo, shape[0]), min(c1 + halo, shape[1])
+
+            yield ((slice(r0, r1), slice(c0, c1)),
+                   (slice(hr0, hr1), slice(hc0, hc1)),
+                   (slice(r0 - hr0, r1 - hr0), slice(c0 - hc0, c1 - hc0)))
+
+
+def threshold_halo(block_size, method):
+    """Return the halo needed for threshold_local to be exact inside a tile
+
+    Arguments:
+        block_size {int} -- threshold block size
+        method {str} -- threshold method ('mean', 'median' or 'gaussian')
+
+    Returns:
+        int -- halo in pixels
+    """
+    if method == 'gaussian':
+        # radius of the gaussian kernel used by threshold_local (sigma from block_size, truncated at 4 sigma)
+        sigma = (block_size - 1) / 6.0
+        return int(4.0 * sigma + 0.5)
+
+    return block_size // 2
+
+
+# gray levels equalize_adapthist works on
+CLAHE_LEVELS = 2**14
+
+
+def clip_histogram(hist, clip_limit):
+    """Clip a histogram and redistribute the clipped counts over the bins below the limit
+
+    Same as the (private) helper of skimage's equalize_adapthist, so the tiled CLAHE matches it exactly.
+
+    Arguments:
+        hist {ndarray} -- histogram, modified in place
+        clip_limit {int} -- maximum count of a bin
+
+    Returns:
+        ndarray -- the clipped histogram
+    """
+    excess_mask = hist > clip_limit
+    excess = hist[excess_mask]
+    n_excess = excess.sum() - excess.size * clip_limit
+    hist[excess_mask] = clip_limit
+
+    # every bin gets the same share of the excess, bins that would exceed the limit are set to it
+    bin_incr = n_excess // hist.size
+    upper = clip_limit - bin_incr
+
+    low_mask = hist < upper
+    n_excess -= hist[low_mask].size * bin_incr
+    hist[low_mask] += bin_incr
+
+    mid_mask = np.logical_and(hist >= upper, hist < clip_limit)
+    mid = hist[mid_mask]
+    n_excess += mid.sum() - mid.size * clip_limit
+    hist[mid_mask] = clip_limit
+
+    # the rest is spread evenly over the bins still below the limit
+    while n_excess > 0:
+        prev_n_excess = n_excess
+        for index in range(hist.size):
+            under_mask = hist < clip_limit
+            step_size = max(1, np.count_nonzero(under_mask) // n_excess)
+            under_mask = under_mask[index::step_size]
+            hist[index::step_size][under_mask] += 1
+            n_excess -= np.count_nonzero(under_mask)
+            if n_excess <= 0:
+                break
+        if prev_n_excess == n_excess:
+            break
+
+    return hist
+
+
+def map_histogram(hist, min_val, max_val, n_pixels):
+    """Return the gray level mapping (lookup table) equalizing clipped histograms
+
+    Arguments:
+        hist {ndarray} -- clipped histograms, the bins along the last axis
+        min_val {int} -- lowest gray level of the mapping
+        max_val {int} -- highest gray level of the mapping
+        n_pixels {int} -- pixels of a contextual region
+
+    Returns:
+        ndarray -- gray level of every bin
+    """
+    out = np.cumsum(hist, axis=-1).astype(float)
+    out *= (max_val - min_val) / n_pixels
+    out += min_val
+    np.clip(out, a_min=None, a_max=max_val, out=out)
+
+    return out.astype(int)
+
+
+def clahe_regions(size, kernel):
+    """Return how many times every row (column) of an image is counted in each CLAHE contextual region
+
+    As in equalize_adapthist, the image is reflected at its end to a whole number of kernels and
+    region i covers the rows i * kernel to (i + 1) * kernel.
+
+    Arguments:
+        size {int} -- rows (columns) of the image
+        kernel {int} -- CLAHE kernel size along the rows (columns)
+
+    Returns:
+        ndarray -- (regions, size) counts
+    """
+    pad_end = (kernel - size % kernel) % kernel + int(np.ceil(kernel / 2.0))
+    n_regions = (size + kernel // 2 + pad_end) // kernel - 1
+    index = np.arange(n_regions * kernel)
+    if size > 1:
+        period = 2 * (size - 1)
+        index %= period
+        index = np.where(index >= size, period - index, index)
+    else:
+        index[:] = 0
+    counts = np.zeros((n_regions, size), np.int64)
+    np.add.at(counts, (np.arange(n_regions * kernel) // kernel, index), 1)
+
+    return counts
+
+
+def clahe_coefficients(start, stop, kernel, n_regions):
+    """Return the two nearest contextual regions of rows (columns) start to stop and their interpolation weights
+
+    Returns:
+        tuple -- ((previous region, weight), (next region, weight))
+    """
+    padded = np.arange(start, stop) + kernel // 2
+    frac = (padded % kernel) / kernel
+    block = padded // kernel
+
+    return ((np.clip(block - 1, 0, n_regions - 1), 1 - frac), (np.clip(block, 0, n_regions - 1), frac))
+
+
+def clahe_levels(grey_img, in_range):
+    """Scale a grayscale image to the gray levels CLAHE works on, over the intensity range of the whole image"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        levels = rescale_intensity(img_as_uint(grey_img), in_range=in_range, out_range=(0, CLAHE_LEVELS - 1))
+
+    return np.round(levels).astype(np.min_scalar_type(CLAHE_LEVELS))
+
+
+def tiled_enhance(rgb, out, **kwargs):
+    """Convert to grayscale and enhance contrast tile by tile - identical to enhance_contrast on the whole image
+
+    CLAHE (equalize_adapthist with its defaults) is computed over the whole image: the intensity
+    range and the kernel size (1/8 of the image) are those of the whole image, and the histogram
+    of every contextual region is gathered from all the tiles it covers. A pixel is then mapped
+    from its own gray level and the histograms of its four nearest regions, so tiles need no halo.
+
+    Arguments:
+        rgb {ndarray} -- RGB image
+        out {ndarray} -- array the contrast enhanced image is written to
+    """
+    tile_size = kwargs.get('tile_size')
+    channel = kwargs.get('grey_channel')
+    kernel = [max(s // 8, 1) for s in out.shape]
+    nbins = 256
+    bin_size = 1 + CLAHE_LEVELS // nbins
+
+    # gray image and its intensity range
+    lo, hi = np.inf, -np.inf
+    for core, _, _ in tiles(out.shape, tile_size):
+        out[core] = to_grey(rgb[core], channel, out.dtype)
+        lo, hi = min(lo, out[core].min()), max(hi, out[core].max())
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        in_range = tuple(img_as_uint(np.array([lo, hi], dtype=out.dtype)))
+
+    # histograms of the contextual regions
+    row_counts, col_counts = clahe_regions(out.shape[0], kernel[0]), clahe_regions(out.shape[1], kernel[1])
+    hist = np.zeros((len(row_counts), len(col_counts), nbins), np.int64)
+    for core, _, _ in tiles(out.shape, tile_size):
+        bins = clahe_levels(out[core], in_range) // bin_size
+        r, c = core
+        for i in np.flatnonzero(row_counts[:, r].any(axis=1)):
+            wr = row_counts[i, r]
+            rows = slice(np.flatnonzero(wr)[0], np.flatnonzero(wr)[-1] + 1)
+            for j in np.flatnonzero(col_counts[:, c].any(axis=1)):
+                wc = col_counts[j, c]
+                cols = slice(np.flatnonzero(wc)[0], np.flatnonzero(wc)[-1] + 1)
+                # rows and columns reflected at the end of the image are counted twice
+                weights = np.outer(wr[rows], wc[cols])
+                if (weights == 1).all():
+                    hist[i, j] += np.bincount(bins[rows, cols].ravel(), minlength=nbins)
+                else:
+                    hist[i, j] += np.bincount(bins[rows, cols].ravel(), weights.ravel(), nbins).astype(np.int64)
+
+    kernel_elements = kernel[0] * kernel[1]
+    clip_limit = int(np.clip(0.01 * kernel_elements, 1, None))
+    hist = np.apply_along_axis(clip_histogram, -1, hist, clip_limit=clip_limit)
+    maps = map_histogram(hist, 0, CLAHE_LEVELS - 1, kernel_elements)
+
+    # interpolate the mappings of the four nearest regions, in the same order and precision as equalize_adapthist
+    lo, hi = np.inf, -np.inf
+    for core, _, _ in tiles(out.shape, tile_size):
+        levels = clahe_levels(out[core], in_range)
+        bins = levels // bin_size
+        r, c = core
+        result = np.zeros(levels.shape, np.float32)
+        for rr, wr in clahe_coefficients(r.start, r.stop, kernel[0], len(row_counts)):
+            for cc, wc in clahe_coefficients(c.start, c.stop, kernel[1], len(col_counts)):
+                mapped = maps[rr[:, None], cc[None, :], bins]
+                result += (mapped * (wc[None, :] * wr[:, None])).astype(np.float32)
+        out[core] = result.astype(levels.dtype)
+        lo, hi = min(lo, out[core].min()), max(hi, out[core].max())
+
+    # stretch to the intensity range of the whole enhanced image
+    for core, _, _ in tiles(out.shape, tile_size):
+        out[core] = rescale_intensity(np.asarray(out[core]), in_range=(lo, hi))
+
+
+def tiled_binarize(grey_img, out, **kwargs):
+    """Threshold the image tile by tile - identical to binarize on the whole image
+
+    Arguments:
+        grey_img {ndarray} -- grayscale image
+        out {ndarray} -- array the binary image is written to
+    """
+    tile_size = kwargs.get('tile_size')
+    halo = threshold_halo(kwargs.get('block_size'), kwargs.get('method'))
+    for core, outer, inner in tiles(out.shape, tile_size, halo):
+        out[core] = binarize(np.asarray(grey_img[outer]), **kwargs)[inner]
+
+
+def seam_edges(left, right, structure):
+    """Return the pairs of labels that touch across a tile seam
+
+    Arguments:
+        left {ndarray} -- labels of the last row/column before the seam
+        right {ndarray} -- labels of the first row/column after the seam
+        structure {ndarray} -- connectivity structure
+
+    Returns:
+        tuple -- arrays of the connected labels on both sides of the seam
+    """
+    # fully connected labels also touch diagonally across the seam
+    shifts = (-1, 0, 1) if structure.all() else (0,)
+    a, b = [], []
+    for shift in shifts:
+        l = left[max(shift, 0):len(left) + min(shift, 0)]
+        r = right[max(-shift, 0):len(right) + min(-shift, 0)]
+        touching = (l != 0) & (r != 0)
+        a.append(l[touching])
+        b.append(r[touching])
+
+    return np.concatenate(a), np.concatenate(b)
+
+
+def tiled_label(binary_img, out, structure, tile_size):
+    """Label the connected components of an image tile by tile
+
+    Every tile is labelled on its own, then labels touching across the tile seams are merged
+    (with scipy's connected components on the graph of touching labels) and relabelled so
+    that every component has a single label.
+
+    Arguments:
+        binary_img {ndarray} -- binary image
+        out {ndarray} -- int32 array the labels are written to
+        structure {ndarray} -- connectivity structure, EDGE_CONNECTED or FULLY_CONNECTED
+        tile_size {int} -- length of the tile sides in pixels
+
+    Returns:
+        tuple -- (number of components, size of every component indexed by label)
+    """
+    rows, cols = out.shape
+    sizes = [np.zeros(1, dtype=np.int64)]
+    # labels in the first and last row (column) of every band of tiles, for merging across seams
+    first_row, last_row, first_col, last_col = {}, {}, {}, {}
+    n = 0
+    for core, _, _ in tiles(out.shape, tile_size):
+        labels, count = ndi.label(np.asarray(binary_img[core]), structure, output=np.int32)
+        sizes.append(np.bincount(labels.ravel(), minlength=count + 1)[1:])
+        labels[labels > 0] += n
+        out[core] = labels
+        n += count
+
+        r, c = core
+        first_row.setdefault(r.start, np.zeros(cols, np.int32))[c] = labels[0]
+        last_row.setdefault(r.stop, np.zeros(cols, np.int32))[c] = labels[-1]
+        first_col.setdefault(c.start, np.zeros(rows, np.int32))[r] = labels[:, 0]
+        last_col.setdefault(c.stop, np.zeros(rows, np.int32))[r] = labels[:, -1]
+
+    sizes = np.concatenate(sizes)
+
+    a, b = [np.zeros(0, np.int32)], [np.zeros(0, np.int32)]
+    for first, last in ((first_row, last_row), (first_col, last_col)):
+        for seam in first.keys() & last.keys():
+            left, right = seam_edges(last[seam], first[seam], structure)
+            a.append(left)
+            b.append(right)
+
+    # merge labels touching across seams - the background (0) never touches anything, so it
+    # stays component 0 and the merged labels are numbered 1..n_components
+    a, b = np.concatenate(a), np.concatenate(b)
+    graph = coo_matrix((np.ones(len(a), dtype=np.int8), (a, b)), shape=(n + 1, n + 1))
+    n_components, lut = connected_components(graph, directed=False)
+    lut = lut.astype(np.int32)
+    component_sizes = np.bincount(lut, weights=sizes).astype(np.int64)
+
+    for core, _, _ in tiles(out.shape, tile_size):
+        out[core] = lut[out[core]]
+
+    return n_components - 1, component_sizes
+
+
+def tiled_fill_holes(binary_img, out, **kwargs):
+    """Remove small objects and fill small holes - identical to fill_holes on the whole image
+
+    Arguments:
+        binary_img {ndarray} -- binary (thresholded) image
+        out {ndarray} -- array the filled image is written to
+    """
+    tile_size = kwargs.get('tile_size')
+    scratch_dir = kwargs.get('scratch_dir') or None
+    min_alv_size = kwargs.get('min_alv_size')
+    max_speckle_size = kwargs.get('max_speckle_size')
+
+    labels = scratch_array(out.shape, np.int32, scratch_dir)
+
+    # remove objects smaller than min_alv_size (4-connected, as remove_small_objects)
+    _, sizes = tiled_label(binary_img, labels, EDGE_CONNECTED, tile_size)
+    keep = sizes >= min_alv_size
+    keep[0] = False
+    for core, _, _ in tiles(out.shape, tile_size):
+        out[core] = keep[labels[core]]
+
+    # fill holes smaller than max_speckle_size (4-connected background, as remove_small_holes)
+    holes = scratch_array(out.shape, bool, scratch_dir)
+    for core, _, _ in tiles(out.shape, tile_size):
+        holes[core] = ~out[core]
+    _, sizes = tiled_label(holes, labels, EDGE_CONNECTED, tile_size)
+    fill = sizes < max_speckle_size
+    fill[0] = False
+    for core, _, _ in tiles(out.shape, tile_size):
+        out[core] |= fill[labels[core]]
+
+
+def process_img_tiled(img, preview, **kwargs):
+    """Perform all pre-processing functions on a large image, tile by tile
+
+    Same steps as process_img. All full-size intermediate images are kept in temporary
+    memory-mapped files.
+
+    Arguments:
+        img {str} -- Path to image to be processed
+        preview {str} -- "Yes" or "No" if preview should be displayed
+
+    Returns:
+        np.memmap -- Labeled array, where all connected regions are assigned the same integer value
+    """
+    tile_size = kwargs.get('tile_size')
+    scratch_dir = kwargs.get('scratch_dir') or None
+
+    with Stage("load", img) as s:
+        rgb = open_image(img, scratch=True)
+        s.pixels = rgb.shape[0] * rgb.shape[1]
+    shape = rgb.shape[:2]
+    pixels = shape[0] * shape[1]
+    print(f"Processing {shape[1]}x{shape[0]} image in {tile_size}x{tile_size} tiles...")
+
+    # QC panels are downsampled from every step before its full-size image is released
+    factor = qc_factor(shape, kwargs.get('qc_width') or QC_WIDTH)
+    panels = []
+    print("Converting image to grayscale and enhancing contrast...")
+    grey_scaled = scratch_array(shape, working_dtype(**kwargs), scratch_dir)
+    # tiles are converted to gray and enhanced in one pass, recorded as clahe
+    with Stage("clahe", img, pixels):
+        tiled_enhance(rgb, grey_scaled, **kwargs)
+    if preview == "Yes":
+        panels.append(grey_panel(grey_scaled, factor))
+    print("Thresholding (this may take a while for large images/block_sizes)...")
+    binary = scratch_array(shape, bool, scratch_dir)
+    with Stage("threshold", img, pixels):
+        tiled_binarize(grey_scaled, binary, **kwargs)
+    del grey_scaled
+    if preview == "Yes":
+        panels.append(grey_panel(binary, factor))
+    print("Performing morphology operations...")
+    filled = scratch_array(shape, bool, scratch_dir)
+    with Stage("morphology", img, pixels):
+        tiled_fill_holes(binary, filled, **kwargs)
+    del binary
+    if preview == "Yes":
+        panels.append(grey_panel(filled, factor))
+    print("Performing connected components labeling...")
+    labeled = scratch_array(shape, np.int32, scratch_dir)
+    with Stage("label", img, pixels):
+        tiled_label(filled, labeled, FULLY_CONNECTED, tile_size)
+
+    if preview == "Yes":
+        panels.append(label_panel(labeled, factor))
+        queue_qc(save_qc, img, panels)
+
+    return labeled
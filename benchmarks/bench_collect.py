@@ -0,0 +1,59 @@
+"""Benchmark finding the images of a study
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Compares load_images.collect (os.scandir, skipping QC folders) with the previous approach,
+Path.glob('**/*.tif') and a stat of every match, and with reusing a manifest. The study is a
+tree of empty image files with a QC folder of JPEGs next to every folder of images, as left by
+a run with QC images. The operating system caches the directories after the first walk, so
+the times are those of a warm cache - the gain on a network share is larger.
+
+    python benchmarks/bench_collect.py
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+from load_images import collect
+
+
+def glob_collect(input_dir):
+    """Previous implementation - glob every .tif and stat it"""
+    return [f.absolute() for f in Path(input_dir).glob('**/*.tif') if f.is_file()]
+
+
+def best_time(func, repeat=5):
+    """Return the best wall-clock time of func() and its result"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+def make_study(root, animals=100, images=50):
+    """Create animals folders of images empty .tif files, each with a QC folder of .jpg files"""
+    for a in range(animals):
+        folder = Path(root, f"animal_{a:03d}")
+        folder.joinpath("QC").mkdir(parents=True)
+        for i in range(images):
+            folder.joinpath(f"img_{i:03d}.tif").write_bytes(b"")
+            folder.joinpath("QC", f"img_{i:03d}.jpg").write_bytes(b"")
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        make_study(tmp)
+        t_glob, old = best_time(lambda: glob_collect(tmp))
+        t_scan, new = best_time(lambda: collect(tmp))
+        collect(tmp, manifest="manifest.json")
+        t_manifest, listed = best_time(lambda: collect(tmp, manifest="manifest.json"))
+        assert sorted(old) == new == listed
+
+        print(f"{len(new)} images: glob + is_file {t_glob * 1000:.1f} ms, "
+              f"scandir {t_scan * 1000:.1f} ms, manifest {t_manifest * 1000:.1f} ms")
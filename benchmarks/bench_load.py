@@ -0,0 +1,67 @@
+"""Benchmark reading images as grayscale
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Compares load_images.read_grey (memory-mapped, strip by strip, float32) with the previous
+approach, which decoded the whole RGB image with skimage.io and converted it with rgb2gray
+(float64). Peak memory is the largest amount of memory allocated by numpy during the read, as
+traced by tracemalloc - memory-mapped file pages are not counted as they can be dropped by the
+operating system at any time.
+
+    python benchmarks/bench_load.py
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import tifffile
+from skimage import io
+from skimage.color import rgb2gray
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+from load_images import read_grey
+from synthetic import lung_rgb
+
+
+def imread_rgb2gray(img):
+    """Previous implementation - decode the whole image, then convert to float64 gray"""
+    return rgb2gray(io.imread(img))
+
+
+def measure(func, img, repeat=3):
+    """Return the best wall-clock time and the peak traced memory (MB) of func(img)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(img)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = func(img)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return min(times), peak, result
+
+
+if __name__ == '__main__':
+    shape = (3840, 5120)
+    rgb = lung_rgb(shape)
+    with tempfile.TemporaryDirectory() as tmp:
+        for compression in (None, 'zlib'):
+            img = str(Path(tmp) / f"{compression}.tif")
+            tifffile.imwrite(img, rgb, compression=compression)
+
+            t_old, m_old, old = measure(imread_rgb2gray, img)
+            t_new, m_new, new = measure(read_grey, img)
+            t_green, m_green, _ = measure(lambda i: read_grey(i, channel='green', dtype=np.uint8), img)
+            assert np.allclose(old, new, atol=1e-6)
+
+            print(f"{shape[1]}x{shape[0]} {compression or 'uncompressed'}: "
+                  f"imread + rgb2gray {t_old:.3f} s / {m_old:.0f} MB, "
+                  f"read_grey float32 {t_new:.3f} s / {m_new:.0f} MB, "
+                  f"read_grey green uint8 {t_green:.3f} s / {m_green:.0f} MB")
@@ -0,0 +1,64 @@
+"""Benchmark the airspace measurements
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Compares the single-pass measurement engine (measure.airspace_properties + measure.expansion)
+with the previous approach, which ran regionprops over the image once for the airspace
+properties and a second time inside expansion.
+
+    python benchmarks/bench_measure.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from skimage.measure import regionprops
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+from measure import airspace_properties, expansion
+from synthetic import lung_labels
+
+
+def regionprops_measurements(labeled_img):
+    """Previous implementation - regionprops for the properties and again for the expansion index"""
+    props = regionprops(labeled_img)
+    areas = [p.area for p in props]
+    dias = [p.equivalent_diameter for p in props]
+    pers = [p.perimeter for p in props]
+    airspace_area = np.sum([p.area for p in regionprops(labeled_img)])
+
+    return areas, dias, pers, airspace_area
+
+
+def single_pass_measurements(labeled_img):
+    """Current implementation - one vectorized pass shared with the expansion index"""
+    airspaces = airspace_properties(labeled_img)
+    e = expansion(labeled_img, airspaces)
+
+    return airspaces.areas, airspaces.dias, airspaces.pers, e.airspace_area
+
+
+def best_of(func, arg, repeat=3):
+    """Return the best wall-clock time of repeat calls and the last result"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+
+if __name__ == '__main__':
+    for shape in ((1920, 2560), (3840, 5120)):
+        labeled = lung_labels(shape)
+        t_old, old = best_of(regionprops_measurements, labeled)
+        t_new, new = best_of(single_pass_measurements, labeled)
+
+        assert np.array_equal(old[0], new[0]) and old[3] == new[3]
+        assert np.allclose(old[1], new[1]) and np.allclose(old[2], new[2])
+
+        print(f"{shape[1]}x{shape[0]} ({labeled.max()} airspaces): "
+              f"regionprops x2 {t_old:.3f} s, single pass {t_new:.3f} s, speedup {t_old / t_new:.1f}x")
@@ -0,0 +1,94 @@
+"""Benchmark the morphology and labeling of a thresholded image
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Compares processing.fill_and_label with the previous steps, fill_holes (remove_small_objects and
+remove_small_holes) followed by label_image, on thresholded synthetic lung images, and checks that
+both give the same label image. Counts the labeling passes over the whole image (calls of
+scipy's and skimage's label) and the peak memory allocated by each, traced by tracemalloc, as a
+multiple of the size of the binary image.
+
+    python benchmarks/bench_morphology.py
+"""
+import sys
+import time
+import tracemalloc
+import warnings
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import scipy.ndimage
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+import processing
+from load_config import load_settings
+from load_images import to_grey
+from processing import enhance_contrast, binarize, fill_holes, label_image, fill_and_label
+from synthetic import lung_rgb
+
+
+CONFIG = Path(__file__).resolve().parents[1] / 'docs' / 'settings_files' / '10X_2560x1920_general.ini'
+
+
+@contextmanager
+def count_labelings(counts):
+    """Count the calls of scipy.ndimage.label and of the skimage label used by label_image
+
+    Newer skimage versions label with scipy, a call of skimage's label is only counted when it did not.
+    """
+    ndi_label, sk_label = scipy.ndimage.label, processing.label
+
+    def counted_ndi(*args, **kwargs):
+        counts.append(ndi_label)
+        return ndi_label(*args, **kwargs)
+
+    def counted_sk(*args, **kwargs):
+        before = len(counts)
+        result = sk_label(*args, **kwargs)
+        if len(counts) == before:
+            counts.append(sk_label)
+        return result
+
+    scipy.ndimage.label, processing.label = counted_ndi, counted_sk
+    try:
+        yield
+    finally:
+        scipy.ndimage.label, processing.label = ndi_label, sk_label
+
+
+def measure(func, binary, repeat=3):
+    """Return the best time (s), the peak traced memory (bytes), the labeling passes and the result of func(binary)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(binary)
+        times.append(time.perf_counter() - start)
+
+    counts = []
+    tracemalloc.start()
+    with count_labelings(counts):
+        func(binary)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(times), peak, len(counts), result
+
+
+if __name__ == '__main__':
+    # deprecation warnings of newer skimage versions would drown the results
+    warnings.simplefilter("ignore", FutureWarning)
+    settings = load_settings(str(CONFIG))
+
+    for shape in ((1920, 2560), (3840, 5120)):
+        grey = enhance_contrast(to_grey(lung_rgb(shape), dtype=np.float32), **settings)
+        binary = binarize(grey, **settings)
+
+        t_old, m_old, n_old, old = measure(lambda b: label_image(fill_holes(b, **settings)), binary)
+        t_new, m_new, n_new, new = measure(lambda b: fill_and_label(b, **settings), binary)
+        assert np.array_equal(old, new)
+
+        print(f"{shape[1]}x{shape[0]}: fill_holes + label_image {t_old:.3f} s, {n_old} labelings, "
+              f"{m_old / binary.nbytes:.1f}x the binary image; "
+              f"fill_and_label {t_new:.3f} s, {n_new} labelings, {m_new / binary.nbytes:.1f}x")
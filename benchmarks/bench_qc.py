@@ -0,0 +1,91 @@
+"""Benchmark the QC images
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Times processing.process_img on a synthetic 2560x1920 field without QC, with the NumPy/Pillow QC
+image (qc.py) and with the previous matplotlib figure (a 10x8 inch figure saved at 800 dpi).
+Peak memory of the QC step is traced with tracemalloc.
+
+    python benchmarks/bench_qc.py
+"""
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import tifffile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+from processing import process_img
+from qc import qc_panels, save_qc
+from synthetic import lung_rgb
+
+
+SETTINGS = {"block_size": 251, "constant": 0, "method": "mean", "min_alv_size": 500, "max_speckle_size": 100}
+
+
+def matplotlib_qc(img, grey, thresh, filled, labeled):
+    """Previous implementation - a 2x2 pyplot figure saved at 800 dpi"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from matplotlib import colormaps
+
+    save_loc = Path(img).parent / "QC" / (Path(img).stem + "_matplotlib.jpg")
+    l = np.ma.masked_where(labeled < 0.05, labeled)
+    cmap_l = colormaps['prism'].copy()
+    cmap_l.set_bad(color='black')
+
+    _, axarr = plt.subplots(2, 2)
+    axarr[0, 0].imshow(grey, cmap='gray')
+    axarr[0, 1].imshow(thresh, cmap='gray')
+    axarr[1, 0].imshow(filled, cmap='gray')
+    axarr[1, 1].imshow(l, interpolation='none', cmap=cmap_l)
+    plt.tight_layout()
+    plt.gcf().set_size_inches(10, 8)
+    plt.savefig(save_loc, dpi=800)
+    plt.close()
+
+
+def timed(func, *args, repeat=3):
+    """Return the best wall-clock time and the peak traced memory (MB) of func(*args)
+
+    Memory is traced in a separate call, as tracing slows numpy down.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return min(times), peak
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp:
+        img = str(Path(tmp) / "A-L-1.tif")
+        tifffile.imwrite(img, lung_rgb((1920, 2560)))
+
+        t_process = timed(lambda: process_img(img, "No", **SETTINGS))[0]
+
+        # the stages as preview_process receives them
+        from processing import convert_to_grey, enhance_contrast, binarize, fill_holes, label_image
+        grey = enhance_contrast(convert_to_grey(img, **SETTINGS), **SETTINGS)
+        binary = binarize(grey, **SETTINGS)
+        filled = fill_holes(binary, **SETTINGS)
+        labeled = label_image(filled)
+
+        print(f"process_img without QC: {t_process:.2f} s")
+        for width in (1024, 1600, 2048, 4096):
+            t_qc, m_qc = timed(lambda: save_qc(img, qc_panels(grey, binary, filled, labeled, qc_width=width)))
+            print(f"QC_Width {width}: {t_qc:.3f} s ({100 * t_qc / t_process:.1f}% of processing), peak {m_qc:.0f} MB")
+        t_old, m_old = timed(matplotlib_qc, img, grey, binary, filled, labeled, repeat=1)
+        print(f"matplotlib at 800 dpi: {t_old:.2f} s ({100 * t_old / t_process:.0f}% of processing), peak {m_old:.0f} MB")
@@ -0,0 +1,53 @@
+"""Benchmark the grouped summary of the results
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Times export.summarize (mean, SD, SEM, count, median and Obj_Num weighted means of every
+measurement per group) on synthetic results tables of increasing size, next to the plain
+groupby mean that the Grouped Averages sheet used before.
+
+    python benchmarks/bench_summary.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+from export import summarize, RAW_COLUMNS, GROUP_KEYS
+
+
+def results_table(n_rows, n_animals=200, seed=0):
+    """Return a synthetic results table, one row per image of n_animals animals and 4 locations"""
+    rng = np.random.default_rng(seed)
+    data = {col: rng.random(n_rows) * 100 for col in RAW_COLUMNS}
+    data["Obj_Num"] = rng.integers(50, 500, n_rows)
+    data["Animal_id"] = np.array([f"A{i}" for i in range(n_animals)], dtype=object)[rng.integers(0, n_animals, n_rows)]
+    data["Location"] = np.array(["L", "R", "M", "S"], dtype=object)[rng.integers(0, 4, n_rows)]
+    data["Img_num"] = rng.integers(0, 100, n_rows)
+    for col in ("FileName", "Species", "Magnification", "Fixed_Field"):
+        data[col] = np.full(n_rows, "x", dtype=object)
+
+    return pd.DataFrame(data)
+
+
+def best_of(func, *args, repeat=3):
+    """Return the fastest wall-clock time of repeat calls of func(*args)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+if __name__ == '__main__':
+    for n_rows in (1000, 100000, 1000000):
+        df = results_table(n_rows)
+        t_new = best_of(summarize, df)
+        t_old = best_of(lambda d: d.groupby(GROUP_KEYS).mean(numeric_only=True), df)
+        print(f"{n_rows} rows: summarize {t_new:.3f} s, groupby mean only {t_old:.3f} s")
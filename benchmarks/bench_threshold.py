@@ -0,0 +1,61 @@
+"""Benchmark the local thresholds
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Compares threshold.local_threshold ([Threshold_Params] Engine = fast) with
+skimage.filters.threshold_local (Engine = skimage) on contrast enhanced synthetic lung images,
+and checks that both give the same binary image. Older skimage versions computed the mean with
+a separable convolution, whose cost grows with block_size - it is timed as well. The median is
+timed on a smaller image as threshold_local takes minutes for it at full size.
+
+    python benchmarks/bench_threshold.py
+"""
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.filters import threshold_local
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+from load_images import to_grey
+from processing import enhance_contrast
+from threshold import local_threshold
+from synthetic import lung_rgb
+
+
+def convolve_mean(image, block_size):
+    """Mean threshold of older skimage versions - two 1D convolutions with a block_size long kernel"""
+    kernel = np.full(block_size, 1.0 / block_size)
+    rows = ndi.convolve1d(image, kernel, axis=0, mode='reflect')
+
+    return ndi.convolve1d(rows, kernel, axis=1, mode='reflect')
+
+
+def timed(func, *args, **kwargs):
+    """Return the wall-clock time and the result of func(*args, **kwargs)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+
+    return time.perf_counter() - start, result
+
+
+if __name__ == '__main__':
+    cases = (((1920, 2560), 'mean', (51, 251, 501)),
+             ((1920, 2560), 'gaussian', (51, 251)),
+             ((480, 640), 'median', (51, 101)))
+
+    for shape, method, block_sizes in cases:
+        grey = enhance_contrast(to_grey(lung_rgb(shape), dtype=np.float64))
+        for block_size in block_sizes:
+            t_old, old = timed(threshold_local, grey, block_size, method=method)
+            t_new, new = timed(local_threshold, grey, block_size, method=method)
+            assert np.array_equal(grey > old, grey > new)
+
+            line = f"{shape[1]}x{shape[0]} {method} block {block_size}: threshold_local {t_old:.2f} s, fast {t_new:.2f} s"
+            if method == 'mean':
+                t_conv, _ = timed(convolve_mean, grey, block_size)
+                line += f", convolution {t_conv:.2f} s"
+            print(line)
@@ -0,0 +1,221 @@
+"""Benchmark suite - every pipeline stage, with a history of the results
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Times every stage of processing.process_img (reading the image as gray, contrast enhancement,
+threshold surface, thresholding with the surface, morphology and labeling - separately and in one
+step, as process_img runs them) and every measurement in measure.py on synthetic lung images
+of 1, 5, 20 and 100 megapixels, and records the peak memory of each. The images are generated
+deterministically (synthetic.py) and saved as TIFFs in --data, so they are made once and the
+same images are measured by every run. The default --data folder and history file are ignored by git.
+
+Every run is appended as one line of JSON to the history file and compared with the last run
+on the same machine (platform, processor, number of cores, Python and NumPy versions) with the
+same settings. A stage that became more than --tolerance slower, or uses that much more memory,
+is reported as a regression, and --check exits with an error code so it can be used in CI.
+
+    python benchmarks/suite.py --sizes 1,5 --check
+
+Times are the best of --repeat runs. Peak memory is the largest amount of memory allocated
+during a separate run traced by tracemalloc (tracing slows the code down, so it is not timed).
+The 100 megapixel images need about 8 GB of memory.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import tifffile
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'autolung'))
+
+from load_config import load_settings
+from processing import (convert_to_grey, enhance_contrast, threshold_surface, binarize, fill_holes, label_image,
+                        fill_and_label)
+from measure import airspace_properties, mli, expansion, d_indeces, object_table, measure_all
+from synthetic import lung_rgb
+
+
+SIZES_MP = (1, 5, 20, 100)
+HISTORY = ROOT / 'benchmarks' / 'history.jsonl'
+CONFIG = ROOT / 'docs' / 'settings_files' / '10X_2560x1920_general.ini'
+# differences below these are noise, never regressions
+MIN_SECONDS = 0.005
+MIN_MB = 1.0
+
+
+def image_shape(megapixels):
+    """Return the (rows, columns) of a 4:3 image of about megapixels million pixels"""
+    rows = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+
+    return rows, int(round(rows * 4 / 3))
+
+
+def synthetic_image(megapixels, data_dir):
+    """Return the path of the synthetic TIFF of a size, generating it on first use"""
+    rows, cols = image_shape(megapixels)
+    img = Path(data_dir) / f"lung_{cols}x{rows}.tif"
+    if not img.exists():
+        print(f"Generating {img.name}...")
+        tmp = img.with_name(img.name + ".tmp")
+        tifffile.imwrite(str(tmp), lung_rgb((rows, cols)))
+        os.replace(str(tmp), str(img))
+
+    return img
+
+
+def pipeline(img, **settings):
+    """Return the stages of the pipeline as (name, function of the earlier results) in the order they run"""
+    return [("convert_to_grey", lambda r: convert_to_grey(img, **settings)),
+            ("enhance_contrast", lambda r: enhance_contrast(r["convert_to_grey"], **settings)),
+            ("threshold_surface", lambda r: threshold_surface(r["enhance_contrast"], **settings)),
+            ("binarize", lambda r: binarize(r["enhance_contrast"], r["threshold_surface"], **settings)),
+            ("fill_holes", lambda r: fill_holes(r["binarize"], **settings)),
+            ("label_image", lambda r: label_image(r["fill_holes"])),
+            ("fill_and_label", lambda r: fill_and_label(r["binarize"], **settings)),
+            ("airspace_properties", lambda r: airspace_properties(r["label_image"])),
+            ("mli", lambda r: mli(r["label_image"], settings['mli_directions'], settings['mli_spacing'])),
+            ("expansion", lambda r: expansion(r["label_image"], r["airspace_properties"])),
+            ("d_indeces", lambda r: d_indeces(r["airspace_properties"].dias)),
+            ("object_table", lambda r: object_table(r["label_image"], r["airspace_properties"], **settings)),
+            ("measure_all", lambda r: measure_all(r["label_image"], r["airspace_properties"], **settings))]
+
+
+def run_stage(func, results, repeat):
+    """Return the best wall-clock time (s), the peak traced memory (MB) and the result of func(results)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(results)
+        times.append(time.perf_counter() - start)
+        del result
+
+    tracemalloc.start()
+    result = func(results)
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    return min(times), peak, result
+
+
+def run_suite(sizes, data_dir, repeat, **settings):
+    """Run every stage on the image of every size
+
+    Returns:
+        dict -- {"<size>MP/<stage>": {"seconds": best time, "peak_mb": peak memory}}
+    """
+    timings = {}
+    for mp in sizes:
+        img = synthetic_image(mp, data_dir)
+        results = {}
+        for name, func in pipeline(img, **settings):
+            seconds, peak, results[name] = run_stage(func, results, repeat)
+            timings[f"{mp}MP/{name}"] = {"seconds": round(seconds, 6), "peak_mb": round(peak, 2)}
+            print(f"{mp:>4} MP  {name:<20} {seconds:9.4f} s  {peak:9.1f} MB")
+
+    return timings
+
+
+def machine():
+    """Return what identifies the machine (and software) results are comparable on"""
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__}
+
+
+def git_commit():
+    """Return the current git commit of the repository, None outside a git checkout"""
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT), stdout=subprocess.PIPE,
+                             stderr=subprocess.DEVNULL, universal_newlines=True)
+    except OSError:
+        return None
+
+    return out.stdout.strip() or None
+
+
+def read_history(path):
+    """Return the runs saved in a history file, oldest first"""
+    if not Path(path).exists():
+        return []
+    with open(str(path)) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(previous, current, tolerance):
+    """Compare two runs stage by stage
+
+    Arguments:
+        previous {dict} -- timings of the earlier run
+        current {dict} -- timings of this run
+        tolerance {float} -- relative increase reported as a regression, e.g. 0.1 for 10 %
+
+    Returns:
+        list -- description of every regression
+    """
+    regressions = []
+    for key, now in current.items():
+        before = previous.get(key)
+        if before is None:
+            continue
+        for field, unit, floor in (("seconds", "s", MIN_SECONDS), ("peak_mb", "MB", MIN_MB)):
+            if now[field] > before[field] * (1 + tolerance) and now[field] - before[field] > floor:
+                regressions.append(f"{key}: {before[field]:.4g} {unit} -> {now[field]:.4g} {unit} "
+                                   f"(+{(now[field] / max(before[field], 1e-12) - 1) * 100:.0f}%)")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the autolung pipeline")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in SIZES_MP),
+                        help="image sizes in megapixels, separated by commas (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of every stage (default: %(default)s)")
+    parser.add_argument("--config", default=str(CONFIG), help="settings file (default: the 10X settings file)")
+    parser.add_argument("--data", default=str(ROOT / 'benchmarks' / 'data'),
+                        help="folder the synthetic images are kept in (default: %(default)s)")
+    parser.add_argument("--history", default=str(HISTORY), help="results history, JSON lines (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slow down (or memory increase) reported as a regression (default: %(default)s)")
+    parser.add_argument("--no-save", action="store_true", help="do not add this run to the history")
+    parser.add_argument("--check", action="store_true", help="exit with code 1 if any stage regressed")
+    args = parser.parse_args(argv)
+    # deprecation warnings of newer library versions would drown the results
+    warnings.simplefilter("ignore", FutureWarning)
+
+    sizes = [float(s) if '.' in s else int(s) for s in args.sizes.split(',') if s.strip()]
+    settings = load_settings(args.config)
+    Path(args.data).mkdir(parents=True, exist_ok=True)
+
+    run = {"date": datetime.now().isoformat(timespec='seconds'), "commit": git_commit(), "machine": machine(),
+           "settings": Path(args.config).name, "repeat": args.repeat,
+           "results": run_suite(sizes, args.data, args.repeat, **settings)}
+
+    earlier = [r for r in read_history(args.history)
+               if r["machine"] == run["machine"] and r["settings"] == run["settings"]]
+    regressions = []
+    if earlier:
+        print(f"\nCompared with {earlier[-1]['date']} (commit {earlier[-1]['commit']}):")
+        regressions = compare(earlier[-1]["results"], run["results"], args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        if not regressions:
+            print("no regressions")
+
+    if not args.no_save:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run) + "\n")
+
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Synthetic lung images for benchmarks
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Generates deterministic, lung-like test images offline. Airspaces are the cells of a jittered
+Voronoi tessellation and the septa between them are drawn as tissue, so the images have the
+same structure (thousands of bright airspaces separated by thin dark walls) as real fields.
+"""
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.measure import label
+
+
+def airspace_mask(shape, seed=0, cell_size=60, wall=3):
+    """Return a binary mask of airspaces (True) and tissue (False)
+
+    Arguments:
+        shape {tuple} -- (rows, columns) of the image
+
+    Keyword Arguments:
+        seed {int} -- random seed (default: {0})
+        cell_size {int} -- approximate airspace diameter in pixels (default: {60})
+        wall {int} -- thickness of the septa in pixels (default: {3})
+
+    Returns:
+        ndarray -- boolean airspace mask
+    """
+    rng = np.random.default_rng(seed)
+    rows, cols = shape
+    grid_rows = rows // cell_size + 3
+    grid_cols = cols // cell_size + 3
+
+    # one seed point per grid cell, jittered inside the cell
+    seed_r = (np.arange(grid_rows)[:, None] - 1 + rng.random((grid_rows, grid_cols))) * cell_size
+    seed_c = (np.arange(grid_cols)[None, :] - 1 + rng.random((grid_rows, grid_cols))) * cell_size
+
+    cells = np.empty(shape, dtype=np.int32)
+    c = np.arange(cols)
+    gc = c // cell_size + 1
+    for r in range(rows):
+        gr = r // cell_size + 1
+        best = np.full(cols, np.inf)
+        for dr in (-1, 0, 1):
+            for dc in (-1, 0, 1):
+                sr = seed_r[gr + dr, gc + dc]
+                sc = seed_c[gr + dr, gc + dc]
+                d = (sr - r) ** 2 + (sc - c) ** 2
+                closer = d < best
+                best[closer] = d[closer]
+                cells[r, closer] = ((gr + dr) * grid_cols + gc + dc)[closer]
+
+    walls = np.zeros(shape, dtype=bool)
+    walls[:-1] |= cells[:-1] != cells[1:]
+    walls[:, :-1] |= cells[:, :-1] != cells[:, 1:]
+    if wall > 1:
+        walls = ndi.binary_dilation(walls, iterations=wall // 2)
+
+    # small tissue specks inside the airspaces and small gaps in the walls
+    specks = rng.random(shape) < 0.0005
+    walls |= ndi.binary_dilation(specks, iterations=2)
+    walls &= rng.random(shape) > 0.002
+
+    return ~walls
+
+
+def lung_rgb(shape, seed=0, **kwargs):
+    """Return a lung-like RGB image (white airspaces, pink tissue)
+
+    Arguments:
+        shape {tuple} -- (rows, columns) of the image
+
+    Keyword Arguments:
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        ndarray -- uint8 RGB image
+    """
+    mask = airspace_mask(shape, seed, **kwargs)
+    rng = np.random.default_rng(seed + 1)
+
+    tissue = np.array([190, 110, 170], dtype=np.float32)
+    air = np.array([238, 236, 240], dtype=np.float32)
+    rgb = np.where(mask[..., None], air, tissue)
+    rgb += rng.normal(0, 8, size=shape).astype(np.float32)[..., None]
+
+    return np.clip(rgb, 0, 255).astype(np.uint8)
+
+
+def lung_labels(shape, seed=0, **kwargs):
+    """Return a labelled airspace image like the one produced by processing.label_image
+
+    Arguments:
+        shape {tuple} -- (rows, columns) of the image
+
+    Keyword Arguments:
+        seed {int} -- random seed (default: {0})
+
+    Returns:
+        ndarray -- labelled image
+    """
+    return label(airspace_mask(shape, seed, **kwargs))
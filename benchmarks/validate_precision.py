@@ -0,0 +1,73 @@
+"""Validate the float32 pre-processing path against float64
+
+(c) 2019 Gennaro Calendo, Laboratory of Marla R. Wolfson, MS, PhD at Lewis Katz School of Medicine at Temple University
+
+Runs process_img and measure_all on synthetic lung images with Precision = float64 and
+Precision = float32, and reports the relative difference of every measurement, the run time
+and the peak memory allocated by numpy (traced by tracemalloc) for both modes. Exits with an
+error when any measurement differs by more than TOLERANCE.
+
+    python benchmarks/validate_precision.py
+"""
+import io
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import tifffile
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
+
+from processing import process_img
+from measure import measure_all
+from synthetic import lung_rgb
+
+
+# largest accepted relative difference of any measurement between float32 and float64
+TOLERANCE = 1e-3
+
+PARAMS = {"scale": 2.0969, "block_size": 251, "constant": 0, "min_alv_size": 500, "max_speckle_size": 100,
+          "mli_directions": (0,), "mli_spacing": 1, "grey_channel": "luminance"}
+
+
+def run(img, precision, method):
+    """Process and measure an image, returning (time, peak MB, measurements)"""
+    params = {**PARAMS, "precision": precision, "method": method}
+
+    with redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        start = time.perf_counter()
+        measurements = measure_all(process_img(img, "No", **params), **params)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        process_img(img, "No", **params)
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+    return elapsed, peak, measurements
+
+
+if __name__ == '__main__':
+    worst = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        for seed in range(3):
+            img = str(Path(tmp) / f"lung_{seed}.tif")
+            tifffile.imwrite(img, lung_rgb((1920, 2560), seed=seed))
+
+            for method in ('mean', 'gaussian'):
+                t64, m64, ref = run(img, 'float64', method)
+                t32, m32, res = run(img, 'float32', method)
+                diffs = {k: abs(res[k] - ref[k]) / abs(ref[k]) if ref[k] else abs(res[k]) for k in ref}
+                key = max(diffs, key=diffs.get)
+                worst = max(worst, diffs[key])
+
+                print(f"seed {seed} {method:8}: float64 {t64:.2f} s / {m64:.0f} MB, "
+                      f"float32 {t32:.2f} s / {m32:.0f} MB, largest difference {diffs[key]:.2e} ({key})")
+
+    print(f"Largest relative difference {worst:.2e} (tolerance {TOLERANCE:.0e})")
+    sys.exit(0 if worst <= TOLERANCE else 1)
@@ -0,0 +1,8 @@
+"""
+the autolung modules import each other by name (app.py is run as a script from the autolung folder),
+so that folder has to be importable for the tests as well
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'autolung'))
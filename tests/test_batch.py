@@ -0,0 +1,37 @@
+"""
+unit tests for the batch processing engine
+"""
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import autolung.batch as batch
+
+
+def crash_on_second(img, preview, grey=None, **kwargs):
+    if Path(img).name == "img_1.tif":
+        # the worker process dies, e.g. killed for running out of memory
+        os._exit(1)
+    # still running when the other worker dies
+    time.sleep(0.3)
+    return {"FileName": Path(img).name}, None
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="the workers must inherit the patched function")
+def test_dead_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "process_one", crash_on_second)
+    images = []
+    for i in range(6):
+        images.append(tmp_path / f"img_{i}.tif")
+        images[-1].write_bytes(b"")
+
+    done = []
+    results = batch.run_batch(images, "No", workers=2, on_result=lambda n, r: done.append(n), prefetch=0)
+    assert [r.index for r in results] == list(range(6))
+    assert sorted(done) == list(range(1, 7))
+    assert results[1].data is None and "BrokenProcessPool" in results[1].error
+    for i in (0, 2, 3, 4, 5):
+        assert results[i].error is None and results[i].data == {"FileName": f"img_{i}.tif"}
@@ -0,0 +1,54 @@
+"""
+unit tests for the processing stage cache
+"""
+import numpy as np
+import tifffile
+from scipy import ndimage as ndi
+from autolung.processing import process_img
+
+
+rng = np.random.default_rng(0)
+rgb = (ndi.gaussian_filter(rng.random((120, 160, 3)), (2, 2, 0)) * 255).astype(np.uint8)
+params = {"block_size": 21, "constant": 0, "method": "mean", "min_alv_size": 25, "max_speckle_size": 15}
+
+
+def loaded(capsys):
+    return [line.split()[1] for line in capsys.readouterr().out.splitlines() if line.endswith("from cache")]
+
+
+def test_resume(tmp_path, capsys):
+    img = tmp_path / "img.tif"
+    tifffile.imwrite(str(img), rgb)
+    cached = {**params, "cache_dir": str(tmp_path / "cache")}
+
+    labeled = process_img(img, "No", **cached)
+    assert loaded(capsys) == []
+    assert len(list((tmp_path / "cache").glob("*.npz"))) == 4
+
+    # nothing changed - only the labeled image is loaded
+    assert np.array_equal(process_img(img, "No", **cached), labeled)
+    assert loaded(capsys) == ["labeled"]
+
+    # morphology changed - resume from the binary image
+    changed = {**cached, "min_alv_size": 40}
+    assert np.array_equal(process_img(img, "No", **changed), process_img(img, "No", **{**params, "min_alv_size": 40}))
+    assert loaded(capsys) == ["binary"]
+
+    # constant changed - only compare the contrast enhanced image with the threshold surface
+    changed = {**cached, "constant": 0.01}
+    assert np.array_equal(process_img(img, "No", **changed), process_img(img, "No", **{**params, "constant": 0.01}))
+    assert loaded(capsys) == ["grey", "surface"]
+
+    # threshold surface changed - resume from the contrast enhanced image
+    process_img(img, "No", **{**cached, "block_size": 31})
+    assert loaded(capsys) == ["grey"]
+
+
+def test_size_limit(tmp_path, capsys):
+    img = tmp_path / "img.tif"
+    tifffile.imwrite(str(img), rgb)
+    # too small for all four stages
+    process_img(img, "No", **params, cache_dir=str(tmp_path / "cache"), cache_size_mb=0.005)
+    files = list((tmp_path / "cache").glob("*"))
+    assert 0 < len(files) < 4
+    assert sum(f.stat().st_size for f in files) <= 0.005 * 1024**2
@@ -0,0 +1,108 @@
+"""
+unit tests for the command line interface
+
+progress events are written to stdout as JSON lines, every other message to stderr
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import tifffile
+from scipy import ndimage as ndi
+
+from autolung.cli import main, EXIT_OK, EXIT_IMAGES_FAILED, EXIT_USAGE, EXIT_NO_RESULTS
+
+
+CONFIG = Path("docs/settings_files/10X_2560x1920_general.ini")
+
+
+def study(tmp_path, n=2):
+    """Write a folder of small synthetic images, a config file and an output folder"""
+    images = tmp_path / "images"
+    images.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(n):
+        grey = (ndi.gaussian_filter(rng.random((120, 160)), 2) * 255 * 4 - 400).clip(0, 255).astype(np.uint8)
+        tifffile.imwrite(str(images / f"A{i}_L1_0.tif"), np.repeat(grey[..., None], 3, axis=2))
+    config = tmp_path / "settings.ini"
+    config.write_text(CONFIG.read_text().replace("Formats: excel", "Formats: csv"))
+    out = tmp_path / "out"
+    out.mkdir()
+
+    return images, config, out
+
+
+def run(capsys, images, config, out):
+    """Run the cli, return the exit code, the progress events and the messages written to stderr"""
+    code = main(["run", "--images", str(images), "--config", str(config), "--out", str(out)])
+    captured = capsys.readouterr()
+    events = [json.loads(line) for line in captured.out.splitlines()]
+
+    return code, events, captured.err
+
+
+def test_run(tmp_path, capsys):
+    images, config, out = study(tmp_path)
+    code, events, err = run(capsys, images, config, out)
+
+    assert code == EXIT_OK
+    assert [e["event"] for e in events] == ["start", "image", "image", "finish"]
+    assert events[0]["images"] == 2
+    assert all(e["status"] == "ok" for e in events[1:3])
+    assert events[-1]["processed"] == 2 and events[-1]["failed"] == 0
+    assert Path(events[-1]["output"]).is_file()
+    # the profile is named after the results file of the run
+    results, = out.glob("Lung_Data_*.jsonl")
+    assert Path(events[-1]["profile"]).name == f"{results.stem}_profile.json"
+    # pipeline messages never end up between the events
+    assert "Processing image" in err
+
+
+def test_run_incremental_objects(tmp_path, capsys):
+    images, config, out = study(tmp_path)
+    objects_config = tmp_path / "objects.ini"
+    objects_config.write_text(config.read_text().replace("Objects: no", "Objects: yes"))
+
+    def started(config):
+        code = main(["run", "--images", str(images), "--config", str(config), "--out", str(out), "--incremental"])
+        assert code == EXIT_OK
+        return json.loads(capsys.readouterr().out.splitlines()[0])
+
+    assert started(config)["images"] == 2
+    # Objects does not change the results, only the images without an airspace table are processed again
+    (images / "A2_L1_0.tif").write_bytes((images / "A0_L1_0.tif").read_bytes())
+    assert started(objects_config)["images"] == 3
+    assert len(list((out / "autolung_objects").glob("image=*/part-0.parquet"))) == 3
+    assert started(objects_config)["images"] == 0
+    assert started(config)["images"] == 0
+
+
+def test_run_corrupt_image(tmp_path, capsys):
+    images, config, out = study(tmp_path)
+    (images / "A9_L1_0.tif").write_bytes(b"not a tiff")
+    code, events, err = run(capsys, images, config, out)
+
+    assert code == EXIT_IMAGES_FAILED
+    errors = [e for e in events if e["event"] == "image" and e["status"] == "error"]
+    assert [Path(e["image"]).name for e in errors] == ["A9_L1_0.tif"]
+    assert events[-1]["event"] == "finish"
+    assert events[-1]["processed"] == 2 and events[-1]["failed"] == 1
+    assert "Traceback" in err
+
+
+def test_run_missing_config(tmp_path, capsys):
+    images, config, out = study(tmp_path)
+    code, events, _ = run(capsys, images, tmp_path / "missing.ini", out)
+
+    assert code == EXIT_USAGE
+    assert [e["event"] for e in events] == ["error"]
+    assert "--config" in events[0]["message"]
+
+
+def test_run_empty_folder(tmp_path, capsys):
+    images, config, out = study(tmp_path, n=0)
+    code, events, _ = run(capsys, images, config, out)
+
+    assert code == EXIT_NO_RESULTS
+    assert [e["event"] for e in events] == ["start", "error"]
+    assert events[0]["images"] == 0
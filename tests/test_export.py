@@ -0,0 +1,65 @@
+"""
+unit tests for the output files
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from autolung.export import write_output, group_and_summarize, ObjectsWriter, read_objects, RAW_COLUMNS, GROUPED_COLUMNS
+
+
+def image_data(name, lm):
+    data = {col: 1.0 for col in RAW_COLUMNS}
+    animal, location, num = name.split("-")
+    data.update({"FileName": f"{name}.tif", "Animal_id": animal, "Location": location, "Img_num": int(num),
+                 "Species": "mouse", "Magnification": "10X", "Fixed_Field": "2560x1920", "Lm(um)": lm})
+    return data
+
+
+def test_columnar_formats(tmp_path):
+    pytest.importorskip("pyarrow")
+    data = [image_data("A1-L-2", 40.0), image_data("A1-L-1", 42.0), image_data("B2-R-1", 30.0)]
+    files = write_output(data, str(tmp_path), formats=("parquet", "csv"))
+    assert [f.rpartition("_")[2] for f in files] == ["raw.parquet", "grouped.parquet", "summary.parquet",
+                                                     "raw.csv", "grouped.csv", "summary.csv"]
+
+    raw = pd.read_parquet(files[0])
+    assert list(raw.columns) == RAW_COLUMNS
+    assert list(raw["FileName"]) == ["A1-L-1.tif", "A1-L-2.tif", "B2-R-1.tif"]
+    assert raw["Lm(um)"].dtype == "float64"
+
+    grouped = pd.read_csv(files[4])
+    assert list(grouped.columns) == GROUPED_COLUMNS
+    assert list(grouped["Lm(um)"]) == [41.0, 30.0]
+
+
+def test_summary():
+    data = [image_data("A1-L-1", 40.0), image_data("A1-L-2", 46.0), image_data("A1-L-3", 43.0), image_data("B2-R-1", 30.0)]
+    data[0]["Obj_Num"], data[1]["Obj_Num"], data[2]["Obj_Num"] = 100, 50, 50
+    raw, grouped, summary = group_and_summarize(data)
+
+    a1 = summary.iloc[0]
+    assert a1["Animal_id"] == "A1" and a1["Lm(um)_n"] == 3
+    assert a1["Lm(um)_mean"] == pytest.approx(43.0)
+    assert a1["Lm(um)_sd"] == pytest.approx(3.0)
+    assert a1["Lm(um)_sem"] == pytest.approx(3.0 / 3 ** 0.5)
+    assert a1["Lm(um)_median"] == pytest.approx(43.0)
+    assert a1["Lm(um)_weighted"] == pytest.approx((40 * 100 + 46 * 50 + 43 * 50) / 200)
+    assert summary.iloc[1]["Lm(um)_n"] == 1 and np.isnan(summary.iloc[1]["Lm(um)_sd"])
+    assert list(grouped["Img_num"]) == [2.0, 1.0]
+
+
+def test_objects_dataset(tmp_path):
+    root = tmp_path / "images"
+    table = np.zeros(2, dtype=[("Label", np.int32), ("Area(sq_um)", np.float64)])
+    writer = ObjectsWriter(tmp_path / "objects", root=str(root))
+    # same file name in two folders, and a name that needs quoting
+    for i, name in enumerate(("a/img 1.tif", "b/img 1.tif", "b/A.L%1.tif")):
+        table["Label"] = [1 + i, 2 + i]
+        writer.append(root / name, table)
+    writer.append(root / "a/img 1.tif", table)
+
+    objects = read_objects(tmp_path / "objects")
+    assert sorted(objects["image"].unique()) == ["a/img 1.tif", "b/A.L%1.tif", "b/img 1.tif"]
+    assert list(objects.loc[objects["image"] == "b/img 1.tif", "Label"]) == [2, 3]
+    # processing an image again replaces its table
+    assert list(objects.loc[objects["image"] == "a/img 1.tif", "Label"]) == [3, 4]
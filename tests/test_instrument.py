@@ -0,0 +1,52 @@
+"""
+unit tests for the stage timing and profile
+"""
+import json
+
+from pathlib import Path
+
+import numpy as np
+from autolung.instrument import Stage, Profile, timed, drain
+
+
+def test_stages_and_profile(tmp_path):
+    drain()
+    image = np.zeros((100, 200))
+    assert timed("clahe", "dir/a.tif", np.add, image, 1).shape == (100, 200)
+    with Stage("grey", "dir/a.tif") as s:
+        s.pixels = image.size
+    with Stage("export"):
+        pass
+
+    events = drain()
+    assert [e.stage for e in events] == ["clahe", "grey", "export"]
+    assert Path(events[0].image) == Path("dir/a.tif") and events[0].pixels == 20000 and events[2].image is None
+    assert all(e.seconds >= 0 for e in events)
+    assert drain() == []
+
+    profile = Profile(root="dir")
+    profile.add(events)
+    profile.add(None)
+    assert [e.image for e in profile.events] == ["a.tif", "a.tif", None]
+    summary = profile.summary()
+    # in STAGES order, not the order they were recorded
+    assert [r["stage"] for r in summary] == ["grey", "clahe", "export"]
+    assert abs(sum(r["share"] for r in summary) - 1) < 1e-9
+    assert "clahe" in profile.table()
+
+    path = profile.write(tmp_path, "Lung_Data_20190101-120000")
+    assert path.name == "Lung_Data_20190101-120000_profile.json"
+    report = json.loads(path.read_text())
+    assert len(report["events"]) == 3 and report["summary"][0]["stage"] == "grey"
+
+
+def test_profile_image_keys(tmp_path):
+    drain()
+    for img in ("animal_1/a.tif", "animal_2/a.tif"):
+        with Stage("grey", tmp_path / img):
+            pass
+
+    # images of the same name in different subfolders are kept apart
+    profile = Profile(root=tmp_path)
+    profile.add(drain())
+    assert [e.image for e in profile.events] == ["animal_1/a.tif", "animal_2/a.tif"]
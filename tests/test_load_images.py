@@ -0,0 +1,103 @@
+"""
+unit tests for reading images as grayscale
+"""
+import numpy as np
+import tifffile
+from skimage.color import rgb2gray
+import json
+import threading
+
+from autolung.load_images import read_grey, open_image, open_region, image_shape, Prefetcher, collect
+
+
+rng = np.random.default_rng(0)
+rgb = rng.integers(0, 256, (70, 90, 3), dtype=np.uint8)
+
+
+def test_luminance(tmp_path):
+    for compression in (None, 'zlib'):
+        img = tmp_path / f"{compression}.tif"
+        tifffile.imwrite(str(img), rgb, compression=compression)
+        grey = read_grey(img)
+        assert grey.dtype == np.float32
+        assert np.allclose(grey, rgb2gray(rgb), atol=1e-6)
+        assert np.allclose(read_grey(img, dtype=np.float64), rgb2gray(rgb))
+        assert image_shape(img) == (70, 90)
+        # compressed images are decoded in memory, to a temporary file only for tiled processing
+        assert isinstance(open_image(img), np.memmap) == (compression is None)
+        assert isinstance(open_image(img, scratch=True), np.memmap)
+
+
+def test_channel_and_region(tmp_path):
+    img = tmp_path / "rgb.tif"
+    tifffile.imwrite(str(img), rgb)
+    region = (slice(10, 30), slice(5, 80))
+    assert np.array_equal(read_grey(img, channel='green', dtype=np.uint8), rgb[..., 1])
+    assert np.array_equal(read_grey(img, channel='red', region=region, dtype=np.uint16), rgb[region + (0,)].astype(np.uint16) * 257)
+    assert np.allclose(read_grey(img, region=region), rgb2gray(rgb[region]), atol=1e-6)
+
+
+def test_compressed_region(tmp_path):
+    region = (slice(10, 40), slice(20, 60))
+    for layout in ({"tile": (32, 32)}, {"rowsperstrip": 16}):
+        img = tmp_path / "compressed.tif"
+        tifffile.imwrite(str(img), rgb, compression='zlib', **layout)
+        assert np.array_equal(open_region(img, region), rgb[region])
+        assert np.array_equal(open_region(img, (slice(None), slice(50, None))), rgb[:, 50:])
+
+        # only the strips or tiles overlapping the region are decoded - a broken last one is never read
+        with tifffile.TiffFile(str(img)) as tif:
+            offset, count = tif.pages[0].dataoffsets[-1], tif.pages[0].databytecounts[-1]
+        with open(str(img), 'r+b') as f:
+            f.seek(offset)
+            f.write(b"\0" * count)
+        assert np.allclose(read_grey(img, region=region), rgb2gray(rgb[region]), atol=1e-6)
+
+
+def test_prefetcher():
+    started = []
+    lock = threading.Lock()
+
+    def load(i):
+        with lock:
+            started.append(i)
+        if i == 3:
+            raise IOError("unreadable")
+        return i * 10
+
+    images = list(range(8))
+    for depth, max_bytes in ((0, 0), (2, 100), (3, 1)):
+        started.clear()
+        seen = []
+        for img, data in Prefetcher(images, load, size=lambda i: 1, depth=depth, max_bytes=max_bytes):
+            with lock:
+                # never more than depth images (or max_bytes, but at least one) loaded ahead
+                assert max(started, default=-1) <= img + max(1, min(depth, max_bytes))
+            seen.append((img, data))
+        assert [i for i, _ in seen] == images
+        expected = [None] * 8 if depth == 0 else [None if i == 3 else i * 10 for i in images]
+        assert [d for _, d in seen] == expected
+
+
+def test_collect(tmp_path):
+    for name in ("a.tif", "b.TIFF", "notes.txt", "QC/a.jpg", "QC/old.tif", "s1/c.tif", "s1/d_overview.tif",
+                 "controls/e.tif"):
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+
+    def names(images):
+        return [p.relative_to(tmp_path).as_posix() for p in images]
+
+    assert names(collect(tmp_path)) == ["a.tif", "b.TIFF", "controls/e.tif", "s1/c.tif", "s1/d_overview.tif"]
+    assert names(collect(tmp_path, exclude=("*_overview.tif", "controls"))) == ["a.tif", "b.TIFF", "s1/c.tif"]
+    assert names(collect(tmp_path, include=("s1/*",))) == ["s1/c.tif", "s1/d_overview.tif"]
+
+    # the manifest is reused while no folder changes
+    assert len(collect(tmp_path, manifest="images.json")) == 5
+    manifest = json.loads((tmp_path / "images.json").read_text())
+    manifest["images"].append("listed.tif")
+    (tmp_path / "images.json").write_text(json.dumps(manifest))
+    assert "listed.tif" in names(collect(tmp_path, manifest="images.json"))
+    assert len(collect(tmp_path, manifest="images.json", exclude=("controls",))) == 4
+    (tmp_path / "s1" / "new.tif").write_bytes(b"")
+    assert "s1/new.tif" in names(collect(tmp_path, manifest="images.json"))
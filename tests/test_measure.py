@@ -0,0 +1,58 @@
+"""
+unit tests for the single pass airspace measurements
+
+results must match regionprops, which was used to measure every airspace before
+"""
+import numpy as np
+from skimage.measure import label, regionprops
+from autolung.measure import airspace_properties, expansion, object_table
+
+
+# 4-connected labels of random noise - many small objects, some touching diagonally
+rng = np.random.default_rng(0)
+img_noise = label(rng.random((80, 120)) > 0.45, connectivity=1)
+
+def test_matches_regionprops():
+    m = airspace_properties(img_noise)
+    props = regionprops(img_noise)
+
+    assert m.obj_num == len(props)
+    assert np.array_equal(m.areas, [p.area for p in props])
+    assert np.allclose(m.dias, [p.equivalent_diameter for p in props])
+    assert np.allclose(m.pers, [p.perimeter for p in props])
+
+
+# objects touching the image border and an empty label in between
+img_border = np.array([[1, 1, 0, 0, 4],
+                       [1, 1, 0, 0, 4],
+                       [0, 0, 0, 0, 4],
+                       [2, 0, 4, 4, 4]])
+
+def test_border_and_missing_labels():
+    m = airspace_properties(img_border)
+    props = regionprops(img_border)
+
+    assert m.obj_num == 3
+    assert np.array_equal(m.areas, [4, 1, 6])
+    assert np.allclose(m.pers, [p.perimeter for p in props])
+
+
+def test_expansion_reuses_airspaces():
+    m = airspace_properties(img_border)
+
+    assert expansion(img_border, m) == expansion(img_border)
+    assert expansion(img_border).airspace_area == 11
+
+
+def test_object_table_matches_regionprops():
+    labeled = label(np.random.default_rng(3).random((120, 90)) > 0.6)
+    table = object_table(labeled, scale=2.0, tile_size=32)
+
+    props = regionprops(labeled)
+    assert list(table["Label"]) == [p.label for p in props]
+    assert np.allclose(table["Area(sq_um)"], [p.area / 4 for p in props])
+    assert np.allclose(table["Perimeter(um)"], [p.perimeter / 2 for p in props])
+    assert np.allclose(table["Centroid_Row(px)"], [p.centroid[0] for p in props], atol=1e-4)
+    assert np.allclose(table["Centroid_Col(px)"], [p.centroid[1] for p in props], atol=1e-4)
+    bbox = np.stack([table[f] for f in ("Min_Row(px)", "Min_Col(px)", "Max_Row(px)", "Max_Col(px)")], axis=1)
+    assert (bbox == [p.bbox for p in props]).all()
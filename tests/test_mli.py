@@ -37,3 +37,42 @@ def test_3():
     assert mli(img_scattered) == np.mean([[2,4,1,6,2,3,1,2,2]])
 
 
+
+
+# image without any airspace - there is nothing to measure
+img_empty = np.zeros((10, 10))
+def test_4():
+    assert np.isnan(mli(img_empty))
+
+
+# labelled image - intercepts are counted on every non-zero label, identical to the per-row scan
+rng = np.random.default_rng(0)
+img_labels = (rng.random((50, 70)) > 0.4) * rng.integers(1, 5, (50, 70))
+def test_5():
+    intercepts = []
+    for row in img_labels > 0:
+        result = np.diff(np.where(np.concatenate(([row[0]], row[:-1] != row[1:], [True])))[0])[::2]
+        intercepts.extend(result)
+    assert mli(img_labels) == np.mean(intercepts)
+
+
+# vertical test lines measure the columns - same as measuring the rows of the transposed image
+def test_vertical():
+    assert mli(img_scattered, directions=(90,)) == mli(img_scattered.T)
+
+
+# a diagonal stripe of airspace: 135 degree lines run along it, 45 degree lines cross it
+img_diagonal = np.eye(6) + np.eye(6, k=1)
+def test_diagonal():
+    # the diagonals of length 6 and 5 - each pixel step is sqrt(2) long
+    assert np.isclose(mli(img_diagonal, directions=(135,)), 5.5 * np.sqrt(2))
+    # every anti-diagonal crosses the stripe in a single pixel
+    assert np.isclose(mli(img_diagonal, directions=(45,)), np.sqrt(2))
+
+
+# pooled directions and sparse test lines
+def test_directions_and_spacing():
+    assert mli(img_100, directions=(0, 90)) == 100.0
+    assert mli(img_threes, spacing=2) == 3.0
+    # rows 0, 3 of img_scattered -> intercepts [2] (row 3 has none)
+    assert mli(img_scattered, spacing=3) == 2.0
@@ -0,0 +1,38 @@
+"""
+unit tests for the processing steps
+
+fill_and_label must give the same label image as fill_holes followed by label_image
+"""
+import numpy as np
+from scipy import ndimage as ndi
+from autolung.processing import fill_holes, fill_and_label, label_image
+
+
+rng = np.random.default_rng(0)
+
+
+def test_fill_and_label():
+    for _ in range(1500):
+        shape = tuple(rng.integers(1, 40, 2))
+        binary = ndi.gaussian_filter(rng.random(shape), rng.uniform(0, 2)) > rng.uniform(0.3, 0.7)
+        params = {"min_alv_size": int(rng.integers(0, 30)), "max_speckle_size": int(rng.integers(0, 30))}
+        labeled = fill_and_label(binary, **params)
+        assert labeled.dtype == np.int32
+        assert np.array_equal(labeled, label_image(fill_holes(binary, **params))), params
+
+    binary = ndi.gaussian_filter(rng.random((300, 400)), 2) > 0.5
+    params = {"min_alv_size": 25, "max_speckle_size": 15}
+    assert np.array_equal(fill_and_label(binary, **params), label_image(fill_holes(binary, **params)))
+
+
+def test_fill_holes_sizes():
+    # objects and holes of exactly the limit are kept, smaller ones are removed
+    binary = np.zeros((9, 12), dtype=bool)
+    binary[1:3, 1:3] = True                # object of 4 pixels
+    binary[5:8, 1:3] = True                # object of 6 pixels
+    binary[1:8, 5:11] = True
+    binary[2:4, 6:8] = False               # hole of 4 pixels
+    binary[5, 9] = False                   # hole of 1 pixel
+    filled = fill_holes(binary, min_alv_size=6, max_speckle_size=4)
+    assert not filled[1:3, 1:3].any() and filled[5:8, 1:3].all()
+    assert not filled[2:4, 6:8].any() and filled[5, 9]
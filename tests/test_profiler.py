@@ -0,0 +1,50 @@
+"""
+unit tests for profiling selected images
+"""
+import pstats
+import time
+
+from autolung.profiler import should_profile, image_profiler
+
+
+def busy(seconds=0.1):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_should_profile():
+    selected = [i for i in range(7) if should_profile(i, f"d/A{i}_L1.tif", profile_every=3)]
+    assert selected == [0, 3, 6]
+    assert should_profile(5, "d/A5_L1.tif", profile_images=("a5_*",))
+    assert not should_profile(5, "d/A5_L1.tif", profile_every=0, profile_images=())
+
+
+def test_image_profiler(tmp_path):
+    with image_profiler(0, "d/A0_L1.tif", profile_every=1, profile_dir=str(tmp_path)):
+        busy()
+    stats = pstats.Stats(str(tmp_path / "A0_L1.prof"))
+    assert any(func[2] == "busy" for func in stats.stats)
+    assert "busy" in (tmp_path / "A0_L1.txt").read_text()
+
+    with image_profiler(1, "d/A1_L1.tif", profile_images=("A1_*",), profiler="sampling", profile_dir=str(tmp_path)):
+        busy()
+    lines = (tmp_path / "A1_L1.folded").read_text().splitlines()
+    assert lines and all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    # stacks start at the caller of the with block
+    assert all(line.startswith("test_image_profiler") for line in lines)
+    assert any("busy" in line for line in lines)
+
+    with image_profiler(1, "d/A2_L1.tif", profile_every=2, profile_dir=str(tmp_path)):
+        pass
+    assert not (tmp_path / "A2_L1.prof").exists()
+
+
+def test_profile_names(tmp_path):
+    # dots in the name and the same name in two folders
+    for img in ("images/a/A.L.1.tif", "images/b/A.L.1.tif"):
+        with image_profiler(0, tmp_path / img, profile_every=1, profile_dir=str(tmp_path / "out"),
+                            image_dir=str(tmp_path / "images")):
+            busy(0.01)
+    names = sorted(p.name for p in (tmp_path / "out").iterdir())
+    assert names == ["a%2FA.L.1.prof", "a%2FA.L.1.txt", "b%2FA.L.1.prof", "b%2FA.L.1.txt"]
@@ -0,0 +1,59 @@
+"""
+unit tests for the QC images
+"""
+import threading
+
+import numpy as np
+from PIL import Image
+from autolung.qc import downsample, qc_panels, save_qc, QCWriter, LABEL_LUT, TITLE_HEIGHT, GAP
+
+
+def test_downsample_block_means():
+    image = np.random.default_rng(0).random((300, 410))
+    small = downsample(image, 4)
+
+    assert small.shape == (75, 103)
+    assert np.allclose(small[:, :102], image[:, :408].reshape(75, 4, 102, 4).mean(axis=(1, 3)), atol=1e-6)
+    # the last column block is only 2 pixels wide
+    assert np.allclose(small[:, 102], image[:, 408:].reshape(75, 4, 2).mean(axis=(1, 2)), atol=1e-6)
+
+
+def test_save_qc(tmp_path):
+    labeled = np.zeros((200, 400), dtype=np.int32)
+    labeled[50:150, 20:120] = 1
+    labeled[50:150, 200:300] = 300
+    binary = labeled > 0
+    panels = qc_panels(binary.astype(np.float32), binary, binary, labeled, qc_width=256)
+
+    assert [p.shape for p in panels] == [(50, 100, 3)] * 4
+    colours = panels[3]
+    assert (colours[0, 0] == 0).all()
+    assert (colours[25, 10] == LABEL_LUT[1]).all() and (colours[25, 60] == LABEL_LUT[300 % 255]).all()
+
+    saved = save_qc(tmp_path / "A-L-1.tif", panels)
+    assert saved == tmp_path / "QC" / "A-L-1.jpg"
+    assert Image.open(str(saved)).size == (2 * (100 + GAP), 2 * (TITLE_HEIGHT + 50 + GAP))
+
+
+def test_qc_writer_backpressure():
+    writer = QCWriter(max_pending=1)
+    release = threading.Event()
+    saved = []
+
+    def job(n):
+        release.wait()
+        saved.append(n)
+
+    writer.submit(job, 0)
+    writer.submit(job, 1)
+    # the writer is busy with job 0 and job 1 fills the queue - the next submit has to wait
+    blocked = threading.Thread(target=writer.submit, args=(job, 2))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()
+
+    release.set()
+    blocked.join()
+    writer.submit(lambda: 1 / 0)
+    writer.close()
+    assert saved == [0, 1, 2]
@@ -0,0 +1,25 @@
+"""
+unit tests for the streaming results file
+"""
+import numpy as np
+from autolung.sink import ResultsSink, read_sink
+
+
+def test_append_and_resume(tmp_path):
+    sink = ResultsSink.create(tmp_path)
+    sink.append("a.tif", {"Obj_Num": np.int64(3), "Lm(um)": np.float64(41.5)})
+    sink.append("b.tif", {"Obj_Num": 4, "Lm(um)": 40.0})
+    sink.close()
+    assert sink.path.suffix == ".jsonl"
+
+    # killed while writing the third row
+    with open(str(sink.path), 'a') as f:
+        f.write('{"image": "c.tif", "da')
+    assert [row["image"] for row in read_sink(sink.path)] == ["a.tif", "b.tif"]
+
+    resumed = ResultsSink(sink.path)
+    resumed.append("c.tif", {"Obj_Num": 5, "Lm(um)": 39.0})
+    resumed.close()
+    rows = read_sink(sink.path)
+    assert [row["image"] for row in rows] == ["a.tif", "b.tif", "c.tif"]
+    assert rows[0]["data"] == {"Obj_Num": 3, "Lm(um)": 41.5}
@@ -0,0 +1,69 @@
+"""
+unit tests for the incremental results store
+"""
+import os
+
+import autolung.store as store_module
+from autolung.load_images import file_digest
+from autolung.store import ResultsStore, settings_hash
+
+
+def test_pending(tmp_path):
+    images = [tmp_path / f"img_{i}.tif" for i in range(3)]
+    for i, img in enumerate(images):
+        img.write_bytes(bytes([i]) * 100)
+    settings = settings_hash(block_size=251, constant=0, workers=1)
+
+    store = ResultsStore(tmp_path, settings)
+    assert store.pending(images) == images
+    for i, img in enumerate(images[:2]):
+        store.add(img, {"FileName": img.name, "Obj_Num": i})
+    assert store.pending(images) == images[2:]
+
+    # touched but unchanged, then changed
+    st = os.stat(str(images[0]))
+    os.utime(str(images[0]), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert store.pending(images) == images[2:]
+    images[1].write_bytes(b"x" * 100)
+    assert store.pending(images) == images[1:]
+    store.close()
+
+    # reopened with the same settings (worker count and objects output do not matter), then with other settings
+    store = ResultsStore(tmp_path, settings_hash(block_size=251, constant=0, workers=8, export_objects=True))
+    assert store.results(images) == [{"FileName": "img_0.tif", "Obj_Num": 0}, {"FileName": "img_1.tif", "Obj_Num": 1}]
+    store.close()
+    store = ResultsStore(tmp_path, settings_hash(block_size=251, constant=1, workers=1))
+    assert store.pending(images) == images
+    assert store.results(images) == []
+    store.close()
+
+
+def test_digests_reused(tmp_path, monkeypatch):
+    hashed = []
+    monkeypatch.setattr(store_module, "file_digest", lambda img: hashed.append(img) or file_digest(img))
+    images = [tmp_path / f"img_{i}.tif" for i in range(3)]
+    for i, img in enumerate(images):
+        img.write_bytes(bytes([i]) * 100)
+
+    # new images are hashed once, when their results are stored
+    store = ResultsStore(tmp_path, settings_hash(constant=0))
+    for img in store.pending(images):
+        store.add(img, {})
+    assert hashed == images
+    store.close()
+
+    # other settings: the stored digests of the unchanged images are reused
+    hashed.clear()
+    store = ResultsStore(tmp_path, settings_hash(constant=1))
+    for img in store.pending(images):
+        store.add(img, {})
+    assert hashed == []
+
+    # a modified image is hashed by pending only
+    images[1].write_bytes(b"x" * 100)
+    st = os.stat(str(images[1]))
+    os.utime(str(images[1]), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert store.pending(images) == [images[1]]
+    store.add(images[1], {})
+    assert hashed == [images[1]]
+    store.close()
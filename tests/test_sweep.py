@@ -0,0 +1,94 @@
+"""
+unit tests for parameter sweeps
+
+every combination of a sweep must be measured the same as the whole pipeline run with its settings
+"""
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+import tifffile
+from scipy import ndimage as ndi
+
+import autolung.sweep as sweep
+from autolung.load_config import load_settings
+from autolung.processing import convert_to_grey, enhance_contrast, binarize, label_image
+from autolung.tiling import tiled_fill_holes, scratch_array
+from autolung.measure import measure_all
+from autolung.sweep import parse_values, validate_grid, combinations, sweep_image, sweep_tables, run_sweep
+
+
+CONFIG = "docs/settings_files/10X_2560x1920_general.ini"
+
+
+def test_parse_values():
+    assert parse_values("151:351:50") == [151, 201, 251, 301, 351]
+    assert parse_values("0, 0.01,0.02") == [0, 0.01, 0.02]
+    assert parse_values("0:0.03:0.01") == [0, 0.01, 0.02, 0.03]
+    assert parse_values("Mean, gaussian") == ['mean', 'gaussian']
+    with pytest.raises(ValueError):
+        parse_values("1:5:0")
+
+
+def test_validate_grid(capsys):
+    grid = validate_grid({"block_size": [151, 150, 151], "method": ['mean', 'otsu']})
+    assert grid == {"block_size": [151], "method": ['mean']}
+    assert "ERROR" in capsys.readouterr().out
+    with pytest.raises(ValueError):
+        validate_grid({"min_alv_size": [-1]})
+
+
+def test_sweep_image(tmp_path):
+    rgb = (ndi.gaussian_filter(np.random.default_rng(0).random((120, 160)), 2) * 255 * 4 - 400).clip(0, 255)
+    img = tmp_path / "A1_L1_0.tif"
+    tifffile.imwrite(str(img), np.repeat(rgb.astype(np.uint8)[..., None], 3, axis=2))
+
+    params = {**load_settings(CONFIG), "mli_spacing": 10}
+    grid = {"block_size": [21, 41], "constant": [0, 0.01], "min_alv_size": [5, 25], "max_speckle_size": [5, 15]}
+    combos = combinations(grid, **params)
+    assert len(combos) == 16
+    assert all(c["method"] == params["method"] for c in combos)
+
+    rows = sweep_image(str(img), combos, **params)
+    assert [i for i, _ in rows] == list(range(16))
+    enhanced = enhance_contrast(convert_to_grey(str(img), **params), **params)
+    for i, data in rows:
+        settings = {**params, **combos[i]}
+        filled = scratch_array(rgb.shape, bool)
+        tiled_fill_holes(binarize(enhanced, **settings), filled, **{**settings, "tile_size": 1000})
+        for key, value in measure_all(label_image(filled), **settings).items():
+            assert np.isclose(value, data[key], equal_nan=True), (i, key)
+
+    results = run_sweep([str(img)], combos, **params)
+    tables = sweep_tables(results, combos)
+    assert len(tables["results"]) == len(tables["summary"]) == 16
+    assert (tables["summary"]["Block_Size"] == [c["block_size"] for c in combos]).all()
+
+
+def crash_on_second(img, combos, **kwargs):
+    if Path(img).name == "img_1.tif":
+        # the worker process dies, e.g. killed for running out of memory
+        os._exit(1)
+    # still running when the other worker dies
+    time.sleep(0.3)
+    return [(i, {"FileName": Path(img).name}) for i in range(len(combos))]
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason="the workers must inherit the patched function")
+def test_dead_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(sweep, "sweep_image", crash_on_second)
+    images = []
+    for i in range(6):
+        images.append(tmp_path / f"img_{i}.tif")
+        images[-1].write_bytes(b"")
+
+    done = []
+    results = run_sweep(images, [{}, {}], workers=2, on_result=lambda n, r: done.append(n))
+    assert [r.index for r in results] == list(range(6))
+    assert sorted(done) == list(range(1, 7))
+    assert results[1].rows is None and "BrokenProcessPool" in results[1].error
+    for i in (0, 2, 3, 4, 5):
+        assert results[i].error is None and results[i].rows == [(0, {"FileName": f"img_{i}.tif"}), (1, {"FileName": f"img_{i}.tif"})]
@@ -0,0 +1,52 @@
+"""
+unit tests for the fast local thresholds
+
+every method must give the same binary image as skimage's threshold_local
+"""
+import numpy as np
+from scipy import ndimage as ndi
+from skimage.filters import threshold_local
+from autolung.threshold import local_threshold
+from autolung.processing import threshold_surface, binarize
+
+
+rng = np.random.default_rng(0)
+img = ndi.gaussian_filter(rng.random((90, 120)), 1.5)
+
+
+def check(image, block_size, method, offset=0):
+    ref = threshold_local(image, block_size, method=method, offset=offset)
+    thresh = local_threshold(image, block_size, method=method, offset=offset)
+    assert thresh.dtype == ref.dtype
+    assert np.allclose(thresh, ref, rtol=0, atol=1e-6)
+    assert np.array_equal(image > thresh, image > ref)
+
+
+def test_mean():
+    for block_size in (3, 21, 51, 251):
+        check(img, block_size, 'mean')
+    check(img, 21, 'mean', offset=0.01)
+    check(img.astype(np.float32), 51, 'mean')
+
+
+def test_gaussian():
+    for block_size in (21, 51):
+        check(img, block_size, 'gaussian')
+    check(img.astype(np.float32), 21, 'gaussian')
+
+
+def test_median():
+    for block_size in (3, 21):
+        check(img, block_size, 'median')
+    # few grey levels, as in 8-bit images - many ties
+    check(np.round(img * 20) / 20, 21, 'median')
+
+
+def test_surface():
+    # one surface, thresholded with any constant, is the same as thresholding from scratch
+    for engine in ('fast', 'skimage'):
+        params = {"block_size": 21, "method": 'gaussian', "threshold_engine": engine}
+        surface = threshold_surface(img, **params)
+        for constant in (0, 0.005, 0.01, -0.02):
+            assert np.array_equal(binarize(img, surface, constant=constant, **params),
+                                  binarize(img, constant=constant, **params))
@@ -0,0 +1,82 @@
+"""
+unit tests for tiled processing
+
+every tiled step must give the same result as the same step on the whole image
+"""
+import warnings
+
+import numpy as np
+import tifffile
+from scipy import ndimage as ndi
+from skimage.exposure import equalize_adapthist
+from autolung.load_config import load_settings
+from autolung.load_images import to_grey
+from autolung.processing import binarize, fill_holes, label_image, process_img
+from autolung.measure import measure_all
+from autolung.tiling import (tiled_binarize, tiled_fill_holes, tiled_label, tiled_enhance, process_img_tiled,
+                             scratch_array, FULLY_CONNECTED)
+
+
+# smooth random texture - blobs of many sizes, crossing the tile seams
+rng = np.random.default_rng(0)
+img_grey = ndi.gaussian_filter(rng.random((150, 190)), 2)
+params = {"block_size": 21, "constant": 0, "min_alv_size": 25, "max_speckle_size": 15, "scale": 2.0, "tile_size": 40}
+
+
+def test_binarize():
+    for method in ('mean', 'gaussian', 'median'):
+        binary = scratch_array(img_grey.shape, bool)
+        tiled_binarize(img_grey, binary, method=method, **params)
+        assert np.array_equal(binary, binarize(img_grey, method=method, **params))
+
+
+def test_fill_holes_and_label():
+    binary = binarize(img_grey, method='mean', **params)
+    filled = scratch_array(img_grey.shape, bool)
+    tiled_fill_holes(binary, filled, **params)
+    assert np.array_equal(filled, fill_holes(binary, **params))
+
+    labeled = label_image(filled)
+    tiled = scratch_array(img_grey.shape, np.int32)
+    n, sizes = tiled_label(filled, tiled, FULLY_CONNECTED, params['tile_size'])
+    assert n == labeled.max()
+    # same objects, only numbered differently
+    assert len(np.unique(labeled * (n + 1) + tiled)) == n + 1
+    assert np.array_equal(np.sort(sizes[1:]), np.sort(np.bincount(labeled.ravel())[1:]))
+
+    # measured in strips of tile_size rows
+    untiled = measure_all(labeled, **{**params, "tile_size": 0})
+    for key, value in measure_all(tiled, **params).items():
+        assert np.isclose(value, untiled[key])
+
+
+def test_enhance():
+    # pinned to skimage's equalize_adapthist, whose histogram clipping tiling.py reimplements
+    for shape, tile_size, sigma in (((97, 131), 30, 2), ((260, 190), 64, 0.5), ((40, 300), 16, 4)):
+        # image and kernel sizes that are not multiples of the tile size
+        rgb = (ndi.gaussian_filter(rng.random(shape + (3,)), (sigma, sigma, 0)) * 255 * 3 - 200).clip(0, 255)
+        rgb = rgb.astype(np.uint8)
+        for precision in ('float64', 'float32'):
+            grey = to_grey(rgb, None, np.dtype(precision))
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                expected = equalize_adapthist(grey)
+            enhanced = scratch_array(shape, np.dtype(precision))
+            tiled_enhance(rgb, enhanced, precision=precision, tile_size=tile_size)
+            assert np.array_equal(enhanced, expected), (shape, precision)
+
+
+def test_process_img_tiled(tmp_path):
+    rgb = (ndi.gaussian_filter(rng.random((200, 260)), 2) * 255 * 4 - 400).clip(0, 255).astype(np.uint8)
+    img = tmp_path / "A1_L1_0.tif"
+    tifffile.imwrite(str(img), np.repeat(rgb[..., None], 3, axis=2))
+    settings = {**load_settings("docs/settings_files/10X_2560x1920_general.ini"), **params, "mli_spacing": 10}
+
+    labeled = process_img(str(img), "No", **{**settings, "tile_size": 0})
+    tiled = process_img_tiled(str(img), "No", **{**settings, "tile_size": 64})
+    # the same airspaces, labelled in a different order
+    assert np.array_equal(labeled > 0, tiled > 0)
+    assert len(np.unique(labeled.astype(np.int64) * (tiled.max() + 1) + tiled)) == len(np.unique(labeled))
+    untiled = measure_all(labeled, **{**settings, "tile_size": 0})
+    for key, value in measure_all(tiled, **settings).items():
+        assert np.isclose(value, untiled[key], equal_nan=True), key